@@ -0,0 +1,186 @@
+import json
+import time
+import asyncio
+import threading
+from uuid import uuid4
+from typing import Any, Callable, Iterator, AsyncIterator, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# A deterministic, local replacement for ChatOpenAI.
+# It lets us run every graph of the repo offline, so we can measure the overhead of the graph itself
+# (nodes, reducers, checkpointers), without the network and the model latency noise.
+
+# 1. Helpers to write the replies script
+
+def tool_call(name: str, **args) -> AIMessage:
+    """
+    Creates an AIMessage asking for a single tool call.
+
+    Args:
+        name: the name of the tool to be called.
+        args: the arguments of the tool call.
+    """
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid4().hex[:24]}", "type": "tool_call"}])
+
+def react_script(calls: list[tuple[str, dict]], answer: str) -> Callable[[list[BaseMessage]], AIMessage]:
+    """
+    Creates a reply function that behaves like a ReAct agent: it asks for the tool calls when a new question arrives
+    and answers with a text when the last message is a tool result.
+
+    Args:
+        calls: list of (tool name, tool arguments) to be requested in the same turn.
+        answer: the final text answer, given after the tools were executed.
+    """
+    def reply(messages: list[BaseMessage]) -> AIMessage:
+        if messages and isinstance(messages[-1], ToolMessage):
+            return AIMessage(content=answer)
+
+        return AIMessage(content="", tool_calls=[
+            {"name": name, "args": args, "id": f"call_{uuid4().hex[:24]}", "type": "tool_call"} for name, args in calls
+        ])
+
+    return reply
+
+
+ScriptItem = Union[str, AIMessage, Callable[[list[BaseMessage]], Union[str, AIMessage]]]
+
+class ScriptedReplies:
+    """
+    Thread safe cursor over a list of scripted replies.
+    Each item can be a text, an AIMessage or a function that receives the input messages and returns one of them.
+    """
+
+    def __init__(self, script: list[ScriptItem], cycle: bool = True):
+        self.script = list(script) or ["ok"]
+        self.cycle = cycle
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+    def next_reply(self, messages: list[BaseMessage]) -> AIMessage:
+        with self._lock:
+            if self._cursor >= len(self.script):
+                if not self.cycle:
+                    raise IndexError("The fake chat model has no more scripted replies.")
+                self._cursor = 0
+            item = self.script[self._cursor]
+            self._cursor += 1
+
+        if callable(item):
+            item = item(messages)
+        if isinstance(item, str):
+            item = AIMessage(content=item)
+
+        # Each call must produce a brand new message, as the graphs use the message ids to merge the history
+        return AIMessage(
+            content=item.content,
+            tool_calls=item.tool_calls,
+            id=f"run-{uuid4()}",
+            response_metadata={"model_name": "fake-chat-model", "finish_reason": "tool_calls" if item.tool_calls else "stop"}
+        )
+
+
+# 2. The fake chat model
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that answers from a script, simulating the model latency and the token streaming.
+
+    Args:
+        replies: the ScriptedReplies (or a plain list of script items) used to answer.
+        latency: seconds waited before the first token (time to first token).
+        token_latency: seconds waited for each generated token.
+    """
+
+    replies: Any = None
+    latency: float = 0.0
+    token_latency: float = 0.0
+    model_name: str = "fake-chat-model"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not isinstance(self.replies, ScriptedReplies):
+            self.replies = ScriptedReplies(self.replies or ["ok"])
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    @classmethod
+    def factory(cls, replies: Any = None, latency: float = 0.0, token_latency: float = 0.0):
+        """
+        Returns a callable with the ChatOpenAI signature, so it can replace it when a module is imported.
+        All the models created by the factory share the same script.
+        """
+        shared_replies = replies if isinstance(replies, ScriptedReplies) else ScriptedReplies(replies or ["ok"])
+
+        def create(*args, **kwargs):
+            return cls(replies=shared_replies, latency=latency, token_latency=token_latency)
+
+        return create
+
+    def bind_tools(self, tools, **kwargs):
+        # The tools are not needed to answer, but we keep their names in the invocation params, as the real model does
+        return self.bind(tools=[getattr(t, "name", getattr(t, "__name__", str(t))) for t in tools], **kwargs)
+
+    def get_num_tokens(self, text: str) -> int:
+        # Avoids the default tokenizer, which depends on the transformers library
+        return len(text.split())
+
+    @staticmethod
+    def _tokens(message: AIMessage) -> list[str]:
+        return [token + " " for token in str(message.content).split()] or [""]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.replies.next_reply(messages)
+        time.sleep(self.latency + self.token_latency * len(self._tokens(message)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.replies.next_reply(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(self._tokens(message)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        tokens = self._tokens(message)
+        for index, token in enumerate(tokens):
+            tool_call_chunks = []
+            if index == len(tokens) - 1:
+                tool_call_chunks = [
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                    for i, call in enumerate(message.tool_calls)
+                ]
+            yield AIMessageChunk(content=token, id=message.id, tool_call_chunks=tool_call_chunks)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        message = self.replies.next_reply(messages)
+        time.sleep(self.latency)
+        for chunk in self._chunks(message):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        message = self.replies.next_reply(messages)
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(message):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+if __name__ == "__main__":
+    from langchain_core.messages import HumanMessage
+
+    model = FakeChatModel(replies=["Olá, tudo bem?", tool_call("triangle_area", base=4, height=10)], token_latency=0.01)
+
+    model.invoke([HumanMessage(content="Oi!")]).pretty_print()
+    model.invoke([HumanMessage(content="Qual é a área de um triângulo de base 4 e altura 10?")]).pretty_print()
+
+    for chunk in model.stream([HumanMessage(content="Oi de novo!")]):
+        print(chunk.content, end=" | ")
@@ -0,0 +1,292 @@
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+from pathlib import Path
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from fake_chat_model import FakeChatModel, react_script
+
+# Offline benchmark of the graph factories of this repository.
+# Each module is imported with ChatOpenAI replaced by the FakeChatModel, so what we measure is the
+# overhead of the graph runtime, the reducers and the checkpointers, for different conversation lengths.
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+
+# 1. Loading the modules with the fake model
+
+def load_module(relative_path: str, chat_model_factory: Optional[Callable] = None):
+    """
+    Imports a module of the repo by its path, replacing ChatOpenAI by the given factory during the import.
+
+    Args:
+        relative_path: path of the module, relative to the src folder.
+        chat_model_factory: callable used in place of ChatOpenAI. If None, the real model is kept.
+    """
+    import langchain_openai
+
+    path = SRC_DIR / relative_path
+    # The modules import their siblings by name, as they are executed as scripts
+    if str(path.parent) not in sys.path:
+        sys.path.insert(0, str(path.parent))
+
+    original_chat_openai = langchain_openai.ChatOpenAI
+    if chat_model_factory is not None:
+        langchain_openai.ChatOpenAI = chat_model_factory
+
+    try:
+        spec = importlib.util.spec_from_file_location(f"bench_{path.stem}_{uuid.uuid4().hex[:8]}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        langchain_openai.ChatOpenAI = original_chat_openai
+
+    return module
+
+
+# 2. Per node timing, using the callbacks that LangGraph triggers for each node run
+
+class NodeTimer(BaseCallbackHandler):
+    def __init__(self):
+        self.total_seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._started = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # The node runnable has the same name of the node. Inner runnables (e.g. chains inside a node) are skipped.
+        if node and kwargs.get("name") == node:
+            self._started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if started := self._started.pop(run_id, None):
+            node, start = started
+            self.total_seconds[node] += time.perf_counter() - start
+            self.calls[node] += 1
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+    def report(self) -> dict:
+        return {node: {"calls": self.calls[node], "mean_ms": 1000 * self.total_seconds[node] / self.calls[node]}
+                for node in self.total_seconds}
+
+
+# 3. The graphs to be measured
+
+@dataclass
+class GraphTarget:
+    """
+    Describes how to build and drive one graph of the repo.
+
+    Args:
+        name: name shown in the report.
+        module_path: path of the module, relative to the src folder.
+        build: receives the imported module and a temporary folder and returns the compiled graph.
+        script: the scripted replies of the fake model.
+        stateful: if True, the graph has a checkpointer and each turn sends only the new message.
+            Otherwise, the whole history is sent at each turn.
+        make_input: builds the graph input for a turn, given the new message text and the history.
+        is_async: if True, the graph has async nodes and it's driven with ainvoke.
+    """
+    name: str
+    module_path: str
+    build: Callable[[Any, Path], Any]
+    script: list = field(default_factory=lambda: ["Resposta do modelo falso."])
+    stateful: bool = False
+    make_input: Optional[Callable[[str, list], dict]] = None
+    is_async: bool = False
+
+
+def messages_input(text: str, history: list) -> dict:
+    return {"messages": history + [HumanMessage(content=text, name="Benchmark")]}
+
+def area_calls():
+    return [react_script([("triangle_area", {"base": 4, "height": 10})], "A área é 20 cm².")]
+
+def arithmetic_calls():
+    return [react_script([("sum_numbers", {"a": 2, "b": 3}), ("multiply_numbers", {"a": 2, "b": 3})], "Os resultados são 5 e 6.")]
+
+
+GRAPH_TARGETS = [
+    GraphTarget("simple_graph", "introduction/simple_graph.py",
+                build=lambda m, tmp: m.create_graph(),
+                make_input=lambda text, history: {"name": text}),
+    GraphTarget("simple_graph_chat_chain", "introduction/simple_graph_chat_chain.py",
+                build=lambda m, tmp: m.create_graph()),
+    GraphTarget("simple_graph_chat_chain_router", "introduction/simple_graph_chat_chain_router.py",
+                build=lambda m, tmp: m.create_graph(), script=area_calls()),
+    GraphTarget("simple_react_agent", "introduction/simple_react_agent.py",
+                build=lambda m, tmp: m.create_graph(), script=area_calls()),
+    GraphTarget("simple_react_agent_with_memory", "introduction/simple_react_agent_with_memory.py",
+                build=lambda m, tmp: m.create_graph(memory_checkpointer=MemorySaver()), script=area_calls(), stateful=True),
+    GraphTarget("filtering_graph_modification", "state_and_memory/filtering_trimming_messages.py",
+                build=lambda m, tmp: m.create_graph_modification_example()),
+    GraphTarget("filtering_inplace", "state_and_memory/filtering_trimming_messages.py",
+                build=lambda m, tmp: m.create_graph_with_inplace_filtering()),
+    GraphTarget("trimming", "state_and_memory/filtering_trimming_messages.py",
+                build=lambda m, tmp: m.create_graph_trimming()),
+    GraphTarget("multiple_state_schemas", "state_and_memory/multiple_state_schemas.py",
+                build=lambda m, tmp: m.create_input_output_graph(),
+                make_input=lambda text, history: {"cpf": text}),
+    GraphTarget("chat_with_summarization", "state_and_memory/simple_chat_with_summarization.py",
+                build=lambda m, tmp: m.create_graph(), stateful=True),
+    GraphTarget("chat_with_summ_external_memory", "state_and_memory/simple_chat_with_summ_external_memory.py",
+                build=lambda m, tmp: m.create_graph(path_checkpoint=str(tmp / "checkpoints.db")), stateful=True),
+    GraphTarget("breaking_for_approval", "human_in_the_loop/breaking_for_approval.py",
+                build=lambda m, tmp: m.Chatbot(checkpointer=MemorySaver(), when_interrupt=None).workflow,
+                script=arithmetic_calls(), stateful=True),
+    GraphTarget("breaking_for_editting", "human_in_the_loop/breaking_for_editting.py",
+                build=lambda m, tmp: m.Chatbot(checkpointer=MemorySaver(), when_interrupt=None).workflow,
+                script=arithmetic_calls(), stateful=True),
+    GraphTarget("breaking_dynamically", "human_in_the_loop/breaking_dynamically.py",
+                build=lambda m, tmp: m.Chatbot(checkpointer=MemorySaver(), when_interrupt=None).workflow,
+                script=arithmetic_calls(), stateful=True),
+    GraphTarget("streaming_update_value_token", "human_in_the_loop/streaming_update_value_token.py",
+                build=lambda m, tmp: m.Chatbot(checkpointer=MemorySaver()).workflow, stateful=True, is_async=True),
+    GraphTarget("time_travel", "human_in_the_loop/time_travel.py",
+                build=lambda m, tmp: m.Chatbot(checkpointer=MemorySaver()).workflow,
+                script=arithmetic_calls(), stateful=True),
+    GraphTarget("async_chatbot", "human_in_the_loop/async_chatbot.py",
+                build=lambda m, tmp: m.AsyncChatbot(checkpointer=MemorySaver()).workflow,
+                script=arithmetic_calls(), stateful=True, is_async=True),
+]
+
+
+# 4. Running the benchmark
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_conversation(graph, target: GraphTarget, turns: int, callbacks: list) -> list[float]:
+    """
+    Drives one conversation with the given number of turns and returns the latency of each turn.
+    """
+    if target.is_async:
+        # A single event loop for the whole conversation, so its setup is not part of the turn latencies
+        return asyncio.run(arun_conversation(graph, target, turns, callbacks))
+
+    make_input = target.make_input or messages_input
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}, "callbacks": callbacks}
+    history = []
+    latencies = []
+
+    for turn in range(turns):
+        graph_input = make_input(f"Mensagem número {turn} da conversa.", [] if target.stateful else history)
+
+        start = time.perf_counter()
+        response = graph.invoke(input=graph_input, config=config)
+        latencies.append(time.perf_counter() - start)
+
+        if not target.stateful and isinstance(response, dict) and "messages" in response:
+            history = response["messages"]
+
+    return latencies
+
+async def arun_conversation(graph, target: GraphTarget, turns: int, callbacks: list) -> list[float]:
+    make_input = target.make_input or messages_input
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}, "callbacks": callbacks}
+    history = []
+    latencies = []
+
+    for turn in range(turns):
+        graph_input = make_input(f"Mensagem número {turn} da conversa.", [] if target.stateful else history)
+
+        start = time.perf_counter()
+        response = await graph.ainvoke(input=graph_input, config=config)
+        latencies.append(time.perf_counter() - start)
+
+        if not target.stateful and isinstance(response, dict) and "messages" in response:
+            history = response["messages"]
+
+    return latencies
+
+def benchmark_target(target: GraphTarget, lengths: list[int], repeats: int, latency: float, token_latency: float) -> list[dict]:
+    factory = FakeChatModel.factory(replies=target.script, latency=latency, token_latency=token_latency)
+    module = load_module(target.module_path, chat_model_factory=factory)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        graph = target.build(module, Path(tmp))
+
+        # Warm up: the first run pays for lazy imports and compilation caches
+        run_conversation(graph, target, turns=1, callbacks=[])
+
+        for turns in lengths:
+            timer = NodeTimer()
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(repeats):
+                latencies += run_conversation(graph, target, turns=turns, callbacks=[timer])
+            elapsed = time.perf_counter() - start
+
+            # Memory is measured in a separate run, as tracemalloc slows down the execution
+            tracemalloc.start()
+            run_conversation(graph, target, turns=turns, callbacks=[])
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results.append({
+                "graph": target.name,
+                "turns": turns,
+                "throughput_turns_per_s": len(latencies) / elapsed,
+                "p50_ms": 1000 * percentile(latencies, 0.50),
+                "p99_ms": 1000 * percentile(latencies, 0.99),
+                "peak_memory_kb": peak_bytes / 1024,
+                "nodes": timer.report(),
+            })
+
+    return results
+
+def print_report(results: list[dict]):
+    header = f"{'graph':<34}{'turns':>6}{'turns/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'peak KB':>10}  nodes (mean ms)"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if "error" in r:
+            print(f"{r['graph']:<34}FAILED: {r['error']}")
+            continue
+        nodes = ", ".join(f"{node}={info['mean_ms']:.2f}" for node, info in r["nodes"].items())
+        print(f"{r['graph']:<34}{r['turns']:>6}{r['throughput_turns_per_s']:>10.1f}{r['p50_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['peak_memory_kb']:>10.0f}  {nodes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the graph factories, using a fake chat model.")
+    parser.add_argument("--graphs", nargs="*", default=None, help="Names of the graphs to run. Default: all.")
+    parser.add_argument("--lengths", nargs="*", type=int, default=[1, 5, 20], help="Conversation lengths (turns).")
+    parser.add_argument("--repeats", type=int, default=3, help="Conversations per length.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake model time to first token, in seconds.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Fake model time per token, in seconds.")
+    parser.add_argument("--json", default=None, help="Path of a JSON file to save the results.")
+    args = parser.parse_args()
+
+    targets = [t for t in GRAPH_TARGETS if not args.graphs or t.name in args.graphs]
+    results = []
+    for target in targets:
+        # A broken target is reported, and doesn't stop the others
+        try:
+            results += benchmark_target(target, lengths=args.lengths, repeats=args.repeats,
+                                        latency=args.latency, token_latency=args.token_latency)
+        except Exception as error:
+            results.append({"graph": target.name, "error": repr(error)})
+
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
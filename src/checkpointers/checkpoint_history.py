@@ -0,0 +1,177 @@
+import sqlite3
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Iterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from pooled_sqlite_saver import migrate_step_column
+
+# Paginated history of a thread, for the time travel and fork operations of time_travel.py.
+# graph.get_state_history(config) loads and deserializes every checkpoint of the thread, newest first, so reaching
+# the first steps (history[-2], history[-3]) of a thread with thousands of checkpoints costs O(history).
+# Here the history is read from the checkpoints table without the checkpoint blobs:
+# - pages are selected with a cursor on the primary key (thread_id, checkpoint_ns, checkpoint_id), in both orders;
+# - a step is found with the index (thread_id, checkpoint_ns, step, checkpoint_id);
+# - the snapshots only deserialize the state (graph.get_state of that checkpoint) when values/next are accessed.
+
+SELECT_COLUMNS = "SELECT checkpoint_id, parent_checkpoint_id, step, metadata FROM checkpoints"
+
+
+@dataclass
+class LazyStateSnapshot:
+    """
+    Entry of the history. The config can be passed to graph.stream (replay) or graph.update_state (fork) as is.
+    """
+    graph: object = field(repr=False)
+    config: RunnableConfig
+    parent_config: Optional[RunnableConfig]
+    step: Optional[int]
+    metadata: dict
+
+    @cached_property
+    def state(self):
+        # A single checkpoint lookup, instead of the scan of the whole history
+        return self.graph.get_state(self.config)
+
+    @property
+    def values(self) -> dict:
+        return self.state.values
+
+    @property
+    def next(self) -> tuple:
+        return self.state.next
+
+
+@dataclass
+class HistoryPage:
+    snapshots: list[LazyStateSnapshot]
+    # Pass it to CheckpointHistory.page to get the next page. None in the last page.
+    next_cursor: Optional[str]
+
+
+class CheckpointHistory:
+    """
+    Args:
+        graph: the compiled graph, used to build the states of the snapshots.
+        path: path of the database of its PooledSqliteSaver or SqliteSaver.
+        config: config with the thread_id (and optionally the checkpoint_ns).
+    """
+
+    def __init__(self, graph, path: str, config: RunnableConfig):
+        self.graph = graph
+        self.thread_id = str(config["configurable"]["thread_id"])
+        self.checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        self.serde = JsonPlusSerializer()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA busy_timeout=5000")
+        migrate_step_column(self.connection)
+
+    def close(self):
+        self.connection.close()
+
+    def _snapshot(self, row: tuple) -> LazyStateSnapshot:
+        checkpoint_id, parent_checkpoint_id, step, metadata = row
+        configurable = {"thread_id": self.thread_id, "checkpoint_ns": self.checkpoint_ns}
+        return LazyStateSnapshot(
+            graph=self.graph,
+            config={"configurable": {**configurable, "checkpoint_id": checkpoint_id}},
+            parent_config={"configurable": {**configurable, "checkpoint_id": parent_checkpoint_id}} if parent_checkpoint_id else None,
+            step=step,
+            metadata=self.serde.loads(metadata) if metadata is not None else {},
+        )
+
+    def page(self, cursor: Optional[str] = None, size: int = 50, oldest_first: bool = False) -> HistoryPage:
+        """
+        Returns up to size snapshots after the cursor, newest first (as get_state_history) or oldest first.
+        """
+        comparison, order = (">", "ASC") if oldest_first else ("<", "DESC")
+        query = f"{SELECT_COLUMNS} WHERE thread_id = ? AND checkpoint_ns = ?"
+        params = [self.thread_id, self.checkpoint_ns]
+        if cursor is not None:
+            query += f" AND checkpoint_id {comparison} ?"
+            params.append(cursor)
+        # One row more than the page tells if there is a next page
+        rows = self.connection.execute(f"{query} ORDER BY checkpoint_id {order} LIMIT ?", (*params, size + 1)).fetchall()
+
+        snapshots = [self._snapshot(row) for row in rows[:size]]
+        next_cursor = rows[size - 1][0] if len(rows) > size else None
+        return HistoryPage(snapshots=snapshots, next_cursor=next_cursor)
+
+    def iter(self, oldest_first: bool = False, page_size: int = 100) -> Iterator[LazyStateSnapshot]:
+        cursor = None
+        while True:
+            page = self.page(cursor, size=page_size, oldest_first=oldest_first)
+            yield from page.snapshots
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+
+    def at_step(self, step: int) -> Optional[LazyStateSnapshot]:
+        """
+        Returns the checkpoint of the given step. The forks (update_state) repeat the steps of the checkpoint they
+        start from, so the latest checkpoint with that step is returned. See all_at_step for all of them.
+        """
+        row = self.connection.execute(
+            f"{SELECT_COLUMNS} WHERE thread_id = ? AND checkpoint_ns = ? AND step = ? ORDER BY checkpoint_id DESC LIMIT 1",
+            (self.thread_id, self.checkpoint_ns, step)).fetchone()
+        return self._snapshot(row) if row else None
+
+    def all_at_step(self, step: int) -> list[LazyStateSnapshot]:
+        rows = self.connection.execute(
+            f"{SELECT_COLUMNS} WHERE thread_id = ? AND checkpoint_ns = ? AND step = ? ORDER BY checkpoint_id DESC",
+            (self.thread_id, self.checkpoint_ns, step)).fetchall()
+        return [self._snapshot(row) for row in rows]
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                                       (self.thread_id, self.checkpoint_ns)).fetchone()[0]
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    import tempfile
+    from langchain_core.messages import HumanMessage
+    from pooled_sqlite_saver import PooledSqliteSaver, create_benchmark_graph
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "checkpoints.db")
+        saver = PooledSqliteSaver(path)
+        graph = create_benchmark_graph(saver)
+        config = {"configurable": {"thread_id": "long-thread"}}
+
+        # Each turn writes 2 checkpoints (input and chat node)
+        for turn in range(1500):
+            graph.invoke({"messages": [HumanMessage(content=f"Pergunta {turn}")]}, config=config)
+
+        # 1. The same lookup of time_travel.py: the checkpoint after the first chat node run (history[-3])
+        start = time.perf_counter()
+        history = [state for state in graph.get_state_history(config)]
+        old = history[-3]
+        print(f"get_state_history: {len(history)} checkpoints, {time.perf_counter() - start:.3f}s | step {old.metadata['step']}")
+
+        checkpoint_history = CheckpointHistory(graph, path, config)
+        start = time.perf_counter()
+        old = checkpoint_history.at_step(1)
+        messages = old.values["messages"]
+        print(f"at_step(1): {time.perf_counter() - start:.4f}s | {len(messages)} messages")
+
+        # 2. Oldest first pages
+        start = time.perf_counter()
+        first_page = checkpoint_history.page(size=5, oldest_first=True)
+        print(f"First page, oldest first: steps {[s.step for s in first_page.snapshots]} in {time.perf_counter() - start:.4f}s")
+        second_page = checkpoint_history.page(first_page.next_cursor, size=5, oldest_first=True)
+        print(f"Second page: steps {[s.step for s in second_page.snapshots]}")
+
+        # 3. Forking from it, as in time_travel.py
+        fork_config = graph.update_state(old.config, {"messages": [HumanMessage(content="Quanto é 5 + 5?", id=messages[0].id)]})
+        for event in graph.stream(input=None, config=fork_config, stream_mode="values"):
+            event["messages"][-1].pretty_print()
+        # The fork checkpoint has the step after the one it started from, as the original lineage
+        print("Checkpoints at step 2 (original and fork):", len(checkpoint_history.all_at_step(2)))
+
+        checkpoint_history.close()
+        saver.close()
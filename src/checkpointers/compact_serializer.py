@@ -0,0 +1,282 @@
+import threading
+from typing import Any, Iterable, Optional
+
+import msgpack
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compact binary serializer for the checkpoints and the pending writes.
+# The JsonPlusSerializer stores each message as a JSON object with the class path and all the field names
+# ("lc", "type", "id": ["langchain", "schema", "messages", "AIMessage"], "kwargs": {...}), and repeats the same
+# response_metadata (model name, fingerprint, finish reason...) in every AI message of the history. Here:
+# - the payload is msgpack, and each message is a msgpack extension with its fields in fixed positions (no names);
+# - the additional_kwargs and response_metadata dicts are interned: each distinct dict is stored once per payload;
+# - optionally, the payload is compressed with zstd, using a dictionary trained on our own checkpoints. The id of the
+#   dictionary is part of the type tag ("compact:<dict id>"), so a payload is never decoded with the wrong dictionary.
+# Objects without a compact encoding are delegated to the JsonPlusSerializer, and payloads written by it can still
+# be loaded, so existing databases keep working.
+
+COMPACT_TYPE = "compact"
+
+# Frame header of the payloads
+RAW_FRAME = b"\x00"
+ZSTD_FRAME = b"\x01"
+
+# msgpack extension codes
+EXT_MESSAGE = 1
+EXT_TUPLE = 2
+EXT_JSONPLUS = 3
+
+# Message classes and the fields stored after the common ones (content, id, name, additional_kwargs, response_metadata)
+MESSAGE_TYPES = {
+    0: (HumanMessage, ()),
+    1: (AIMessage, ("tool_calls", "invalid_tool_calls", "usage_metadata")),
+    2: (SystemMessage, ()),
+    3: (ToolMessage, ("tool_call_id", "artifact", "status")),
+    4: (RemoveMessage, ()),
+}
+MESSAGE_CODES = {cls: code for code, (cls, _) in MESSAGE_TYPES.items()}
+
+
+class _Encoder:
+    """
+    Encodes one payload. Keeps the table of interned dicts of that payload.
+    """
+
+    def __init__(self, jsonplus: JsonPlusSerializer):
+        self.jsonplus = jsonplus
+        self.table = []
+        self._index = {}
+
+    def intern(self, value: dict) -> int:
+        # The key is the encoding itself: equal bytes decode to equal dicts, whatever the types of the keys and values
+        key = self.pack(value)
+        if (index := self._index.get(key)) is None:
+            index = self._index[key] = len(self.table)
+            self.table.append(value)
+        return index
+
+    def pack(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, default=self.default, strict_types=True, use_bin_type=True)
+
+    def default(self, obj: Any):
+        code = MESSAGE_CODES.get(type(obj))
+        if code is not None:
+            _, extra_fields = MESSAGE_TYPES[code]
+            fields = [code, obj.content, obj.id, obj.name,
+                      self.intern(obj.additional_kwargs), self.intern(obj.response_metadata)]
+            fields += [getattr(obj, name) for name in extra_fields]
+            return msgpack.ExtType(EXT_MESSAGE, self.pack(fields))
+        # Only plain tuples: namedtuples and other subclasses keep their type through the LangGraph encoding
+        if type(obj) is tuple:
+            return msgpack.ExtType(EXT_TUPLE, self.pack(list(obj)))
+        # Anything else (sets, datetimes, pydantic models, Send...) uses the LangGraph encoding
+        return msgpack.ExtType(EXT_JSONPLUS, self.jsonplus.dumps(obj))
+
+
+class _Decoder:
+    def __init__(self, jsonplus: JsonPlusSerializer, table: list):
+        self.jsonplus = jsonplus
+        self.table = table
+
+    def unpack(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, ext_hook=self.ext_hook, raw=False, strict_map_key=False)
+
+    def ext_hook(self, code: int, data: bytes):
+        if code == EXT_MESSAGE:
+            type_code, content, id_, name, additional_kwargs, response_metadata, *extra = self.unpack(data)
+            cls, extra_fields = MESSAGE_TYPES[type_code]
+            if cls is RemoveMessage:
+                return RemoveMessage(id=id_)
+            kwargs = {name_: value for name_, value in zip(extra_fields, extra) if value is not None}
+            # Each message gets its own copies, so a message edited in a node doesn't change the others
+            return cls(content=content, id=id_, name=name, additional_kwargs=dict(self.table[additional_kwargs]),
+                       response_metadata=dict(self.table[response_metadata]), **kwargs)
+        if code == EXT_TUPLE:
+            return tuple(self.unpack(data))
+        if code == EXT_JSONPLUS:
+            return self.jsonplus.loads(data)
+        return msgpack.ExtType(code, data)
+
+
+class CompactSerializer:
+    """
+    Serializer that can be given to the checkpointers (SqliteSaver(conn, serde=...), MemorySaver(serde=...),
+    PooledSqliteSaver(path, serde=...)).
+
+    Args:
+        dictionary: zstd dictionary trained with train_dictionary. If None, zstd without dictionary is used.
+        previous_dictionaries: dictionaries used before, so the payloads compressed with them can still be loaded.
+        compress: if False, the payloads are not compressed.
+        level: the zstd compression level.
+        min_compress_size: payloads smaller than it (in bytes) are not compressed.
+    """
+
+    def __init__(self, dictionary: Optional[bytes] = None, compress: bool = True, level: int = 3, min_compress_size: int = 64,
+                 previous_dictionaries: Iterable[bytes] = ()):
+        if compress and zstandard is None:
+            raise ImportError("Compression requires the zstandard package: pip install zstandard")
+        self.compress = compress
+        self.level = level
+        self.min_compress_size = min_compress_size
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary) if compress and dictionary else None
+        self.type_tag = COMPACT_TYPE if self.dictionary is None else f"{COMPACT_TYPE}:{self.dictionary.dict_id()}"
+        # dict id -> dictionary (0: no dictionary)
+        self._dictionaries = {0: None}
+        if zstandard is not None:
+            for data in previous_dictionaries:
+                previous = zstandard.ZstdCompressionDict(data)
+                self._dictionaries[previous.dict_id()] = previous
+        if self.dictionary is not None:
+            self._dictionaries[self.dictionary.dict_id()] = self.dictionary
+        self.jsonplus = JsonPlusSerializer()
+        # The zstd (de)compressors are not thread safe, so each thread has its own
+        self._local = threading.local()
+
+    def _compressor(self):
+        if (compressor := getattr(self._local, "compressor", None)) is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        return compressor
+
+    def _decompressor(self, dict_id: int):
+        if dict_id not in self._dictionaries:
+            raise ValueError(f"The payload was compressed with the zstd dictionary {dict_id}, which was not given to the serializer")
+        if (decompressors := getattr(self._local, "decompressors", None)) is None:
+            decompressors = self._local.decompressors = {}
+        if (decompressor := decompressors.get(dict_id)) is None:
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=self._dictionaries[dict_id])
+        return decompressor
+
+    def encode(self, obj: Any) -> bytes:
+        """
+        Returns the uncompressed msgpack payload: [interned dicts, body].
+        """
+        encoder = _Encoder(self.jsonplus)
+        body = encoder.pack(obj)
+        return msgpack.packb([encoder.pack(encoder.table), body], use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        table_bytes, body = msgpack.unpackb(data, raw=False)
+        table = _Decoder(self.jsonplus, []).unpack(table_bytes)
+        return _Decoder(self.jsonplus, table).unpack(body)
+
+    # SerializerProtocol
+
+    def dumps(self, obj: Any) -> bytes:
+        data = self.encode(obj)
+        if self.compress and len(data) >= self.min_compress_size:
+            return ZSTD_FRAME + self._compressor().compress(data)
+        return RAW_FRAME + data
+
+    def _loads(self, data: bytes, dict_id: Optional[int]) -> Any:
+        header, payload = data[:1], data[1:]
+        if header == ZSTD_FRAME:
+            if dict_id is None:
+                # Untyped payload (or tag without an id): the zstd frame has the id of its dictionary (0: none)
+                dict_id = zstandard.get_frame_parameters(payload).dict_id
+            return self.decode(self._decompressor(dict_id).decompress(payload))
+        if header == RAW_FRAME:
+            return self.decode(payload)
+        # Written by the JsonPlusSerializer
+        return self.jsonplus.loads(data)
+
+    def loads(self, data: bytes) -> Any:
+        return self._loads(data, None)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        return self.type_tag, self.dumps(obj)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        name, _, dict_id = type_.partition(":")
+        if name == COMPACT_TYPE:
+            return self._loads(payload, int(dict_id) if dict_id else None)
+        return self.jsonplus.loads_typed(data)
+
+
+# Training the zstd dictionary on our own checkpoints
+
+def train_dictionary(objects: Iterable[Any], dict_size: int = 16 * 1024) -> bytes:
+    """
+    Trains a zstd dictionary with the uncompressed compact payloads of the given objects (e.g. checkpoints).
+    The dictionary holds the byte strings common to the payloads (metadata, prompts, tool schemas), so even
+    small checkpoints compress well.
+    """
+    if zstandard is None:
+        raise ImportError("Training a dictionary requires the zstandard package: pip install zstandard")
+    serializer = CompactSerializer(compress=False)
+    samples = [serializer.encode(obj) for obj in objects]
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+def checkpoints_from_sqlite(path: str, limit: int = 2000) -> list:
+    """
+    Loads the most recent checkpoints of a database written by a SqliteSaver, to be used as training samples.
+    """
+    import sqlite3
+
+    jsonplus = JsonPlusSerializer()
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT type, checkpoint FROM checkpoints ORDER BY checkpoint_id DESC LIMIT ?", (limit,)).fetchall()
+    return [jsonplus.loads_typed((type_, blob)) for type_, blob in rows]
+
+
+if __name__ == "__main__":
+    import time
+    import uuid
+    from langgraph.checkpoint.base import empty_checkpoint
+
+    # 1. Synthetic traffic: checkpoints of conversations with tool calls, as stored by the Chatbot graphs
+    def ai_message(text: str, tool_calls: list = ()) -> AIMessage:
+        return AIMessage(
+            content=text, id=f"run-{uuid.uuid4()}", tool_calls=list(tool_calls),
+            response_metadata={"token_usage": {"completion_tokens": 42, "prompt_tokens": 310, "total_tokens": 352},
+                               "model_name": "gpt-4o-mini-2024-07-18", "system_fingerprint": "fp_e2bde53e6e",
+                               "finish_reason": "tool_calls" if tool_calls else "stop", "logprobs": None},
+            usage_metadata={"input_tokens": 310, "output_tokens": 42, "total_tokens": 352},
+        )
+
+    def conversation_checkpoints(turns: int) -> list:
+        messages = []
+        checkpoints = []
+        for turn in range(turns):
+            call_id = f"call_{uuid.uuid4().hex[:24]}"
+            messages += [
+                HumanMessage(content=f"Quanto é {turn} mais {turn + 1}?", id=str(uuid.uuid4()), name="User"),
+                ai_message("", [{"name": "sum_numbers", "args": {"a": turn, "b": turn + 1}, "id": call_id, "type": "tool_call"}]),
+                ToolMessage(content=str(2 * turn + 1), tool_call_id=call_id, name="sum_numbers", id=str(uuid.uuid4())),
+                ai_message(f"O resultado é {2 * turn + 1}."),
+            ]
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"messages": list(messages)}
+            checkpoint["channel_versions"] = {"messages": f"{turn:032}.0.5", "__start__": f"{turn:032}.0.1"}
+            checkpoints.append(checkpoint)
+        return checkpoints
+
+    training = [c for _ in range(20) for c in conversation_checkpoints(10)]
+    evaluation = [c for _ in range(5) for c in conversation_checkpoints(20)]
+
+    # 2. Bytes per checkpoint and encode/decode latency
+    serializers = {"jsonplus": JsonPlusSerializer(), "compact": CompactSerializer(compress=False)}
+    if zstandard is not None:
+        serializers["compact + zstd"] = CompactSerializer()
+        serializers["compact + zstd dict"] = CompactSerializer(dictionary=train_dictionary(training))
+
+    print(f"{'serializer':<22}{'bytes/checkpoint':>18}{'encode µs':>12}{'decode µs':>12}")
+    for label, serializer in serializers.items():
+        start = time.perf_counter()
+        payloads = [serializer.dumps_typed(c) for c in evaluation]
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [serializer.loads_typed(p) for p in payloads]
+        decode_seconds = time.perf_counter() - start
+
+        assert all(d["channel_values"]["messages"] == c["channel_values"]["messages"] for d, c in zip(decoded, evaluation))
+        n = len(evaluation)
+        print(f"{label:<22}{sum(len(blob) for _, blob in payloads) / n:>18.0f}"
+              f"{1e6 * encode_seconds / n:>12.1f}{1e6 * decode_seconds / n:>12.1f}")
@@ -0,0 +1,340 @@
+import copy
+import asyncio
+import random
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, \
+    CheckpointTuple, copy_checkpoint, get_checkpoint_id
+
+try:
+    from langgraph.checkpoint.base import WRITES_IDX_MAP
+except ImportError:
+    WRITES_IDX_MAP = {}
+
+from delta_encoding import apply_delta, encode_delta, message_channels
+
+# In-memory checkpointer with copy-on-write forks, for the what-if forks of time_travel.py.
+# The MemorySaver serializes the whole state at each checkpoint, so each fork made with update_state copies all
+# the messages of the parent. Here the checkpoints keep the Python objects:
+# - the message lists are stored as deltas against the parent (delta_encoding.py), so the messages that didn't
+#   change are shared by reference between the parent, its children and its forks;
+# - fork() creates a new thread whose first checkpoint only points to the source checkpoint (O(1) memory);
+# - fork_many() creates K forks, each with its own update_state, and run_forks() runs them concurrently.
+# As the values are not copied, the nodes must return new objects instead of changing the state values in place,
+# which is already the rule of the LangGraph reducers. The bookkeeping of the checkpoint (channel_versions,
+# versions_seen) and the metadata are copied on the way in and out, as Pregel changes them in place.
+
+
+@dataclass
+class StoredCheckpoint:
+    # The checkpoint without the message lists (or with them, if deltas is None)
+    checkpoint: Checkpoint
+    metadata: CheckpointMetadata
+    parent_checkpoint_id: Optional[str]
+    # (thread_id, checkpoint_ns, checkpoint_id) of the checkpoint the deltas apply to. May be in another thread (forks).
+    base: Optional[tuple]
+    deltas: Optional[dict]
+    depth: int = 0
+
+
+class CowMemorySaver(BaseCheckpointSaver):
+    """
+    Args:
+        snapshot_interval: a checkpoint stores its full message lists (a list of references) every snapshot_interval
+            deltas, so rebuilding a state applies at most snapshot_interval deltas.
+    """
+
+    def __init__(self, snapshot_interval: int = 32):
+        super().__init__()
+        self.snapshot_interval = snapshot_interval
+        # (thread_id, checkpoint_ns) -> checkpoint_id -> StoredCheckpoint
+        self.storage = defaultdict(dict)
+        # (thread_id, checkpoint_ns, checkpoint_id) -> (task_id, idx) -> (task_id, channel, value)
+        self.writes = defaultdict(dict)
+
+        self._lock = threading.RLock()
+        self._lists_cache = OrderedDict()
+        self._lists_cache_size = 256
+
+    # 1. Message lists of a stored checkpoint
+
+    def _stored(self, key: tuple) -> Optional[StoredCheckpoint]:
+        thread_id, checkpoint_ns, checkpoint_id = key
+        return self.storage.get((thread_id, checkpoint_ns), {}).get(checkpoint_id)
+
+    def _lists(self, key: tuple) -> dict[str, list]:
+        """
+        Rebuilds the message lists of a checkpoint: walks up the bases until a snapshot (or a cached checkpoint)
+        and applies the deltas back down.
+        """
+        chain = []
+        lists = None
+        while lists is None:
+            if key in self._lists_cache:
+                self._lists_cache.move_to_end(key)
+                lists = self._lists_cache[key]
+                break
+            stored = self._stored(key)
+            if stored.deltas is None:
+                lists = {channel: stored.checkpoint["channel_values"][channel] for channel in message_channels(stored.checkpoint)}
+                break
+            chain.append(stored)
+            key = stored.base
+
+        for stored in reversed(chain):
+            lists = {**lists, **{channel: apply_delta(lists.get(channel, []), delta) for channel, delta in stored.deltas.items()}}
+        return lists
+
+    def _cache(self, key: tuple, lists: dict[str, list]):
+        self._lists_cache[key] = lists
+        self._lists_cache.move_to_end(key)
+        if len(self._lists_cache) > self._lists_cache_size:
+            self._lists_cache.popitem(last=False)
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, stored: StoredCheckpoint) -> CheckpointTuple:
+        key = (thread_id, checkpoint_ns, checkpoint_id)
+        lists = self._lists(key)
+        self._cache(key, lists)
+        # The lists are copied (only the references), so the graph never changes the stored ones
+        checkpoint = copy_checkpoint(stored.checkpoint)
+        checkpoint["channel_values"].update((channel, list(value)) for channel, value in lists.items())
+
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=checkpoint,
+            metadata=copy.deepcopy(stored.metadata),
+            parent_config=({"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": stored.parent_checkpoint_id}}
+                           if stored.parent_checkpoint_id else None),
+            pending_writes=list(self.writes.get(key, {}).values()),
+        )
+
+    # 2. The BaseCheckpointSaver interface
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            checkpoints = self.storage.get((thread_id, checkpoint_ns))
+            if not checkpoints:
+                return None
+            checkpoint_id = get_checkpoint_id(config) or max(checkpoints)
+            if (stored := checkpoints.get(checkpoint_id)) is None:
+                return None
+            return self._to_tuple(thread_id, checkpoint_ns, checkpoint_id, stored)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            keys = [key for key in self.storage if config is None or key[0] == str(config["configurable"]["thread_id"])]
+            if config is not None and (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                keys = [key for key in keys if key[1] == checkpoint_ns]
+            items = [(key, checkpoint_id, stored) for key in keys for checkpoint_id, stored in self.storage[key].items()]
+
+        before_id = get_checkpoint_id(before) if before else None
+        config_id = get_checkpoint_id(config) if config else None
+        for (thread_id, checkpoint_ns), checkpoint_id, stored in sorted(items, key=lambda item: item[1], reverse=True):
+            if config_id and checkpoint_id != config_id:
+                continue
+            if before_id and checkpoint_id >= before_id:
+                continue
+            if filter and any(stored.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            with self._lock:
+                checkpoint_tuple = self._to_tuple(thread_id, checkpoint_ns, checkpoint_id, stored)
+            yield checkpoint_tuple
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        key = (thread_id, checkpoint_ns, checkpoint["id"])
+        # Pregel keeps changing the versions of the checkpoint it gave us (apply_writes)
+        checkpoint = copy_checkpoint(checkpoint)
+        metadata = copy.deepcopy(metadata)
+
+        with self._lock:
+            parent_key = (thread_id, checkpoint_ns, parent_id)
+            parent = self._stored(parent_key) if parent_id else None
+
+            payload = None
+            if parent is not None and parent.depth + 1 < self.snapshot_interval:
+                payload = encode_delta(checkpoint, self._lists(parent_key), base_id=parent_id, depth=parent.depth + 1)
+
+            if payload is None:
+                # The snapshot keeps its own lists (of the same message objects)
+                checkpoint["channel_values"].update((channel, list(checkpoint["channel_values"][channel]))
+                                                    for channel in message_channels(checkpoint))
+                stored = StoredCheckpoint(checkpoint=checkpoint, metadata=metadata, parent_checkpoint_id=parent_id, base=None, deltas=None)
+            else:
+                stored = StoredCheckpoint(checkpoint=payload["checkpoint"], metadata=metadata, parent_checkpoint_id=parent_id,
+                                          base=parent_key, deltas=payload["deltas"], depth=payload["depth"])
+            self.storage[(thread_id, checkpoint_ns)][checkpoint["id"]] = stored
+            self._cache(key, {channel: list(checkpoint["channel_values"][channel]) for channel in message_channels(checkpoint)})
+
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        key = (str(config["configurable"]["thread_id"]), config["configurable"].get("checkpoint_ns", ""),
+               config["configurable"]["checkpoint_id"])
+        with self._lock:
+            stored_writes = self.writes[key]
+            for idx, (channel, value) in enumerate(writes):
+                write_key = (task_id, WRITES_IDX_MAP.get(channel, idx))
+                # Regular writes are kept if already stored, special ones (errors, interrupts) replace them
+                if write_key[1] >= 0 and write_key in stored_writes:
+                    continue
+                stored_writes[write_key] = (task_id, channel, value)
+
+    def get_next_version(self, current: Optional[str], channel) -> str:
+        # Same versions format of the MemorySaver
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for checkpoint_tuple in self.list(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    # 3. Forks
+
+    def fork(self, config: RunnableConfig, thread_id: str) -> RunnableConfig:
+        """
+        Creates the thread thread_id starting from the checkpoint of config. Only a reference to the source is stored.
+        """
+        source_thread = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            source = self.get_tuple(config)
+            if source is None:
+                raise ValueError(f"Checkpoint not found: {config}")
+            checkpoint_id = source.config["configurable"]["checkpoint_id"]
+            stored = self.storage[(source_thread, checkpoint_ns)][checkpoint_id]
+
+            # source is already a copy (see _to_tuple), so the fork shares no versions or metadata with the source
+            channels = message_channels(source.checkpoint)
+            no_change = {"removed": [], "replaced": [], "appended": []}
+            for channel in channels:
+                del source.checkpoint["channel_values"][channel]
+            self.storage[(thread_id, checkpoint_ns)][checkpoint_id] = StoredCheckpoint(
+                checkpoint=source.checkpoint,
+                metadata={**source.metadata, "source": "fork", "forked_from": {"thread_id": source_thread, "checkpoint_id": checkpoint_id}},
+                parent_checkpoint_id=None,
+                base=(source_thread, checkpoint_ns, checkpoint_id),
+                deltas={channel: no_change for channel in channels},
+                depth=min(stored.depth + 1, self.snapshot_interval - 1),
+            )
+            # The pending writes of the source, so a fork of an interrupted step resumes as the source would
+            if writes := self.writes.get((source_thread, checkpoint_ns, checkpoint_id)):
+                self.writes[(thread_id, checkpoint_ns, checkpoint_id)] = dict(writes)
+
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+
+def fork_many(graph, config: RunnableConfig, updates: list[Optional[dict]], as_node: Optional[str] = None) -> list[RunnableConfig]:
+    """
+    Creates one fork (a new thread) per update, from the checkpoint of config, and applies the update with update_state.
+
+    Args:
+        graph: compiled graph whose checkpointer is a CowMemorySaver.
+        config: config of the checkpoint to fork from, e.g. history[-2].config in time_travel.py.
+        updates: the state update of each fork. None keeps the source state.
+        as_node: passed to update_state.
+    """
+    saver = graph.checkpointer
+    source_thread = config["configurable"]["thread_id"]
+    configs = []
+    for index, update in enumerate(updates):
+        fork_config = saver.fork(config, thread_id=f"{source_thread}/fork-{index}-{random.getrandbits(32):08x}")
+        if update is not None:
+            fork_config = graph.update_state(fork_config, update, as_node=as_node)
+        configs.append(fork_config)
+    return configs
+
+def run_forks(graph, fork_configs: list[RunnableConfig], max_concurrency: Optional[int] = None) -> list[dict]:
+    """
+    Continues the forks from their checkpoints, concurrently (each fork is a thread of its own).
+    """
+    configs = [{**config, "max_concurrency": max_concurrency} for config in fork_configs]
+    return graph.batch([None] * len(fork_configs), configs)
+
+async def arun_forks(graph, fork_configs: list[RunnableConfig], max_concurrency: int = 16) -> list[dict]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(config):
+        async with semaphore:
+            return await graph.ainvoke(None, config)
+
+    return await asyncio.gather(*(run(config) for config in fork_configs))
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+    from pathlib import Path
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+    from graph_benchmark import load_module, arithmetic_calls
+
+    # The Chatbot of time_travel.py with the fake model (0.2s per call)
+    time_travel = load_module("human_in_the_loop/time_travel.py",
+                              chat_model_factory=FakeChatModel.factory(replies=arithmetic_calls(), latency=0.2))
+    n_forks = 32
+
+    for label, saver in [("MemorySaver", MemorySaver()), ("CowMemorySaver", CowMemorySaver())]:
+        workflow = time_travel.Chatbot(checkpointer=saver).workflow
+        config = {"configurable": {"thread_id": "1"}}
+        # A long conversation before the fork point
+        for turn in range(30):
+            workflow.invoke({"messages": [HumanMessage(content=f"Quanto é {turn} mais 3?", name="Marianna")]}, config)
+        # As in time_travel.py: the checkpoint before the assistant answers the last question, whose question is replaced
+        fork_from = next(state for state in workflow.get_state_history(config) if state.next == ("assistant",))
+        question_id = fork_from.values["messages"][-1].id
+        updates = [{"messages": [HumanMessage(content=f"Quanto é {i} + 5?", id=question_id)]} for i in range(n_forks)]
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        if isinstance(saver, CowMemorySaver):
+            fork_configs = fork_many(workflow, fork_from.config, updates)
+        else:
+            # Forks of time_travel.py: each update_state stores a full copy of the state, in the same thread
+            fork_configs = [workflow.update_state(fork_from.config, update) for update in updates]
+        fork_seconds = time.perf_counter() - start
+        fork_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        if isinstance(saver, CowMemorySaver):
+            results = run_forks(workflow, fork_configs, max_concurrency=n_forks)
+        else:
+            # Forks of the same thread can't run at the same time without mixing their checkpoints
+            results = [workflow.invoke(None, fork_config) for fork_config in fork_configs]
+        run_seconds = time.perf_counter() - start
+
+        print(f"{label:<15} | {n_forks} forks: {fork_seconds * 1000:7.1f} ms, {fork_bytes / 1024:8.0f} KB "
+              f"| running them: {run_seconds:5.2f}s | last answer: {results[0]['messages'][-1].content}")
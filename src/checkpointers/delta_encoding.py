@@ -0,0 +1,109 @@
+from typing import Optional
+
+from langchain_core.messages import BaseMessage
+
+# Delta encoding of the message lists stored in the checkpoints.
+# Each super-step of a graph like the Chatbot of time_travel.py writes a checkpoint with the full "messages" list,
+# so a thread with T turns stores O(T²) message bytes. A delta stores only what changed against the parent
+# checkpoint: the appended messages, the messages replaced by id (add_messages overwrite) and the removed ids
+# (RemoveMessage). A full snapshot is stored every N checkpoints, so rebuilding a state applies at most N deltas.
+
+DELTA_TYPE_PREFIX = "delta+"
+
+
+def is_message_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(msg, BaseMessage) and msg.id for msg in value)
+
+def message_channels(checkpoint: dict) -> list[str]:
+    """
+    Names of the channels whose values are lists of messages with ids (e.g. the "messages" of MessagesState).
+    """
+    return [channel for channel, value in checkpoint["channel_values"].items() if is_message_list(value)]
+
+
+def diff_messages(parent: list[BaseMessage], child: list[BaseMessage]) -> Optional[dict]:
+    """
+    Returns the delta that turns the parent list into the child list, or None if the child can't be described as
+    the parent minus removed messages, with replaced messages in place, plus appended messages.
+    """
+    parent_by_id = {msg.id: msg for msg in parent}
+    child_ids = [msg.id for msg in child]
+    child_id_set = set(child_ids)
+    if len(parent_by_id) != len(parent) or len(child_id_set) != len(child):
+        # Repeated ids: the positions can't be recovered from the ids
+        return None
+
+    kept = [msg.id for msg in parent if msg.id in child_id_set]
+    if child_ids[:len(kept)] != kept:
+        return None
+
+    return {
+        "removed": [msg.id for msg in parent if msg.id not in child_id_set],
+        # Identity is checked first, as unchanged messages are usually the same objects
+        "replaced": [msg for msg in child[:len(kept)] if msg is not parent_by_id[msg.id] and msg != parent_by_id[msg.id]],
+        "appended": child[len(kept):],
+    }
+
+def apply_delta(parent: list[BaseMessage], delta: dict) -> list[BaseMessage]:
+    removed = set(delta["removed"])
+    replaced = {msg.id: msg for msg in delta["replaced"]}
+
+    return [replaced.get(msg.id, msg) for msg in parent if msg.id not in removed] + list(delta["appended"])
+
+
+def encode_delta(checkpoint: dict, parent_lists: dict[str, list], base_id: str, depth: int) -> Optional[dict]:
+    """
+    Builds the delta payload of a checkpoint against the message lists of its parent.
+    The message channels are removed from the checkpoint copy stored in the payload.
+    Returns None if a snapshot must be stored instead.
+    """
+    channels = message_channels(checkpoint)
+    deltas = {}
+    for channel in channels:
+        delta = diff_messages(parent_lists.get(channel, []), checkpoint["channel_values"][channel])
+        if delta is None:
+            return None
+        deltas[channel] = delta
+
+    stripped = {**checkpoint, "channel_values": {k: v for k, v in checkpoint["channel_values"].items() if k not in deltas}}
+    return {"base": base_id, "depth": depth, "checkpoint": stripped, "deltas": deltas}
+
+def decode_delta(payload: dict, parent_lists: dict[str, list]) -> tuple[dict, dict[str, list]]:
+    """
+    Rebuilds the checkpoint of a delta payload. Returns the checkpoint and its message lists.
+    """
+    lists = {channel: apply_delta(parent_lists.get(channel, []), delta) for channel, delta in payload["deltas"].items()}
+    checkpoint = payload["checkpoint"]
+    checkpoint["channel_values"] = {**checkpoint["channel_values"], **lists}
+
+    return checkpoint, lists
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    import tempfile
+    from langchain_core.messages import HumanMessage
+    from pooled_sqlite_saver import PooledSqliteSaver, create_benchmark_graph
+
+    turns = 300
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, interval in [("full checkpoints", None), ("delta checkpoints", 16)]:
+            path = os.path.join(tmp, f"{interval}.db")
+            saver = PooledSqliteSaver(path, delta_snapshot_interval=interval)
+            graph = create_benchmark_graph(saver)
+            config = {"configurable": {"thread_id": "long-thread"}}
+
+            for turn in range(turns):
+                graph.invoke({"messages": [HumanMessage(content=f"Pergunta número {turn}, um pouco mais longa que o normal.")]}, config=config)
+
+            start = time.perf_counter()
+            history = list(graph.get_state_history(config))
+            history_seconds = time.perf_counter() - start
+
+            with saver._reader() as connection:
+                stored_bytes = connection.execute("SELECT SUM(LENGTH(checkpoint)) FROM checkpoints").fetchone()[0]
+
+            print(f"{label:<18} | checkpoints: {len(history)} | stored: {stored_bytes / 1024:8.0f} KB "
+                  f"| history scan: {history_seconds:.3f}s | last state messages: {len(history[0].values['messages'])}")
+            saver.close()
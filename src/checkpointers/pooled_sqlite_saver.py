@@ -0,0 +1,543 @@
+import sys
+import time
+import queue
+import random
+import sqlite3
+import asyncio
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, \
+    CheckpointTuple, get_checkpoint_id
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    from langgraph.checkpoint.base import WRITES_IDX_MAP
+except ImportError:
+    WRITES_IDX_MAP = {}
+
+from delta_encoding import DELTA_TYPE_PREFIX, decode_delta, encode_delta, message_channels
+
+# SQLite checkpointer built for many concurrent threads.
+# The SqliteSaver used in simple_chat_with_summ_external_memory.py shares a single connection (behind a lock) for
+# reads and writes, and commits each checkpoint on its own. Here:
+# - the database runs in WAL mode, so readers don't block the writer and vice versa;
+# - the reads use a pool of connections, one per concurrent reader;
+# - a single writer thread drains the queue of pending writes and commits all of them in one transaction
+#   (group commit), so N concurrent checkpoints cost one fsync instead of N;
+# - the SQL statements are constants, so each connection compiles them once (sqlite3 statement cache).
+# Optionally, the message lists are stored as deltas against the parent checkpoint (see delta_encoding.py).
+# The tables are the same of the SqliteSaver (plus a nullable step column), so existing databases can be opened by both
+# savers, but only without the deltas: the SqliteSaver can't decode the "delta+" rows, so a database written with
+# delta_snapshot_interval must only be read by this saver.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# The step of the checkpoint (metadata["step"]) is also stored in its own indexed column, used by checkpoint_history.py.
+# Databases created by the SqliteSaver get the column on the first open (see migrate_step_column), and a trigger fills
+# it in the rows the SqliteSaver keeps writing (its INSERT doesn't know the column).
+STEP_INDEX = "CREATE INDEX IF NOT EXISTS checkpoints_step ON checkpoints (thread_id, checkpoint_ns, step, checkpoint_id)"
+STEP_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS checkpoints_fill_step AFTER INSERT ON checkpoints
+FOR EACH ROW WHEN NEW.step IS NULL AND NEW.metadata IS NOT NULL
+BEGIN
+    UPDATE checkpoints SET step = json_extract(CAST(NEW.metadata AS TEXT), '$.step') WHERE rowid = NEW.rowid;
+END
+"""
+
+INSERT_CHECKPOINT = ("INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata, step) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+UPSERT_WRITE = ("INSERT OR REPLACE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+INSERT_WRITE = ("INSERT OR IGNORE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+SELECT_CHECKPOINT = ("SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata FROM checkpoints "
+                     "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?")
+SELECT_LAST_CHECKPOINT = ("SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata FROM checkpoints "
+                          "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1")
+DELETE_THREAD_CHECKPOINTS = "DELETE FROM checkpoints WHERE thread_id = ?"
+DELETE_THREAD_WRITES = "DELETE FROM writes WHERE thread_id = ?"
+# list() reads the checkpoints in pages of this size, and never holds a reader connection while the caller iterates
+LIST_PAGE_SIZE = 100
+# Max seconds waited for a free reader connection
+READER_TIMEOUT = 30.0
+SELECT_WRITES = ("SELECT task_id, channel, type, value FROM writes "
+                 "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx")
+
+
+def migrate_step_column(connection: sqlite3.Connection):
+    """
+    Adds the step column (filled from the JSON metadata), its index and the trigger that fills it in the rows inserted
+    without it to an existing checkpoints table.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(checkpoints)")]
+        if "step" not in columns:
+            connection.execute("ALTER TABLE checkpoints ADD COLUMN step INTEGER")
+            connection.execute("UPDATE checkpoints SET step = json_extract(CAST(metadata AS TEXT), '$.step') WHERE metadata IS NOT NULL")
+        connection.execute(STEP_TRIGGER)
+        connection.execute(STEP_INDEX)
+        connection.execute("COMMIT")
+    except Exception:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+
+
+class PooledSqliteSaver(BaseCheckpointSaver):
+    """
+    Args:
+        path: path of the SQLite database file.
+        serde: the serializer of the checkpoints and writes. Default: the LangGraph JsonPlusSerializer.
+        readers: number of connections in the readers pool.
+        max_batch: max number of queued writes committed in the same transaction.
+        delta_snapshot_interval: if given, the message lists are stored as deltas against the parent checkpoint,
+            with a full snapshot every delta_snapshot_interval checkpoints of a lineage. Don't use it on a database
+            also read by the SqliteSaver.
+        lists_cache_size: max number of checkpoints whose message lists are kept decoded, to encode and decode the deltas.
+    """
+
+    def __init__(self, path: str, *, serde=None, readers: int = 4, max_batch: int = 512,
+                 delta_snapshot_interval: Optional[int] = None, lists_cache_size: int = 1024):
+        super().__init__(serde=serde)
+        self.path = path
+        self.max_batch = max_batch
+        self.delta_snapshot_interval = delta_snapshot_interval
+        self.jsonplus_serde = JsonPlusSerializer()
+
+        # (thread_id, checkpoint_ns, checkpoint_id) -> (message lists, delta depth) of recently used checkpoints
+        self._lists_cache = OrderedDict()
+        self._lists_cache_size = lists_cache_size
+        self._lists_lock = threading.Lock()
+
+        self.commits = 0
+        self.committed_writes = 0
+
+        self._writer_connection = self._connect()
+        self._writer_connection.executescript(SCHEMA)
+        migrate_step_column(self._writer_connection)
+
+        self._readers = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(self._connect())
+
+        self._write_queue = queue.Queue()
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="checkpoint-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: autocommit mode, the writer thread opens the transactions explicitly
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only fsyncs at the WAL checkpoints, and a crash can't corrupt the database
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    def close(self):
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._write_queue.put(None)
+        self._writer.join()
+        self._writer_connection.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+    # 1. Reads and writes infrastructure
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        try:
+            connection = self._readers.get(timeout=READER_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"No reader connection released in {READER_TIMEOUT}s") from None
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
+
+    def _submit(self, statements: list[tuple[str, list[tuple]]]) -> Future:
+        """
+        Queues statements to be executed (each with many rows) in the next group commit.
+        The future is resolved once they are committed.
+        """
+        future = Future()
+        # Under the lock, no write is queued behind the stop marker of close(), where it would never be committed
+        with self._submit_lock:
+            if self._closed:
+                future.set_exception(RuntimeError("The saver is closed"))
+            else:
+                self._write_queue.put((statements, future))
+        return future
+
+    def _commit(self, connection: sqlite3.Connection, batch: list[tuple[list, Future]]):
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for statements, _ in batch:
+                for sql, rows in statements:
+                    connection.executemany(sql, rows)
+            connection.execute("COMMIT")
+        except BaseException:
+            # BEGIN itself can fail (e.g. busy database), and then there is no transaction to roll back
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    def _write_batch(self, connection: sqlite3.Connection, batch: list[tuple[list, Future]]):
+        try:
+            self._commit(connection, batch)
+        except Exception:
+            # A bad write must not fail the others of the same group: they are retried one by one
+            for item in batch:
+                try:
+                    self._commit(connection, [item])
+                    item[1].set_result(None)
+                except Exception as error:
+                    item[1].set_exception(error)
+        else:
+            self.commits += 1
+            self.committed_writes += len(batch)
+            for _, future in batch:
+                future.set_result(None)
+
+    def _write_loop(self):
+        connection = self._writer_connection
+        while (first := self._write_queue.get()) is not None:
+            batch = [first]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(connection, batch)
+            except BaseException as error:
+                # Whatever happens, no caller is left waiting on its future
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+            if stop:
+                break
+
+    # 2. Checkpoint encoding
+
+    def _cache_lists(self, key: tuple, lists: dict[str, list], depth: int):
+        with self._lists_lock:
+            self._lists_cache[key] = ({channel: list(value) for channel, value in lists.items()}, depth)
+            self._lists_cache.move_to_end(key)
+            if len(self._lists_cache) > self._lists_cache_size:
+                self._lists_cache.popitem(last=False)
+
+    def forget_lists(self, keys: Iterable[tuple]):
+        """
+        Drops the cached message lists of deleted checkpoints, given as (thread_id, checkpoint_ns, checkpoint_id).
+        Called by delete_thread and by the retention (retention.py), which deletes the rows with its own connection.
+        """
+        with self._lists_lock:
+            for key in keys:
+                self._lists_cache.pop(tuple(key), None)
+
+    def _message_lists(self, connection: sqlite3.Connection, thread_id: str, checkpoint_ns: str,
+                       checkpoint_id: str) -> Optional[tuple[dict[str, list], int]]:
+        """
+        Returns the message lists and the delta depth of a stored checkpoint, rebuilding it if it's not cached.
+        """
+        key = (thread_id, checkpoint_ns, checkpoint_id)
+        with self._lists_lock:
+            if (cached := self._lists_cache.get(key)) is not None:
+                self._lists_cache.move_to_end(key)
+                return cached
+
+        row = connection.execute(SELECT_CHECKPOINT, key).fetchone()
+        if row is None:
+            return None
+        self._decode_checkpoint(connection, thread_id, checkpoint_ns, checkpoint_id, row[2], row[3])
+
+        with self._lists_lock:
+            return self._lists_cache.get(key)
+
+    def _encode_checkpoint(self, config: RunnableConfig, checkpoint: Checkpoint) -> tuple[str, bytes]:
+        if not self.delta_snapshot_interval:
+            return self.serde.dumps_typed(checkpoint)
+
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        lists = {channel: checkpoint["channel_values"][channel] for channel in message_channels(checkpoint)}
+
+        payload = None
+        if parent_id:
+            with self._reader() as connection:
+                parent = self._message_lists(connection, thread_id, checkpoint_ns, parent_id)
+            if parent is not None and parent[1] + 1 < self.delta_snapshot_interval:
+                payload = encode_delta(checkpoint, parent[0], base_id=parent_id, depth=parent[1] + 1)
+
+        key = (thread_id, checkpoint_ns, checkpoint["id"])
+        if payload is None:
+            self._cache_lists(key, lists, depth=0)
+            return self.serde.dumps_typed(checkpoint)
+
+        self._cache_lists(key, lists, depth=payload["depth"])
+        type_, blob = self.serde.dumps_typed(payload)
+        return DELTA_TYPE_PREFIX + type_, blob
+
+    def _decode_checkpoint(self, connection: sqlite3.Connection, thread_id: str, checkpoint_ns: str,
+                           checkpoint_id: str, type_: str, blob: bytes) -> Checkpoint:
+        key = (thread_id, checkpoint_ns, checkpoint_id)
+
+        if not type_.startswith(DELTA_TYPE_PREFIX):
+            checkpoint = self.serde.loads_typed((type_, blob))
+            if self.delta_snapshot_interval:
+                self._cache_lists(key, {c: checkpoint["channel_values"][c] for c in message_channels(checkpoint)}, depth=0)
+            return checkpoint
+
+        # At most delta_snapshot_interval deltas are applied, until a snapshot (or a cached ancestor) is found
+        payload = self.serde.loads_typed((type_[len(DELTA_TYPE_PREFIX):], blob))
+        base = self._message_lists(connection, thread_id, checkpoint_ns, payload["base"])
+        if base is None:
+            raise ValueError(f"Missing base checkpoint {payload['base']} of the delta checkpoint {checkpoint_id}")
+
+        checkpoint, lists = decode_delta(payload, base[0])
+        self._cache_lists(key, lists, depth=payload["depth"])
+        return checkpoint
+
+    def snapshot(self, connection: sqlite3.Connection, thread_id: str, checkpoint_ns: str,
+                 checkpoint_id: str) -> Optional[tuple[str, bytes]]:
+        """
+        Returns the full (not delta) encoding of a stored checkpoint, so its delta bases can be deleted (retention.py).
+        """
+        row = connection.execute(SELECT_CHECKPOINT, (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+        if row is None:
+            return None
+        checkpoint = self._decode_checkpoint(connection, thread_id, checkpoint_ns, checkpoint_id, row[2], row[3])
+        return self.serde.dumps_typed(checkpoint)
+
+    def _row_to_tuple(self, connection, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, blob, metadata = row
+        writes = connection.execute(SELECT_WRITES, (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=self._decode_checkpoint(connection, thread_id, checkpoint_ns, checkpoint_id, type_, blob),
+            metadata=self.jsonplus_serde.loads(metadata) if metadata is not None else {},
+            parent_config=({"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                           if parent_checkpoint_id else None),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, channel, type_, value in writes],
+        )
+
+    # 3. The BaseCheckpointSaver interface
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        with self._reader() as connection:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = connection.execute(SELECT_CHECKPOINT, (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+            else:
+                row = connection.execute(SELECT_LAST_CHECKPOINT, (thread_id, checkpoint_ns)).fetchone()
+
+            return self._row_to_tuple(connection, thread_id, checkpoint_ns, row) if row else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        conditions, params = [], []
+        if config is not None:
+            conditions.append("thread_id = ?")
+            params.append(str(config["configurable"]["thread_id"]))
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_id)
+
+        # Pages are read with keyset pagination, in the order (checkpoint_id, thread_id, checkpoint_ns) DESC.
+        # The metadata filter is applied in Python, so with a filter the limit can't be pushed into the query.
+        columns = "thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata"
+        order = "ORDER BY checkpoint_id DESC, thread_id DESC, checkpoint_ns DESC"
+        yielded = 0
+        last_key = None
+
+        while limit is None or yielded < limit:
+            page_conditions, page_params = list(conditions), list(params)
+            if last_key is not None:
+                page_conditions.append("(checkpoint_id, thread_id, checkpoint_ns) < (?, ?, ?)")
+                page_params.extend(last_key)
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            page_size = LIST_PAGE_SIZE if limit is None or filter else min(LIST_PAGE_SIZE, limit - yielded)
+
+            page = []
+            with self._reader() as connection:
+                rows = connection.execute(f"SELECT {columns} FROM checkpoints {where} {order} LIMIT ?", [*page_params, page_size]).fetchall()
+                for thread_id, checkpoint_ns, *row in rows:
+                    if limit is not None and yielded + len(page) >= limit:
+                        break
+                    if filter:
+                        metadata = self.jsonplus_serde.loads(row[-1]) if row[-1] is not None else {}
+                        if any(metadata.get(key) != value for key, value in filter.items()):
+                            continue
+                    page.append(self._row_to_tuple(connection, thread_id, checkpoint_ns, tuple(row)))
+
+            # The connection is back in the pool before the caller gets the tuples, so a half consumed iterator
+            # doesn't hold it
+            yield from page
+            yielded += len(page)
+            if len(rows) < page_size:
+                return
+            last_key = (rows[-1][2], rows[-1][0], rows[-1][1])
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, blob = self._encode_checkpoint(config, checkpoint)
+
+        row = (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+               type_, blob, self.jsonplus_serde.dumps(metadata), metadata.get("step"))
+        # Waiting for the commit keeps the read-your-writes behavior of the SqliteSaver
+        self._submit([(INSERT_CHECKPOINT, [row])]).result()
+
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        # Special writes (errors, interrupts) replace the previous ones, regular writes are kept if already stored
+        sql = UPSERT_WRITE if all(channel in WRITES_IDX_MAP for channel, _ in writes) else INSERT_WRITE
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, *self.serde.dumps_typed(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        self._submit([(sql, rows)]).result()
+
+    def delete_thread(self, thread_id: str) -> None:
+        thread_id = str(thread_id)
+        self._submit([(DELETE_THREAD_CHECKPOINTS, [(thread_id,)]), (DELETE_THREAD_WRITES, [(thread_id,)])]).result()
+        with self._lists_lock:
+            keys = [key for key in self._lists_cache if key[0] == thread_id]
+        self.forget_lists(keys)
+
+    def get_next_version(self, current: Optional[str], channel) -> str:
+        # Same versions format of the SqliteSaver and the MemorySaver
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # The async interface runs the sync methods in the default executor, so the saver also works with astream/ainvoke
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        tuples = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = "") -> None:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put_writes, config, writes, task_id, task_path)
+
+
+# 4. Benchmark against the SqliteSaver setup of simple_chat_with_summ_external_memory.py
+
+def create_benchmark_graph(checkpointer):
+    from langgraph.graph import MessagesState, StateGraph, START, END
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+
+    chat_model = FakeChatModel(replies=["Resposta do modelo falso para a pergunta."])
+
+    def chat_node(state: MessagesState):
+        return {"messages": [chat_model.invoke(state["messages"])]}
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("chat node", chat_node)
+    graph.add_edge(START, "chat node")
+    graph.add_edge("chat node", END)
+
+    return graph.compile(checkpointer=checkpointer)
+
+def run_benchmark(graph, n_threads: int, turns: int) -> float:
+    from concurrent.futures import ThreadPoolExecutor
+    from langchain_core.messages import HumanMessage
+
+    def conversation(thread_index):
+        config = {"configurable": {"thread_id": f"bench-{thread_index}-{time.time_ns()}"}}
+        for turn in range(turns):
+            graph.invoke({"messages": [HumanMessage(content=f"Pergunta {turn}")]}, config=config)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(conversation, range(n_threads)))
+
+    return n_threads * turns / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    turns = 20
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_threads in [1, 8, 32, 64]:
+            # The current setup: one shared connection
+            connection = sqlite3.connect(database=f"{tmp}/sqlite_saver_{n_threads}.db", check_same_thread=False)
+            baseline = run_benchmark(create_benchmark_graph(SqliteSaver(connection)), n_threads, turns)
+            connection.close()
+
+            saver = PooledSqliteSaver(f"{tmp}/pooled_saver_{n_threads}.db", readers=min(n_threads, 16))
+            pooled = run_benchmark(create_benchmark_graph(saver), n_threads, turns)
+            print(f"Threads: {n_threads:>3} | SqliteSaver: {baseline:8.1f} turns/s | PooledSqliteSaver: {pooled:8.1f} turns/s "
+                  f"| writes per commit: {saver.committed_writes / max(1, saver.commits):.1f}")
+            saver.close()
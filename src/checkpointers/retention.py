@@ -0,0 +1,462 @@
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from delta_encoding import DELTA_TYPE_PREFIX
+
+# Retention of the checkpoints of the MemorySaver and of the SQLite savers (SqliteSaver, PooledSqliteSaver).
+# Every super-step of every thread writes a checkpoint, and update_state (time_travel.py) creates forks that are
+# usually abandoned, so the RAM of the MemorySaver and the SQLite file grow without bound. The policy:
+# - keeps the last N checkpoints of the lineage of the thread head (the latest checkpoint);
+# - keeps only the head (leaf) of each other fork, or drops the abandoned forks;
+# - expires the threads without new checkpoints for more than X seconds.
+# It's safe to run online (except on the plain MemorySaver, which has no lock): the head of a thread is never
+# deleted, and the deletions (in small transactions for SQLite) are skipped if the thread got a new checkpoint after
+# the plan was made.
+
+logger = logging.getLogger(__name__)
+
+
+# 1. The policy
+
+def checkpoint_time(checkpoint_id: str) -> Optional[float]:
+    """
+    Unix time of a checkpoint, read from its id (LangGraph uses time ordered uuid6 ids). None if it's not a uuid1/6.
+    """
+    try:
+        value = uuid.UUID(checkpoint_id)
+    except ValueError:
+        return None
+
+    if value.version == 6:
+        # 60 bits timestamp in the fields time_high (32 bits), time_mid (16 bits) and time_low (12 bits)
+        timestamp = ((value.int >> 96) << 28) | (((value.int >> 80) & 0xFFFF) << 12) | ((value.int >> 64) & 0x0FFF)
+    elif value.version == 1:
+        timestamp = value.time
+    else:
+        return None
+    # Gregorian epoch (1582-10-15) to unix epoch, in 100ns intervals
+    return (timestamp - 0x01B21DD213814000) / 1e7
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Args:
+        keep_last: number of checkpoints kept in the lineage of the thread head. None keeps the whole lineage.
+        keep_fork_heads: if True, the leaf of each abandoned fork is kept (its history is dropped).
+            If False, the abandoned forks are deleted.
+        max_idle_seconds: threads whose latest checkpoint is older than it are deleted. None disables the expiration.
+    """
+    keep_last: Optional[int] = 20
+    keep_fork_heads: bool = True
+    max_idle_seconds: Optional[float] = None
+
+    def is_expired(self, head_id: str, now: Optional[float] = None) -> bool:
+        if self.max_idle_seconds is None:
+            return False
+        created = checkpoint_time(head_id)
+        return created is not None and (now or time.time()) - created > self.max_idle_seconds
+
+    def to_delete(self, parents: dict[str, Optional[str]]) -> set[str]:
+        """
+        Selects the checkpoints of a thread namespace to be deleted.
+
+        Args:
+            parents: checkpoint_id -> parent_checkpoint_id, for all the checkpoints of the namespace.
+        """
+        if not parents:
+            return set()
+
+        head = max(parents)
+        keep = set()
+        checkpoint_id = head
+        while checkpoint_id is not None and checkpoint_id in parents:
+            if self.keep_last is not None and len(keep) >= self.keep_last:
+                break
+            keep.add(checkpoint_id)
+            checkpoint_id = parents[checkpoint_id]
+
+        if self.keep_fork_heads:
+            with_children = {parent for parent in parents.values() if parent is not None}
+            keep.update(checkpoint_id for checkpoint_id in parents if checkpoint_id not in with_children)
+
+        return set(parents) - keep
+
+
+@dataclass
+class RetentionReport:
+    threads_expired: int = 0
+    checkpoints_deleted: int = 0
+    writes_deleted: int = 0
+    snapshots_rewritten: int = 0
+    pages_freed: int = 0
+    skipped_threads: int = 0
+
+
+# 2. The MemorySaver
+
+class MemoryRetention:
+    """
+    Applies a retention policy to the dicts of a MemorySaver (storage, writes and, in newer versions, blobs) or of a
+    TieredMemorySaver. The plan of each thread (the deleted checkpoints, and the blobs no longer referenced by the kept
+    ones) is made without holding any lock, and the deletions are skipped if the thread got a new checkpoint meanwhile.
+    With the TieredMemorySaver, the deletions go through its prune_thread, under its lock and keeping its bookkeeping,
+    so the retention can run online and it also covers the spilled threads. The plain MemorySaver writes its dicts
+    without a lock: run the retention only while no graph uses it (e.g. between two batches of runs).
+
+    Args:
+        saver: the MemorySaver or the TieredMemorySaver.
+        policy: the retention policy.
+    """
+
+    def __init__(self, saver, policy: RetentionPolicy):
+        self.saver = saver
+        self.policy = policy
+        self.tiered = hasattr(saver, "prune_thread")
+
+    def run_once(self, now: Optional[float] = None) -> RetentionReport:
+        report = RetentionReport()
+
+        thread_ids = self.saver.thread_ids() if self.tiered else list(self.saver.storage)
+        for thread_id in thread_ids:
+            namespaces, blob_keys = self._thread_checkpoints(thread_id)
+            checkpoint_ids = [checkpoint_id for checkpoints in namespaces.values() for checkpoint_id in checkpoints]
+            if not checkpoint_ids:
+                continue
+            head = max(checkpoint_ids)
+
+            if self.policy.is_expired(head, now):
+                writes_deleted = self._prune(thread_id, head, None, [])
+                if writes_deleted is None:
+                    report.skipped_threads += 1
+                    continue
+                report.checkpoints_deleted += len(checkpoint_ids)
+                report.writes_deleted += writes_deleted
+                report.threads_expired += 1
+                continue
+
+            deleted = set()
+            for checkpoint_ns, checkpoints in namespaces.items():
+                # The parent id is the last field of the stored tuples
+                parents = {checkpoint_id: saved[-1] for checkpoint_id, saved in checkpoints.items()}
+                deleted.update((checkpoint_ns, checkpoint_id) for checkpoint_id in self.policy.to_delete(parents))
+            if not deleted:
+                continue
+
+            writes_deleted = self._prune(thread_id, head, deleted, self._unreferenced_blobs(namespaces, deleted, blob_keys))
+            if writes_deleted is None:
+                report.skipped_threads += 1
+                continue
+            report.checkpoints_deleted += len(deleted)
+            report.writes_deleted += writes_deleted
+
+        return report
+
+    def _thread_checkpoints(self, thread_id: str) -> tuple[dict, list]:
+        if self.tiered:
+            return self.saver.thread_checkpoints(thread_id)
+        storage = {ns: dict(checkpoints) for ns, checkpoints in list(self.saver.storage.get(thread_id, {}).items())}
+        blobs = getattr(self.saver, "blobs", None) or {}
+        return storage, [key for key in list(blobs) if key[0] == thread_id]
+
+    def _unreferenced_blobs(self, namespaces: dict, deleted: set[tuple[str, str]], blob_keys: list[tuple]) -> list[tuple]:
+        """
+        Selects the channel values (blobs) no longer referenced by the kept checkpoints.
+        """
+        if not blob_keys:
+            return []
+
+        referenced = {}
+        for checkpoint_ns, checkpoints in namespaces.items():
+            for checkpoint_id, saved in checkpoints.items():
+                if (checkpoint_ns, checkpoint_id) in deleted:
+                    continue
+                for channel, version in self.saver.serde.loads_typed(saved[0])["channel_versions"].items():
+                    referenced.setdefault((checkpoint_ns, channel), set()).add(version)
+
+        unreferenced = []
+        for key in blob_keys:
+            _, checkpoint_ns, channel, version = key
+            versions = referenced.get((checkpoint_ns, channel))
+            # Blobs newer than the kept checkpoints may belong to a checkpoint being written right now
+            if versions and version not in versions and version < max(versions):
+                unreferenced.append(key)
+        return unreferenced
+
+    def _prune(self, thread_id: str, head: str, checkpoints: Optional[set[tuple[str, str]]], blob_keys: list[tuple]) -> Optional[int]:
+        """
+        Deletes the checkpoints (all the thread if None), their writes and the blobs.
+        Returns the number of deleted writes, or None if the thread got a new checkpoint after the plan was made.
+        """
+        if self.tiered:
+            return self.saver.prune_thread(thread_id, head, checkpoints, blob_keys)
+
+        storage = self.saver.storage.get(thread_id, {})
+        if max((checkpoint_id for ns in storage.values() for checkpoint_id in ns), default=None) != head:
+            return None
+
+        write_keys = [key for key in list(self.saver.writes) if key[0] == thread_id and (checkpoints is None or key[1:] in checkpoints)]
+        writes_deleted = sum(len(self.saver.writes.get(key, {})) for key in write_keys)
+        if checkpoints is None and hasattr(self.saver, "delete_thread"):
+            self.saver.delete_thread(thread_id)
+            return writes_deleted
+        if checkpoints is None:
+            # Older MemorySaver versions, without delete_thread
+            checkpoints = {(ns, checkpoint_id) for ns, ids in storage.items() for checkpoint_id in ids}
+
+        for checkpoint_ns, checkpoint_id in checkpoints:
+            storage.get(checkpoint_ns, {}).pop(checkpoint_id, None)
+        for key in write_keys:
+            self.saver.writes.pop(key, None)
+        blobs = getattr(self.saver, "blobs", None) or {}
+        for key in blob_keys:
+            blobs.pop(key, None)
+        if not any(storage.values()):
+            self.saver.storage.pop(thread_id, None)
+        return writes_deleted
+
+
+# 3. The SQLite savers
+
+SELECT_THREADS = "SELECT DISTINCT thread_id FROM checkpoints"
+SELECT_THREAD_CHECKPOINTS = "SELECT checkpoint_ns, checkpoint_id, parent_checkpoint_id, type FROM checkpoints WHERE thread_id = ?"
+SELECT_THREAD_HEAD = "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?"
+DELETE_CHECKPOINT = "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+DELETE_CHECKPOINT_WRITES = "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+UPDATE_CHECKPOINT_BLOB = "UPDATE checkpoints SET type = ?, checkpoint = ? WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+
+
+class SqliteRetention:
+    """
+    Applies a retention policy to a database written by the SqliteSaver or the PooledSqliteSaver.
+
+    Args:
+        path: path of the SQLite database file.
+        policy: the retention policy.
+        saver: the PooledSqliteSaver of the database, required if it stores delta checkpoints. Its cache of decoded
+            message lists is cleared of the deleted checkpoints.
+        batch_size: max number of checkpoints deleted per transaction.
+        pause_seconds: pause between transactions, so the deletions and the vacuum don't starve the graph runs.
+        vacuum_pages: max number of free pages returned to the file system per vacuum step.
+    """
+
+    def __init__(self, path: str, policy: RetentionPolicy, saver=None, batch_size: int = 200,
+                 pause_seconds: float = 0.05, vacuum_pages: int = 256):
+        self.policy = policy
+        self.saver = saver
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.vacuum_pages = vacuum_pages
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA busy_timeout=5000")
+
+    def close(self):
+        self.connection.close()
+
+    def rollback(self):
+        """
+        Rolls back the transaction left open by a failed step, if any.
+        """
+        if self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+
+    def _head(self, thread_id: str) -> Optional[str]:
+        return self.connection.execute(SELECT_THREAD_HEAD, (thread_id,)).fetchone()[0]
+
+    def _delete_batches(self, thread_id: str, head: str, rows: list[tuple[str, str]], report: RetentionReport) -> bool:
+        """
+        Deletes the (checkpoint_ns, checkpoint_id) rows in small transactions.
+        Stops (returns False) if the thread got a new checkpoint in the meantime: it will be planned again in the next run.
+        """
+        for start in range(0, len(rows), self.batch_size):
+            batch = [(thread_id, ns, checkpoint_id) for ns, checkpoint_id in rows[start:start + self.batch_size]]
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self._head(thread_id) != head:
+                    self.connection.execute("ROLLBACK")
+                    return False
+                report.writes_deleted += self.connection.executemany(DELETE_CHECKPOINT_WRITES, batch).rowcount
+                report.checkpoints_deleted += self.connection.executemany(DELETE_CHECKPOINT, batch).rowcount
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.rollback()
+                raise
+            # The saver keeps the decoded message lists of recent checkpoints, which must not outlive the rows
+            if self.saver is not None:
+                self.saver.forget_lists(batch)
+            time.sleep(self.pause_seconds)
+        return True
+
+    def _rewrite_orphan_deltas(self, thread_id: str, rows: list[tuple], deleted: set[tuple[str, str]], report: RetentionReport):
+        """
+        A delta checkpoint is decoded from its parent, so the kept deltas whose parent will be deleted are
+        rewritten as full snapshots before the deletion.
+        """
+        orphans = [(ns, checkpoint_id) for ns, checkpoint_id, parent_id, type_ in rows
+                   if type_ and type_.startswith(DELTA_TYPE_PREFIX) and (ns, checkpoint_id) not in deleted
+                   and (ns, parent_id) in deleted]
+        if not orphans:
+            return
+        if self.saver is None:
+            raise ValueError("The database has delta checkpoints: the PooledSqliteSaver is required to rewrite them")
+
+        # Snapshots are built before any update, while all the bases still exist
+        with self.saver._reader() as connection:
+            snapshots = [(*self.saver.snapshot(connection, thread_id, ns, checkpoint_id), thread_id, ns, checkpoint_id)
+                         for ns, checkpoint_id in orphans]
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany(UPDATE_CHECKPOINT_BLOB, snapshots)
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.rollback()
+            raise
+        report.snapshots_rewritten += len(snapshots)
+
+    def run_once(self, now: Optional[float] = None) -> RetentionReport:
+        report = RetentionReport()
+        thread_ids = [row[0] for row in self.connection.execute(SELECT_THREADS).fetchall()]
+
+        for thread_id in thread_ids:
+            rows = self.connection.execute(SELECT_THREAD_CHECKPOINTS, (thread_id,)).fetchall()
+            if not rows:
+                continue
+            head = max(checkpoint_id for _, checkpoint_id, _, _ in rows)
+
+            if self.policy.is_expired(head, now):
+                completed = self._delete_batches(thread_id, head, [(ns, checkpoint_id) for ns, checkpoint_id, _, _ in rows], report)
+                report.threads_expired += completed
+                report.skipped_threads += not completed
+                continue
+
+            deleted = set()
+            for checkpoint_ns in {ns for ns, _, _, _ in rows}:
+                parents = {checkpoint_id: parent_id for ns, checkpoint_id, parent_id, _ in rows if ns == checkpoint_ns}
+                deleted.update((checkpoint_ns, checkpoint_id) for checkpoint_id in self.policy.to_delete(parents))
+            if not deleted:
+                continue
+
+            self._rewrite_orphan_deltas(thread_id, rows, deleted, report)
+            # The oldest checkpoints are deleted first
+            if not self._delete_batches(thread_id, head, sorted(deleted, key=lambda row: row[1]), report):
+                report.skipped_threads += 1
+
+        report.pages_freed = self.vacuum()
+        return report
+
+    def vacuum(self) -> int:
+        """
+        Returns the free pages to the file system a few at a time, and truncates the WAL.
+        Works only on databases with auto_vacuum=INCREMENTAL (see enable_incremental_vacuum). Otherwise, the free
+        pages are reused by the next writes, so the file stops growing but doesn't shrink.
+        """
+        freed = 0
+        if self.connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while (free_pages := self.connection.execute("PRAGMA freelist_count").fetchone()[0]) > 0:
+                self.connection.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+                step = free_pages - self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+                if step <= 0:
+                    # Nothing freed (e.g. a reader holds the pages, or the writes refill the freelist): next run
+                    break
+                freed += step
+                time.sleep(self.pause_seconds)
+        # PASSIVE doesn't wait for the readers and writers, it copies what it can from the WAL to the database
+        self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return freed
+
+
+def enable_incremental_vacuum(path: str):
+    """
+    Switches a database to auto_vacuum=INCREMENTAL. It rewrites the whole file (VACUUM), so run it offline, once.
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    connection.execute("VACUUM")
+    connection.close()
+
+
+# 4. Running the retention in the background
+
+class RetentionWorker(threading.Thread):
+    """
+    Runs a MemoryRetention or a SqliteRetention every interval_seconds, in a daemon thread.
+    A failed run is logged (and its open transaction rolled back), and the next one runs as scheduled.
+    """
+
+    def __init__(self, retention, interval_seconds: float = 60.0):
+        super().__init__(name="checkpoint-retention", daemon=True)
+        self.retention = retention
+        self.interval_seconds = interval_seconds
+        self.last_report = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.last_report = self.retention.run_once()
+            except Exception:
+                logger.exception("Checkpoint retention failed, retrying in %s seconds", self.interval_seconds)
+                if (rollback := getattr(self.retention, "rollback", None)) is not None:
+                    try:
+                        rollback()
+                    except Exception:
+                        logger.exception("Rollback of the checkpoint retention failed")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+    from pooled_sqlite_saver import PooledSqliteSaver, create_benchmark_graph
+
+    def chat_with_forks(graph, thread_id: str, turns: int = 60, forks: int = 10):
+        config = {"configurable": {"thread_id": thread_id}}
+        for turn in range(turns):
+            graph.invoke({"messages": [HumanMessage(content=f"Pergunta {turn}")]}, config=config)
+            # As in time_travel.py: a past state is edited, creating a fork that is never continued
+            if turn % (turns // forks) == 0:
+                past = list(graph.get_state_history(config))[-2]
+                graph.update_state(past.config, {"messages": [HumanMessage(content=f"Edição {turn}")]})
+        # The fork above can be the latest checkpoint: the conversation continues from the main lineage
+        graph.invoke({"messages": [HumanMessage(content="Última pergunta")]}, config=config)
+
+    policy = RetentionPolicy(keep_last=10, keep_fork_heads=True)
+
+    # 1. The MemorySaver
+    saver = MemorySaver()
+    graph = create_benchmark_graph(saver)
+    for thread in range(5):
+        chat_with_forks(graph, f"thread-{thread}")
+    before = sum(len(c) for ns in saver.storage.values() for c in ns.values())
+    report = MemoryRetention(saver, policy).run_once()
+    print(f"MemorySaver: {before} checkpoints -> {before - report.checkpoints_deleted} | {report}")
+    print("Head state still readable:", len(graph.get_state({"configurable": {"thread_id": "thread-0"}}).values["messages"]), "messages")
+
+    # 2. The PooledSqliteSaver with delta checkpoints, and the expiration of idle threads
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "checkpoints.db")
+        enable_incremental_vacuum(path)
+        saver = PooledSqliteSaver(path, delta_snapshot_interval=16)
+        graph = create_benchmark_graph(saver)
+        for thread in range(5):
+            chat_with_forks(graph, f"thread-{thread}")
+        size_before = os.path.getsize(path)
+
+        retention = SqliteRetention(path, policy, saver=saver)
+        print(f"\nSQLite: {size_before / 1024:.0f} KB | {retention.run_once()}")
+        print("Head state still readable:", len(graph.get_state({"configurable": {"thread_id": "thread-0"}}).values["messages"]), "messages")
+
+        retention.policy = RetentionPolicy(keep_last=None, max_idle_seconds=0)
+        print(f"Expiring the idle threads | {retention.run_once()} | file: {os.path.getsize(path) / 1024:.0f} KB")
+        retention.close()
+        saver.close()
@@ -0,0 +1,331 @@
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+
+# MemorySaver with a memory budget.
+# The MemorySaver used by the Chatbots of human_in_the_loop keeps every thread in RAM forever. This saver keeps the
+# recently used threads in the MemorySaver dicts, up to max_resident_bytes, and moves the least recently used ones
+# to a local SQLite file (spill). A spilled thread is loaded back (fault in) the next time it's read or written,
+# so invoke/get_state work the same. The stored values are already serialized by the MemorySaver, so the size of
+# a thread is the size of its bytes, and spilling it doesn't serialize the state again.
+
+SPILL_SCHEMA = "CREATE TABLE IF NOT EXISTS spilled_threads (thread_id TEXT PRIMARY KEY, data BLOB NOT NULL)"
+
+
+def _size(value) -> int:
+    """
+    Approximate size of a stored entry: the length of its bytes and strings.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_size(item) for item in value.values())
+    return 8
+
+
+class TieredMemorySaver(MemorySaver):
+    """
+    Args:
+        spill_path: path of the SQLite file of the evicted threads.
+        max_resident_bytes: memory budget of the threads kept in RAM.
+        serde: the serializer of the checkpoints. Default: the MemorySaver one.
+    """
+
+    def __init__(self, spill_path: str, max_resident_bytes: int = 64 * 1024 * 1024, *, serde=None):
+        super().__init__(serde=serde)
+        self.max_resident_bytes = max_resident_bytes
+
+        # thread_id -> approximate bytes, from the least to the most recently used, and their sum
+        self._resident = OrderedDict()
+        self._resident_bytes = 0
+        # thread_id -> keys of the thread in the writes and blobs dicts, so evicting a thread doesn't scan all of them
+        self._write_keys = defaultdict(set)
+        self._blob_keys = defaultdict(set)
+        self._lock = threading.RLock()
+
+        self._spill = sqlite3.connect(spill_path, check_same_thread=False, isolation_level=None)
+        self._spill.execute("PRAGMA journal_mode=WAL")
+        self._spill.execute("PRAGMA synchronous=NORMAL")
+        self._spill.execute(SPILL_SCHEMA)
+        self._spilled = {row[0] for row in self._spill.execute("SELECT thread_id FROM spilled_threads")}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # 1. Metrics
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._resident_bytes
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 1.0
+
+    def metrics(self) -> dict:
+        return {"resident_bytes": self.resident_bytes, "resident_threads": len(self._resident),
+                "spilled_threads": len(self._spilled), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate, "evictions": self.evictions}
+
+    # 2. Moving the threads between the tiers
+
+    def _touch(self, thread_id: str) -> bool:
+        """
+        Marks the thread as recently used, loading it from the spill file if it was evicted.
+        Returns False for a thread that is in neither tier: it's only tracked once something is written to it.
+        """
+        if thread_id in self._resident:
+            self._resident.move_to_end(thread_id)
+            self.hits += 1
+        elif thread_id in self._spilled:
+            self._fault_in(thread_id)
+            self.misses += 1
+            self._enforce_budget()
+        else:
+            return False
+        return True
+
+    def _fault_in(self, thread_id: str):
+        row = self._spill.execute("SELECT data FROM spilled_threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        storage, writes, blobs = pickle.loads(row[0])
+
+        for checkpoint_ns, checkpoints in storage.items():
+            self.storage[thread_id][checkpoint_ns].update(checkpoints)
+        for key, task_writes in writes.items():
+            self.writes[key].update(task_writes)
+        self._write_keys[thread_id].update(writes)
+        if blobs:
+            self.blobs.update(blobs)
+            self._blob_keys[thread_id].update(blobs)
+
+        self._spill.execute("DELETE FROM spilled_threads WHERE thread_id = ?", (thread_id,))
+        self._spilled.discard(thread_id)
+        self._resident[thread_id] = len(row[0])
+        self._resident_bytes += len(row[0])
+
+    def _pop_thread(self, thread_id: str) -> tuple[dict, dict, dict]:
+        """
+        Removes the thread from the MemorySaver dicts and returns its entries.
+        """
+        storage = {ns: dict(checkpoints) for ns, checkpoints in self.storage.pop(thread_id, {}).items()}
+        writes = {key: dict(self.writes.pop(key)) for key in self._write_keys.pop(thread_id, ()) if key in self.writes}
+        # The newer MemorySaver keeps the channel values apart from the checkpoints
+        blobs = {key: self.blobs.pop(key) for key in self._blob_keys.pop(thread_id, ()) if key in self.blobs}
+        self._resident_bytes -= self._resident.pop(thread_id, 0)
+        return storage, writes, blobs
+
+    def _evict(self, thread_id: str):
+        self._spill.execute("INSERT OR REPLACE INTO spilled_threads (thread_id, data) VALUES (?, ?)",
+                            (thread_id, pickle.dumps(self._pop_thread(thread_id), protocol=pickle.HIGHEST_PROTOCOL)))
+        self._spilled.add(thread_id)
+        self.evictions += 1
+
+    def spill(self, thread_id: str):
+        """
+        Evicts the thread now, e.g. when it's paused waiting for a human (see approval_queue.py).
+        """
+        with self._lock:
+            if thread_id in self._resident:
+                self._evict(thread_id)
+
+    def _enforce_budget(self):
+        # The most recently used thread is never evicted, even if it's alone above the budget
+        while len(self._resident) > 1 and self._resident_bytes > self.max_resident_bytes:
+            self._evict(next(iter(self._resident)))
+
+    def _grow(self, thread_id: str, size: int):
+        # A new thread becomes resident with its first write
+        self._resident[thread_id] = self._resident.get(thread_id, 0) + size
+        self._resident.move_to_end(thread_id)
+        self._resident_bytes += size
+        self._enforce_budget()
+
+    # 3. The BaseCheckpointSaver interface, with the thread loaded before each access
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            if not self._touch(str(config["configurable"]["thread_id"])):
+                # Nothing was written to the thread (the defaultdicts of the MemorySaver would keep an empty entry)
+                return None
+            return super().get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        if config is not None:
+            with self._lock:
+                if not self._touch(str(config["configurable"]["thread_id"])):
+                    return
+                checkpoints = list(super().list(config, filter=filter, before=before, limit=limit))
+            yield from checkpoints
+            return
+
+        # All the threads: they are loaded one at a time, so the budget holds
+        with self._lock:
+            thread_ids = list(self._resident) + list(self._spilled)
+        for thread_id in thread_ids:
+            for checkpoint_tuple in self.list({"configurable": {"thread_id": thread_id}}, filter=filter, before=before, limit=limit):
+                yield checkpoint_tuple
+                if limit is not None:
+                    limit -= 1
+                    if limit <= 0:
+                        return
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            self._touch(thread_id)
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            size = _size(self.storage[thread_id][checkpoint_ns].get(checkpoint["id"]))
+            if blobs := getattr(self, "blobs", None):
+                keys = [(thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items()]
+                keys = [key for key in keys if key in blobs]
+                self._blob_keys[thread_id].update(keys)
+                size += sum(_size(blobs[key]) for key in keys)
+            self._grow(thread_id, size)
+            return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._lock:
+            self._touch(thread_id)
+            before = _size(self.writes.get(key, {}))
+            super().put_writes(config, writes, task_id, task_path)
+            self._write_keys[thread_id].add(key)
+            self._grow(thread_id, _size(self.writes.get(key, {})) - before)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._pop_thread(thread_id)
+            self._spilled.discard(thread_id)
+            self._spill.execute("DELETE FROM spilled_threads WHERE thread_id = ?", (thread_id,))
+
+    # 4. Hooks of the retention (retention.py), for the resident and the spilled threads
+
+    def thread_ids(self) -> list[str]:
+        with self._lock:
+            return list(self._resident) + list(self._spilled)
+
+    def _spilled_entries(self, thread_id: str) -> tuple[dict, dict, dict]:
+        row = self._spill.execute("SELECT data FROM spilled_threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        return pickle.loads(row[0])
+
+    def _thread_size(self, thread_id: str) -> int:
+        return (sum(_size(checkpoints) for checkpoints in self.storage.get(thread_id, {}).values())
+                + sum(_size(self.writes.get(key, {})) for key in self._write_keys.get(thread_id, ()))
+                + sum(_size(self.blobs.get(key)) for key in self._blob_keys.get(thread_id, ()) if key in self.blobs))
+
+    def thread_checkpoints(self, thread_id: str) -> tuple[dict, list]:
+        """
+        Returns the checkpoints of a thread ({checkpoint_ns: {checkpoint_id: stored tuple}}) and the keys of its
+        blobs, without loading a spilled thread back in RAM.
+        """
+        with self._lock:
+            if thread_id in self._resident:
+                storage = {ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items()}
+                return storage, list(self._blob_keys.get(thread_id, ()))
+            if thread_id in self._spilled:
+                storage, _, blobs = self._spilled_entries(thread_id)
+                return storage, list(blobs)
+            return {}, []
+
+    def prune_thread(self, thread_id: str, head: str, checkpoints: Optional[set[tuple[str, str]]] = None,
+                     blob_keys: Sequence[tuple] = ()) -> Optional[int]:
+        """
+        Deletes checkpoints of a thread, with their writes, and blobs, keeping the bookkeeping of the tiers.
+        Returns the number of deleted writes, or None (nothing deleted) if the latest checkpoint of the thread is no
+        longer head: it got a new checkpoint after the retention made its plan.
+
+        Args:
+            thread_id: the thread, resident or spilled.
+            head: the latest checkpoint id of the thread when the plan was made.
+            checkpoints: the (checkpoint_ns, checkpoint_id) to delete. None deletes the whole thread (delete_thread).
+            blob_keys: the keys of the blobs to delete.
+        """
+        with self._lock:
+            if thread_id in self._resident:
+                storage, writes, blobs = self.storage.get(thread_id, {}), self.writes, getattr(self, "blobs", {})
+                write_keys = self._write_keys.get(thread_id, set())
+            elif thread_id in self._spilled:
+                storage, writes, blobs = self._spilled_entries(thread_id)
+                write_keys = set(writes)
+            else:
+                return None
+
+            if max((checkpoint_id for ns in storage.values() for checkpoint_id in ns), default=None) != head:
+                return None
+            if checkpoints is None:
+                writes_deleted = sum(len(writes.get(key, {})) for key in write_keys)
+                self.delete_thread(thread_id)
+                return writes_deleted
+
+            writes_deleted = 0
+            for checkpoint_ns, checkpoint_id in checkpoints:
+                storage.get(checkpoint_ns, {}).pop(checkpoint_id, None)
+                key = (thread_id, checkpoint_ns, checkpoint_id)
+                writes_deleted += len(writes.pop(key, {}))
+                write_keys.discard(key)
+            for key in blob_keys:
+                blobs.pop(key, None)
+
+            if thread_id in self._spilled:
+                self._spill.execute("UPDATE spilled_threads SET data = ? WHERE thread_id = ?",
+                                    (pickle.dumps((storage, writes, blobs), protocol=pickle.HIGHEST_PROTOCOL), thread_id))
+            else:
+                self._blob_keys[thread_id].difference_update(blob_keys)
+                size = self._thread_size(thread_id)
+                self._resident_bytes += size - self._resident[thread_id]
+                self._resident[thread_id] = size
+            return writes_deleted
+
+    def close(self):
+        self._spill.close()
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+    import tracemalloc
+    from langchain_core.messages import HumanMessage
+    from pooled_sqlite_saver import create_benchmark_graph
+
+    # A long lived worker: 2000 threads, a few of them much more active than the others (Zipf like)
+    n_threads, n_turns = 2000, 20000
+    weights = [1 / (rank + 1) for rank in range(n_threads)]
+    random.seed(0)
+    schedule = random.choices(range(n_threads), weights=weights, k=n_turns)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        savers = {"MemorySaver": MemorySaver(),
+                  "TieredMemorySaver (2 MB)": TieredMemorySaver(os.path.join(tmp, "spill.db"), max_resident_bytes=2 * 1024 * 1024)}
+
+        for label, saver in savers.items():
+            graph = create_benchmark_graph(saver)
+            tracemalloc.start()
+            for turn, thread in enumerate(schedule):
+                graph.invoke({"messages": [HumanMessage(content=f"Pergunta {turn}")]},
+                             config={"configurable": {"thread_id": f"thread-{thread}"}})
+                if (turn + 1) % 5000 == 0:
+                    current, _ = tracemalloc.get_traced_memory()
+                    print(f"{label:<26} turns: {turn + 1:>6} | traced memory: {current / 2**20:7.1f} MB")
+            tracemalloc.stop()
+
+            if isinstance(saver, TieredMemorySaver):
+                print("Metrics:", saver.metrics())
+                # The evicted threads are loaded back transparently
+                cold = f"thread-{n_threads - 1}"
+                print(f"State of {cold}:", len(graph.get_state({"configurable": {"thread_id": cold}}).values.get("messages", [])), "messages")
+                saver.close()
@@ -0,0 +1,334 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+# Approvals for many paused threads, without a process waiting on input().
+# breaking_for_approval.py and breaking_for_editting.py stop with interrupt_before and then block on input() until
+# the human answers, one thread at a time. Here:
+# 1. a thread that stops in an interrupt is indexed in a SQLite table (thread_id, state.next, checkpoint_id and its
+#    pending tool calls), which the reviewers can query by node or by tool;
+# 2. while it waits, the thread is released from memory, if the checkpointer can spill it (e.g. the TieredMemorySaver
+#    moves it to disk right away); with other in-memory checkpointers it stays in RAM, and a warning is logged;
+# 3. the reviewers record decisions in bulk: approve, edit (new tool call args or a new human message, as in
+#    breaking_for_editting.py) or reject (the tool calls get a ToolMessage saying so);
+# 4. resume runs the stream(input=None, ...) continuations of the decided threads concurrently. A decision taken on a
+#    checkpoint that is no longer the latest one of the thread is not applied (stale).
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS approvals (
+    thread_id TEXT PRIMARY KEY,
+    checkpoint_id TEXT NOT NULL,
+    next TEXT NOT NULL,
+    tool_calls TEXT NOT NULL,
+    status TEXT NOT NULL,
+    decision TEXT,
+    paused_at REAL NOT NULL,
+    decided_at REAL
+);
+CREATE INDEX IF NOT EXISTS approvals_status ON approvals (status, paused_at);
+"""
+
+# Life cycle of a row: pending -> approved | edited | rejected -> running -> done (or pending again, at the next
+# interrupt of the thread), failed or stale
+DECIDED = ("approved", "edited", "rejected")
+
+
+@dataclass
+class PendingApproval:
+    thread_id: str
+    checkpoint_id: str
+    next: tuple
+    tool_calls: list[dict]
+    status: str
+    paused_at: float
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "PendingApproval":
+        thread_id, checkpoint_id, next_nodes, tool_calls, status, paused_at = row
+        return cls(thread_id, checkpoint_id, tuple(json.loads(next_nodes)), json.loads(tool_calls), status, paused_at)
+
+
+class ApprovalQueue:
+    """
+    Args:
+        workflow: a graph compiled with a checkpointer and interrupt_before (e.g. Chatbot(...).workflow).
+        path: path of the SQLite database of the queue. A single process owns it: the rows left as running by a
+            process that stopped in the middle of a resume are registered again when the queue is opened.
+            The paused threads are only released from memory if the checkpointer has a spill method (TieredMemorySaver).
+        max_concurrency: max number of threads resumed (or started) at the same time.
+    """
+
+    def __init__(self, workflow, path: str, max_concurrency: int = 16):
+        self.workflow = workflow
+        self.max_concurrency = max_concurrency
+        if getattr(workflow.checkpointer, "spill", None) is None:
+            logger.warning("The checkpointer %s can't spill threads: the paused threads stay in its memory while they wait",
+                           type(workflow.checkpointer).__name__)
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self._reclaim_running()
+
+    @staticmethod
+    def _config(thread_id: str) -> dict:
+        return {"configurable": {"thread_id": thread_id}}
+
+    def _execute(self, sql: str, parameters: Iterable = ()) -> list[tuple]:
+        with self._lock:
+            return self.connection.execute(sql, tuple(parameters)).fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+                self.connection.execute("COMMIT")
+            except BaseException:
+                if self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK")
+                raise
+
+    def _reclaim_running(self):
+        """
+        The decision of a running row may have been written to the thread, or not, so the row is indexed again from
+        the current state of the thread: pending at its current interrupt (for a new decision), or done.
+        """
+        for (thread_id,) in self._execute("SELECT thread_id FROM approvals WHERE status = 'running'"):
+            try:
+                self.register(thread_id)
+            except Exception:
+                logger.exception("Reclaim of the thread %s failed", thread_id)
+                self._execute("UPDATE approvals SET status = 'failed' WHERE thread_id = ?", (thread_id,))
+
+    # 1. Running the threads until they stop, and indexing the paused ones
+
+    def register(self, thread_id: str) -> Optional[PendingApproval]:
+        """
+        Indexes the thread if it's stopped in an interrupt, then releases its memory. Returns the indexed entry.
+        """
+        state = self.workflow.get_state(self._config(thread_id))
+        if not state.next:
+            self._execute("UPDATE approvals SET status = 'done' WHERE thread_id = ?", (thread_id,))
+            return None
+
+        messages = state.values.get("messages", [])
+        last = messages[-1] if messages else None
+        tool_calls = [{"id": call["id"], "name": call["name"], "args": call["args"]}
+                      for call in getattr(last, "tool_calls", None) or []]
+        entry = PendingApproval(thread_id, state.config["configurable"]["checkpoint_id"], tuple(state.next),
+                                tool_calls, "pending", time.time())
+        self._execute("INSERT OR REPLACE INTO approvals (thread_id, checkpoint_id, next, tool_calls, status, paused_at) "
+                      "VALUES (?, ?, ?, ?, 'pending', ?)",
+                      (thread_id, entry.checkpoint_id, json.dumps(entry.next), json.dumps(tool_calls), entry.paused_at))
+
+        spill = getattr(self.workflow.checkpointer, "spill", None)
+        if spill is not None:
+            spill(thread_id)
+        return entry
+
+    def _run(self, thread_id: str, graph_input: Any) -> Optional[PendingApproval]:
+        for _ in self.workflow.stream(input=graph_input, config=self._config(thread_id), stream_mode="values"):
+            pass
+        return self.register(thread_id)
+
+    def start(self, inputs: dict[str, Any]) -> dict[str, Optional[PendingApproval]]:
+        """
+        Runs the inputs (thread_id -> graph input) concurrently, until they end or stop in an interrupt.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {thread_id: executor.submit(self._run, thread_id, graph_input) for thread_id, graph_input in inputs.items()}
+            return {thread_id: future.result() for thread_id, future in futures.items()}
+
+    # 2. Queries of the reviewers
+
+    def pending(self, node: Optional[str] = None, tool: Optional[str] = None, status: str = "pending",
+                limit: int = 100, offset: int = 0) -> list[PendingApproval]:
+        """
+        The paused threads, the oldest first, optionally only the ones stopped before a node or calling a tool.
+        """
+        sql = "SELECT thread_id, checkpoint_id, next, tool_calls, status, paused_at FROM approvals WHERE status = ?"
+        parameters = [status]
+        if node is not None:
+            sql += " AND EXISTS (SELECT 1 FROM json_each(approvals.next) WHERE value = ?)"
+            parameters.append(node)
+        if tool is not None:
+            sql += " AND EXISTS (SELECT 1 FROM json_each(approvals.tool_calls) WHERE json_extract(value, '$.name') = ?)"
+            parameters.append(tool)
+        sql += " ORDER BY paused_at LIMIT ? OFFSET ?"
+        parameters += [limit, offset]
+        return [PendingApproval.from_row(row) for row in self._execute(sql, parameters)]
+
+    def counts(self) -> dict[str, int]:
+        return dict(self._execute("SELECT status, COUNT(*) FROM approvals GROUP BY status"))
+
+    # 3. Decisions, in bulk. They are only recorded here, and applied by resume.
+
+    def _decide(self, thread_ids: Iterable[str], status: str, decisions: Optional[dict] = None) -> int:
+        decisions = decisions or {}
+        now = time.time()
+        rows = [(status, json.dumps(decisions.get(thread_id)), now, thread_id) for thread_id in thread_ids]
+        with self._transaction() as connection:
+            changed = sum(connection.execute(
+                "UPDATE approvals SET status = ?, decision = ?, decided_at = ? WHERE thread_id = ? AND status = 'pending'",
+                row).rowcount for row in rows)
+        return changed
+
+    def approve(self, thread_ids: Iterable[str]) -> int:
+        return self._decide(thread_ids, "approved")
+
+    def reject(self, thread_ids: Iterable[str], reason: str = "Operation cancelled by the reviewer.") -> int:
+        thread_ids = list(thread_ids)
+        return self._decide(thread_ids, "rejected", {thread_id: {"reason": reason} for thread_id in thread_ids})
+
+    def edit(self, edits: dict[str, dict]) -> int:
+        """
+        Args:
+            edits: thread_id -> {"tool_calls": {call id: new args}} to change the args of the pending tool calls,
+                or {"message": text} to add a new human message (as in breaking_for_editting.py).
+        """
+        return self._decide(edits.keys(), "edited", edits)
+
+    # 4. Applying the decisions and resuming the threads
+
+    def _apply(self, thread_id: str, status: str, decision: Optional[dict]) -> bool:
+        """
+        Writes the decision in the state of the thread. Returns False if the thread must not be resumed.
+        """
+        config = self._config(thread_id)
+        if status == "approved":
+            return True
+        messages = self.workflow.get_state(config).values.get("messages", [])
+        last = messages[-1] if messages else None
+        has_tool_calls = isinstance(last, AIMessage) and bool(last.tool_calls)
+
+        if status == "rejected":
+            if not has_tool_calls:
+                return False
+            # The tool calls are answered without running them, so the assistant can tell the user
+            self.workflow.update_state(config, {"messages": [
+                ToolMessage(content=decision["reason"], tool_call_id=call["id"], name=call["name"])
+                for call in last.tool_calls]}, as_node="tools")
+            return True
+
+        if "tool_calls" in decision:
+            if not has_tool_calls:
+                # Nothing to edit: the thread is no longer stopped before a tool call
+                return False
+            # Same id: the AI message is replaced by add_messages, with the new args
+            new_args = decision["tool_calls"]
+            tool_calls = [{**call, "args": new_args.get(call["id"], call["args"])} for call in last.tool_calls]
+            self.workflow.update_state(config, {"messages": [AIMessage(content=last.content, tool_calls=tool_calls, id=last.id)]})
+        if "message" in decision:
+            self.workflow.update_state(config, {"messages": [HumanMessage(content=decision["message"])]})
+        return True
+
+    def _continue(self, thread_id: str) -> Optional[PendingApproval]:
+        config = self._config(thread_id)
+        before = self.workflow.get_state(config).config["configurable"]["checkpoint_id"]
+        for _ in self.workflow.stream(input=None, config=config, stream_mode="values"):
+            pass
+        if self.workflow.get_state(config).config["configurable"]["checkpoint_id"] == before:
+            # After an update_state the interrupt fires again at the same node (see breaking_for_editting.py)
+            for _ in self.workflow.stream(input=None, config=config, stream_mode="values"):
+                pass
+        return self.register(thread_id)
+
+    def _resume(self, thread_id: str, checkpoint_id: str, status: str, decision: Optional[dict]) -> str:
+        try:
+            current = self.workflow.get_state(self._config(thread_id)).config["configurable"]["checkpoint_id"]
+            if current != checkpoint_id:
+                # The thread moved after the decision was taken (e.g. a new message of the user)
+                self._execute("UPDATE approvals SET status = 'stale' WHERE thread_id = ?", (thread_id,))
+                return "stale"
+
+            if not self._apply(thread_id, status, decision):
+                self._execute("UPDATE approvals SET status = 'done' WHERE thread_id = ?", (thread_id,))
+                return "done"
+            entry = self._continue(thread_id)
+            return entry.status if entry else "done"
+        except Exception:
+            logger.exception("Resume of the thread %s failed", thread_id)
+            self._execute("UPDATE approvals SET status = 'failed' WHERE thread_id = ?", (thread_id,))
+            return "failed"
+
+    def resume(self, thread_ids: Optional[Iterable[str]] = None, max_concurrency: Optional[int] = None) -> dict[str, str]:
+        """
+        Applies the decisions and resumes the decided threads (all of them, or only thread_ids) concurrently.
+        Returns thread_id -> new status: done, pending (stopped in the next interrupt), stale or failed.
+        """
+        sql = f"SELECT thread_id, checkpoint_id, status, decision FROM approvals WHERE status IN ({', '.join('?' * len(DECIDED))})"
+        rows = self._execute(sql, DECIDED)
+        if thread_ids is not None:
+            wanted = set(thread_ids)
+            rows = [row for row in rows if row[0] in wanted]
+
+        # The rows are claimed before running, so two resume calls never run the same thread
+        with self._transaction() as connection:
+            claimed = [row for row in rows if connection.execute(
+                "UPDATE approvals SET status = 'running' WHERE thread_id = ? AND status = ?", (row[0], row[2])).rowcount]
+
+        with ThreadPoolExecutor(max_workers=max_concurrency or self.max_concurrency) as executor:
+            futures = {thread_id: executor.submit(self._resume, thread_id, checkpoint_id, status, json.loads(decision))
+                       for thread_id, checkpoint_id, status, decision in claimed}
+            return {thread_id: future.result() for thread_id, future in futures.items()}
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    from collections import Counter
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "checkpointers"))
+    from fake_chat_model import FakeChatModel
+    from graph_benchmark import load_module, arithmetic_calls
+    from tiered_memory_saver import TieredMemorySaver
+
+    # The Chatbot of breaking_for_approval.py with the fake model (0.2s per call), 200 threads waiting for approval
+    approval = load_module("human_in_the_loop/breaking_for_approval.py",
+                           chat_model_factory=FakeChatModel.factory(replies=arithmetic_calls(), latency=0.2))
+    n_threads = 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = TieredMemorySaver(os.path.join(tmp, "spill.db"))
+        queue = ApprovalQueue(approval.Chatbot(checkpointer=saver, when_interrupt="tools").workflow,
+                              os.path.join(tmp, "approvals.db"), max_concurrency=32)
+
+        start = time.perf_counter()
+        queue.start({f"thread-{i}": {"messages": [HumanMessage(content="Quanto é 2 mais 3? E 2 vezes 3?", name="Marianna")]}
+                     for i in range(n_threads)})
+        print(f"Started {n_threads} threads in {time.perf_counter() - start:.2f}s | queue: {queue.counts()} | "
+              f"resident threads: {saver.metrics()['resident_threads']}")
+
+        # A reviewer: rejects 10, changes the args of 10 and approves the rest, in three bulk operations
+        pending = queue.pending(tool="multiply_numbers", limit=n_threads)
+        queue.reject([entry.thread_id for entry in pending[:10]])
+        queue.edit({entry.thread_id: {"tool_calls": {call["id"]: {"a": 4, "b": 3} for call in entry.tool_calls}}
+                    for entry in pending[10:20]})
+        queue.approve([entry.thread_id for entry in queue.pending(limit=n_threads)])
+
+        start = time.perf_counter()
+        results = queue.resume()
+        elapsed = time.perf_counter() - start
+        print(f"Resumed {len(results)} threads in {elapsed:.2f}s (sequentially, one input() at a time: at least "
+              f"{0.2 * len(results):.0f}s of model calls) | results: {dict(Counter(results.values()))}")
+
+        for label, entry in [("Rejected", pending[0]), ("Edited", pending[10])]:
+            messages = queue.workflow.get_state({"configurable": {"thread_id": entry.thread_id}}).values["messages"]
+            print(f"{label} thread, tool results:", [msg.content for msg in messages if isinstance(msg, ToolMessage)])
+        saver.close()
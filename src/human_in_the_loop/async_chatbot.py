@@ -0,0 +1,100 @@
+import dotenv
+import asyncio
+import time
+
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage
+from langgraph.graph import START, StateGraph, MessagesState
+from langgraph.prebuilt import ToolNode, tools_condition
+from langchain.tools import tool
+
+
+# Set up env variables
+print("Is env variables loaded?", dotenv.load_dotenv(".env"))
+
+## Fully async version of the Chatbot used in the human in the loop examples.
+## The assistant node awaits the model, the tools are coroutines and the checkpointer is async, so a single
+## event loop can serve many threads at the same time, without a thread per request.
+## When the model asks for several tools in the same turn, the ToolNode runs the async tools concurrently (asyncio.gather).
+
+class AsyncChatbot:
+    def __init__(self, checkpointer=None, when_interrupt=None):
+        self.llm = ChatOpenAI(model="gpt-3.5-turbo", streaming=True)
+        self.tools = [self.sum_numbers, self.multiply_numbers]
+        self.llm = self.llm.bind_tools(self.tools)
+        self.when_interrupt = when_interrupt
+        self.workflow = self.create_graph(checkpointer=checkpointer)
+
+    @staticmethod
+    @tool
+    async def sum_numbers(a:int, b:int):
+        '''Sum two numbers'''
+        return a+b
+
+    @staticmethod
+    @tool
+    async def multiply_numbers(a:int, b:int):
+        '''Multiply two numbers'''
+        return a*b
+
+    async def assistant(self, state: MessagesState):
+        response = await self.llm.ainvoke(state['messages'])
+        return {'messages': response}
+
+    def create_graph(self, checkpointer):
+        graph = StateGraph(MessagesState)
+        graph.add_node("assistant", self.assistant)
+        graph.add_node("tools", ToolNode(self.tools))
+
+        graph.add_edge(START, "assistant")
+        graph.add_conditional_edges(
+            "assistant",
+            tools_condition
+        )
+        graph.add_edge("tools", "assistant")
+
+        return graph.compile(checkpointer=checkpointer, interrupt_before=self.when_interrupt)
+
+
+async def run_async(workflow, config, initial_message):
+    async for event in workflow.astream_events(input=initial_message, config=config, version="v2"):
+        if event["event"] == "on_chat_model_stream" and event["metadata"].get('langgraph_node','') == "assistant":
+            print(event["data"]['chunk'].content, end = " | ")
+
+
+async def run_many_threads(workflow, messages, max_concurrency=100):
+    """
+    Runs one conversation per message, each one in its own thread_id, all of them in the same event loop.
+    The semaphore limits how many conversations are waiting for the model at the same time.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_thread(thread_id, message):
+        async with semaphore:
+            config = {"configurable": {"thread_id": str(thread_id)}}
+            return await workflow.ainvoke(input={"messages": [message]}, config=config)
+
+    return await asyncio.gather(*[run_thread(thread_id, message) for thread_id, message in enumerate(messages)])
+
+
+async def main():
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    async with AsyncSqliteSaver.from_conn_string("src/databases/async_chatbot.db") as checkpointer:
+        workflow = AsyncChatbot(checkpointer=checkpointer).workflow
+
+        print("=========== Tokens Streaming ==============")
+        initial_message = {"messages": [HumanMessage(content="Quanto é 2 mais 3? E quanto é 2 vezes 3?", name="Marianna")]}
+        config = {"configurable": {"thread_id": "async-1"}}
+        await run_async(workflow=workflow, config=config, initial_message=initial_message)
+
+        print("\n=========== Many Threads in the Same Event Loop ==============")
+        messages = [HumanMessage(content=f"Quanto é {i} mais {i+1}?", name="Marianna") for i in range(10)]
+        start = time.perf_counter()
+        responses = await run_many_threads(workflow, messages)
+        print(f"{len(responses)} threads in {time.perf_counter() - start:.2f}s")
+        responses[0]['messages'][-1].pretty_print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
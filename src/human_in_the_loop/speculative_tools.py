@@ -0,0 +1,233 @@
+import json
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import BaseTool
+
+# Tool results computed while the approval is pending.
+# With when_interrupt="tools" in breaking_for_approval.py the graph does nothing until the reviewer says "y", and only
+# then the ToolNode runs sum_numbers/multiply_numbers and the assistant is called again. Here:
+# 1. tools are marked as pure (no side effects) in their metadata; only calls to pure tools are speculated;
+# 2. when a thread stops before "tools", the pending tool calls (and optionally the next assistant turn) run in the
+#    background, against the paused state, without writing anything in the checkpointer;
+# 3. on approval, the results are committed with update_state(as_node="tools") (and as_node="assistant"), so the
+#    reviewer gets the answer without waiting for the tools and the model;
+# 4. on rejection or edit, the speculation is discarded, and an edit runs the ToolNode as usual.
+# A speculation belongs to a checkpoint: if the thread moved meanwhile, it's not committed.
+
+logger = logging.getLogger(__name__)
+
+
+# 1. The purity flag
+
+def pure_tool(tool: BaseTool) -> BaseTool:
+    """
+    Marks the tool as side effect free, so its calls can run before the approval.
+    """
+    tool.metadata = {**(tool.metadata or {}), "pure": True}
+    return tool
+
+
+def is_pure(tool: BaseTool) -> bool:
+    return bool((tool.metadata or {}).get("pure"))
+
+
+def tool_message(tool: BaseTool, call: dict) -> ToolMessage:
+    """
+    Runs the call as the ToolNode does, including the error message sent back to the model on failure.
+    """
+    try:
+        output = tool.invoke(call["args"])
+        content = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False, default=str)
+    except Exception as error:
+        content = f"Error: {error!r}\n Please fix your mistakes."
+    return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"])
+
+
+# 2. The speculations
+
+@dataclass
+class Speculation:
+    checkpoint_id: str
+    future: Optional[Future] = None
+    # Filled by the job: the tool results and, if enabled, the next assistant message
+    tool_messages: Optional[list[ToolMessage]] = None
+    assistant_message: Optional[AIMessage] = None
+
+
+class SpeculativeApprover:
+    """
+    Args:
+        workflow: the graph of the Chatbot, compiled with interrupt_before="tools".
+        tools: the tools of the ToolNode of the graph.
+        assistant: the assistant node (state -> {"messages": AIMessage}), to also speculate the next model call.
+            None speculates only the tools.
+        max_workers: max number of speculations running at the same time.
+    """
+
+    def __init__(self, workflow, tools: list[BaseTool], assistant: Optional[Callable] = None, max_workers: int = 4):
+        self.workflow = workflow
+        self.tools = {tool.name: tool for tool in tools}
+        self.assistant = assistant
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+
+        self._lock = threading.Lock()
+        self._speculations: dict[str, Speculation] = {}
+
+        self.committed = 0
+        self.discarded = 0
+
+    @staticmethod
+    def _config(thread_id: str) -> dict:
+        return {"configurable": {"thread_id": thread_id}}
+
+    def _stream(self, thread_id: str, graph_input: Any) -> dict:
+        state = None
+        for state in self.workflow.stream(input=graph_input, config=self._config(thread_id), stream_mode="values"):
+            pass
+        return state
+
+    def run(self, thread_id: str, graph_input: Any) -> dict:
+        """
+        Runs the input until the graph ends or stops before the tools, and starts the speculation in the latter case.
+        """
+        state = self._stream(thread_id, graph_input)
+        self._speculate(thread_id)
+        return state
+
+    def _speculate(self, thread_id: str):
+        snapshot = self.workflow.get_state(self._config(thread_id))
+        if snapshot.next != ("tools",):
+            return
+        calls = snapshot.values["messages"][-1].tool_calls
+        if not all(call["name"] in self.tools and is_pure(self.tools[call["name"]]) for call in calls):
+            # A single impure call and the whole turn waits for the approval, as in breaking_for_approval.py
+            return
+
+        speculation = Speculation(snapshot.config["configurable"]["checkpoint_id"])
+        speculation.future = self._executor.submit(self._run_speculation, speculation, snapshot.values["messages"], calls)
+        with self._lock:
+            self._speculations[thread_id] = speculation
+
+    def _run_speculation(self, speculation: Speculation, messages: list, calls: list[dict]):
+        speculation.tool_messages = [tool_message(self.tools[call["name"]], call) for call in calls]
+        if self.assistant is not None:
+            response = self.assistant({"messages": messages + speculation.tool_messages})["messages"]
+            speculation.assistant_message = response[-1] if isinstance(response, list) else response
+
+    def _pop(self, thread_id: str) -> Optional[Speculation]:
+        with self._lock:
+            return self._speculations.pop(thread_id, None)
+
+    # 3. The decisions of the reviewer
+
+    def approve(self, thread_id: str) -> dict:
+        """
+        Commits the speculation of the thread, if it's still valid, or runs the tools as usual.
+        Returns the state after the approval (stopped again before the tools, or finished).
+        """
+        config = self._config(thread_id)
+        speculation = self._pop(thread_id)
+        if speculation is not None:
+            try:
+                # Usually already done: the reviewer takes longer than the tools
+                speculation.future.result()
+                current = self.workflow.get_state(config).config["configurable"]["checkpoint_id"]
+                if current == speculation.checkpoint_id:
+                    self.workflow.update_state(config, {"messages": speculation.tool_messages}, as_node="tools")
+                    if speculation.assistant_message is None:
+                        state = self._stream(thread_id, None)
+                    else:
+                        self.workflow.update_state(config, {"messages": speculation.assistant_message}, as_node="assistant")
+                        state = self.workflow.get_state(config).values
+                    self.committed += 1
+                    self._speculate(thread_id)
+                    return state
+            except Exception:
+                logger.exception("Speculation of the thread %s failed, running the tools", thread_id)
+            self.discarded += 1
+
+        state = self._stream(thread_id, None)
+        self._speculate(thread_id)
+        return state
+
+    def reject(self, thread_id: str):
+        """
+        Discards the speculation. The thread stays stopped before the tools, as when the answer is "n".
+        """
+        speculation = self._pop(thread_id)
+        if speculation is not None:
+            speculation.future.cancel()
+            self.discarded += 1
+
+    def edit(self, thread_id: str, tool_args: dict[str, dict]) -> dict:
+        """
+        Discards the speculation, changes the args of the pending tool calls (call id -> args) and runs the tools.
+        """
+        self.reject(thread_id)
+        config = self._config(thread_id)
+        last = self.workflow.get_state(config).values["messages"][-1]
+        tool_calls = [{**call, "args": tool_args.get(call["id"], call["args"])} for call in last.tool_calls]
+        self.workflow.update_state(config, {"messages": [AIMessage(content=last.content, tool_calls=tool_calls, id=last.id)]})
+        before = self.workflow.get_state(config).config["configurable"]["checkpoint_id"]
+        state = self._stream(thread_id, None)
+        if self.workflow.get_state(config).config["configurable"]["checkpoint_id"] == before:
+            # After update_state the interrupt fires again before the tools (see breaking_for_editting.py)
+            state = self._stream(thread_id, None)
+        self._speculate(thread_id)
+        return state
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from pathlib import Path
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+    from graph_benchmark import load_module, arithmetic_calls
+
+    # The Chatbot of breaking_for_approval.py with the fake model (0.3s per call). The reviewer takes 0.5s to answer.
+    approval = load_module("human_in_the_loop/breaking_for_approval.py",
+                           chat_model_factory=FakeChatModel.factory(replies=arithmetic_calls(), latency=0.3))
+    review_seconds = 0.5
+    question = {"messages": [HumanMessage(content="Quanto é 2 mais 3? E 2 vezes 3?", name="Marianna")]}
+    n_turns = 5
+
+    chatbot = approval.Chatbot(checkpointer=MemorySaver(), when_interrupt="tools")
+    for tool in chatbot.tools:
+        pure_tool(tool)
+
+    setups = [("input() + stream(None)", None),
+              ("speculative tools", SpeculativeApprover(chatbot.workflow, chatbot.tools)),
+              ("speculative tools + assistant", SpeculativeApprover(chatbot.workflow, chatbot.tools, assistant=chatbot.assistant))]
+
+    for label, approver in setups:
+        latencies = []
+        for turn in range(n_turns):
+            thread_id = f"{label}-{turn}"
+            config = {"configurable": {"thread_id": thread_id}}
+            if approver is None:
+                chatbot.workflow.invoke(question, config)
+            else:
+                approver.run(thread_id, question)
+
+            time.sleep(review_seconds)
+            # Time between the "y" of the reviewer and the final answer
+            start = time.perf_counter()
+            state = chatbot.workflow.invoke(None, config) if approver is None else approver.approve(thread_id)
+            latencies.append(time.perf_counter() - start)
+
+        print(f"{label:<32} approval to answer: {1000 * sum(latencies) / n_turns:7.1f} ms | "
+              f"answer: {state['messages'][-1].content}")
+        if approver is not None:
+            approver.close()
@@ -0,0 +1,424 @@
+import re
+import json
+import difflib
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Optional, Sequence
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+from langgraph.errors import NodeInterrupt
+from langgraph.graph import START, END, StateGraph, MessagesState
+from langgraph.prebuilt import ToolNode
+
+# Validation of the tool calls before the ToolNode.
+# In breaking_dynamically.py sum_numbers/multiply_numbers raise NodeInterrupt on negative inputs: the model call and
+# the ToolNode already ran, and the recovery is a manual update_state plus another pass (see its __main__ block).
+# Here the args of the tool calls are checked by declarative rules right after the assistant, in a conditional edge:
+# - the rules are compiled once per tool (required fields and types from the tool schema, plus Range, OneOf, Matches
+#   and cross-field rules), so checking a call costs microseconds and no checkpoint;
+# - valid turns go to the ToolNode as before;
+# - invalid turns (default on_invalid="fix") go to a fix node when the rules can fix them deterministically (clamp to
+#   a Range, nearest value of a OneOf, args coerced to the schema types): the AI message is rewritten with the fixed
+#   args and the ToolNode runs once, without another model call. The calls that can't be fixed stop in an interrupt;
+# - with on_invalid="repair", they go to a repair node, which answers the invalid calls with structured diagnostics
+#   (and runs the valid ones in the ToolNode, so an interrupt raised by a tool still stops the graph), so the model
+#   fixes them in the next call; with on_invalid="interrupt", to an interrupt node, which raises NodeInterrupt with
+#   the same diagnostics before any tool runs (also after max_repairs failed repairs).
+# The repair is not free: each repaired turn costs one more model call (in the __main__ block, 10 of the 20 turns
+# are invalid, so 50 model calls instead of 40). The fix keeps the 40 model calls and runs the ToolNode once per turn.
+
+INVALID_PREFIX = "Invalid tool call"
+
+
+# 1. The rules
+
+@dataclass
+class Violation:
+    tool: str
+    call_id: str
+    fields: list[str]
+    rule: str
+    message: str
+
+
+@dataclass
+class Range:
+    field: str
+    min: Optional[float] = None
+    max: Optional[float] = None
+    # If True, fix moves an out of range value to the nearest bound
+    clamp: bool = False
+
+    def check(self, args: dict) -> Optional[str]:
+        value = args.get(self.field)
+        if value is None:
+            return None
+        if self.min is not None and value < self.min:
+            return f"{self.field}={value!r} is below the minimum {self.min}"
+        if self.max is not None and value > self.max:
+            return f"{self.field}={value!r} is above the maximum {self.max}"
+        return None
+
+    def fix(self, args: dict) -> Optional[dict]:
+        if not self.clamp:
+            return None
+        value = args[self.field]
+        if self.min is not None and value < self.min:
+            value = self.min
+        if self.max is not None and value > self.max:
+            value = self.max
+        return {**args, self.field: value}
+
+    @property
+    def fields(self) -> list[str]:
+        return [self.field]
+
+
+@dataclass
+class OneOf:
+    field: str
+    values: Sequence[Any]
+    # If True, fix replaces a value not allowed by the most similar allowed one (closest number or string)
+    nearest: bool = False
+
+    def __post_init__(self):
+        self._allowed = frozenset(self.values)
+
+    def check(self, args: dict) -> Optional[str]:
+        value = args.get(self.field)
+        if value is None or value in self._allowed:
+            return None
+        return f"{self.field}={value!r} is not one of {sorted(self._allowed, key=repr)}"
+
+    def fix(self, args: dict) -> Optional[dict]:
+        if not self.nearest:
+            return None
+        value = args[self.field]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers = [v for v in self._allowed if isinstance(v, (int, float)) and not isinstance(v, bool)]
+            best = min(numbers, key=lambda v: abs(v - value), default=None)
+        else:
+            strings = {str(v): v for v in self._allowed}
+            matches = difflib.get_close_matches(str(value), list(strings), n=1, cutoff=0.6)
+            best = strings[matches[0]] if matches else None
+        return {**args, self.field: best} if best is not None else None
+
+    @property
+    def fields(self) -> list[str]:
+        return [self.field]
+
+
+@dataclass
+class Matches:
+    field: str
+    pattern: str
+
+    def __post_init__(self):
+        self._regex = re.compile(self.pattern)
+
+    def check(self, args: dict) -> Optional[str]:
+        value = args.get(self.field)
+        if value is None or (isinstance(value, str) and self._regex.fullmatch(value)):
+            return None
+        return f"{self.field}={value!r} doesn't match {self.pattern!r}"
+
+    @property
+    def fields(self) -> list[str]:
+        return [self.field]
+
+
+@dataclass
+class CrossField:
+    """
+    A rule over several args, e.g. CrossField(["a", "b"], lambda a, b: a <= b, "a must not be greater than b").
+    """
+    fields: list[str]
+    predicate: Callable[..., bool]
+    message: str
+
+    def check(self, args: dict) -> Optional[str]:
+        values = [args.get(name) for name in self.fields]
+        if any(value is None for value in values) or self.predicate(*values):
+            return None
+        return self.message
+
+
+def coerce(value: Any, expected) -> Any:
+    """
+    Converts a value to the expected type when it's lossless (e.g. "3" -> 3, 2.0 -> 2, 3 -> "3"). Returns None otherwise.
+    """
+    accepted = expected if isinstance(expected, tuple) else (expected,)
+    if isinstance(value, bool) or bool in accepted:
+        return {"true": True, "false": False}.get(value.lower()) if isinstance(value, str) and bool in accepted else None
+    if int in accepted:
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and re.fullmatch(r"[+-]?\d+", value.strip()):
+            return int(value)
+    if float in accepted and isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if str in accepted and isinstance(value, (int, float)):
+        return str(value)
+    return None
+
+
+JSON_TYPES = {"integer": int, "number": (int, float), "string": str, "boolean": bool, "array": list, "object": dict}
+
+
+def schema_rules(tool: BaseTool) -> tuple[list[str], dict[str, type]]:
+    """
+    The required args and the arg types of the tool schema (the same schema sent to the model by bind_tools).
+    """
+    schema = tool.args_schema.model_json_schema() if hasattr(tool.args_schema, "model_json_schema") else tool.args_schema.schema()
+    types = {name: JSON_TYPES[prop["type"]] for name, prop in schema.get("properties", {}).items() if prop.get("type") in JSON_TYPES}
+    return list(schema.get("required", [])), types
+
+
+class ToolCallValidator:
+    """
+    Args:
+        tools: the tools bound to the model. Their schemas give the required args and the arg types.
+        rules: tool name -> extra rules (Range, OneOf, Matches, CrossField or any object with check(args) and fields,
+            and optionally fix(args), which returns the fixed args or None).
+        coerce_types: if True, fix_call converts the args of the wrong type when it's lossless (see coerce).
+    """
+
+    def __init__(self, tools: list[BaseTool], rules: Optional[dict[str, list]] = None, coerce_types: bool = True):
+        rules = rules or {}
+        self.coerce_types = coerce_types
+        self._compiled = {}
+        for tool in tools:
+            required, types = schema_rules(tool)
+            self._compiled[tool.name] = (required, types, list(rules.get(tool.name, [])))
+
+    def validate_call(self, call: dict) -> list[Violation]:
+        name, args, call_id = call["name"], call.get("args") or {}, call.get("id") or ""
+        if name not in self._compiled:
+            return [Violation(name, call_id, [], "unknown_tool", f"There is no tool named {name!r}")]
+
+        required, types, rules = self._compiled[name]
+        violations = [Violation(name, call_id, [arg], "required", f"{arg} is required") for arg in required if arg not in args]
+        for arg, value in args.items():
+            expected = types.get(arg)
+            # bool is a subclass of int, but true is not an integer arg
+            if expected is not None and (not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool)):
+                violations.append(Violation(name, call_id, [arg], "type", f"{arg}={value!r} must be of type {getattr(expected, '__name__', expected)}"))
+        if violations:
+            # The rules assume the types are right
+            return violations
+
+        for rule in rules:
+            if (message := rule.check(args)) is not None:
+                violations.append(Violation(name, call_id, list(rule.fields), type(rule).__name__, message))
+        return violations
+
+    def validate(self, tool_calls: list[dict]) -> list[Violation]:
+        return [violation for call in tool_calls for violation in self.validate_call(call)]
+
+    def fix_call(self, call: dict) -> Optional[dict]:
+        """
+        Returns the call with its args fixed by the type coercion and the fix of the broken rules, or None if it can't
+        be fixed without the model (a missing arg, a rule without fix, or a fix that breaks another rule).
+        """
+        if call["name"] not in self._compiled:
+            return None
+        required, types, rules = self._compiled[call["name"]]
+        args = dict(call.get("args") or {})
+        if any(arg not in args for arg in required):
+            return None
+
+        if self.coerce_types:
+            for arg, value in list(args.items()):
+                expected = types.get(arg)
+                if expected is not None and (not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool)):
+                    if (value := coerce(value, expected)) is None:
+                        return None
+                    args[arg] = value
+
+        for rule in rules:
+            if rule.check(args) is None:
+                continue
+            fix = getattr(rule, "fix", None)
+            if fix is None or (args := fix(args)) is None:
+                return None
+
+        fixed = {**call, "args": args}
+        return fixed if not self.validate_call(fixed) else None
+
+
+# 2. The graph of breaking_dynamically.py with the validation
+
+def diagnostics_message(call: dict, violations: list[Violation]) -> ToolMessage:
+    content = f"{INVALID_PREFIX}, it was not executed. Fix the args and call the tool again: " + \
+              json.dumps([asdict(violation) for violation in violations], ensure_ascii=False)
+    return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"])
+
+
+def repair_rounds(messages: list) -> int:
+    """
+    Number of assistant messages, since the last human message, with calls answered by diagnostics.
+    """
+    invalid_ids, rounds = set(), 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage) and message.content.startswith(INVALID_PREFIX):
+            invalid_ids.add(message.tool_call_id)
+        elif isinstance(message, AIMessage) and any(call["id"] in invalid_ids for call in message.tool_calls):
+            rounds += 1
+    return rounds
+
+
+def create_graph(assistant: Callable, tools: list[BaseTool], validator: ToolCallValidator, checkpointer=None,
+                 on_invalid: str = "fix", max_repairs: int = 2):
+    """
+    Args:
+        assistant: the assistant node of the Chatbot (its model bound to the tools).
+        tools: the tools of the ToolNode.
+        validator: the ToolCallValidator of the tools.
+        checkpointer: the checkpointer of the graph.
+        on_invalid: "fix" rewrites the calls fixed by the rules and runs them (the others interrupt), "repair" sends the
+            diagnostics to the model, "interrupt" raises NodeInterrupt with them.
+        max_repairs: max repair rounds in a turn, before the interrupt.
+    """
+    tool_node = ToolNode(tools)
+
+    def route_after_assistant(state: MessagesState):
+        last = state["messages"][-1]
+        if not isinstance(last, AIMessage) or not last.tool_calls:
+            return END
+        if not validator.validate(last.tool_calls):
+            return "tools"
+        if on_invalid == "fix":
+            return "fix" if all(validator.fix_call(call) is not None for call in last.tool_calls) else "invalid tool calls"
+        if on_invalid == "repair" and repair_rounds(state["messages"]) < max_repairs:
+            return "repair"
+        return "invalid tool calls"
+
+    def fix(state: MessagesState):
+        last = state["messages"][-1]
+        fixed = [validator.fix_call(call) for call in last.tool_calls]
+        # Same id: the AI message is replaced by add_messages, so the history shows the args that ran
+        return {"messages": [AIMessage(content=last.content, tool_calls=fixed, id=last.id)]}
+
+    def repair(state: MessagesState, config: RunnableConfig):
+        calls = state["messages"][-1].tool_calls
+        answers, valid = {}, []
+        for call in calls:
+            if violations := validator.validate_call(call):
+                answers[call["id"]] = diagnostics_message(call, violations)
+            else:
+                valid.append(call)
+        if valid:
+            # The same ToolNode of the "tools" node: same error messages, and NodeInterrupt (GraphBubbleUp) is raised
+            result = tool_node.invoke({"messages": [AIMessage(content="", tool_calls=valid)]}, config)
+            answers.update((message.tool_call_id, message) for message in result["messages"])
+        return {"messages": [answers[call["id"]] for call in calls]}
+
+    def interrupt_invalid_calls(state: MessagesState):
+        # The recovery is the one of breaking_dynamically.py: an update_state with the fixed calls, which is applied
+        # as the assistant, so the calls go through the validation again
+        violations = validator.validate(state["messages"][-1].tool_calls)
+        raise NodeInterrupt(json.dumps([asdict(violation) for violation in violations], ensure_ascii=False))
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("assistant", assistant)
+    graph.add_node("tools", tool_node)
+    graph.add_node("fix", fix)
+    graph.add_node("repair", repair)
+    graph.add_node("invalid tool calls", interrupt_invalid_calls)
+
+    graph.add_edge(START, "assistant")
+    graph.add_conditional_edges("assistant", route_after_assistant, ["tools", "fix", "repair", "invalid tool calls", END])
+    graph.add_edge("fix", "tools")
+    graph.add_edge("tools", "assistant")
+    graph.add_edge("repair", "assistant")
+    graph.add_edge("invalid tool calls", END)
+
+    return graph.compile(checkpointer=checkpointer)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import timeit
+    from pathlib import Path
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langgraph.checkpoint.memory import MemorySaver
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel, tool_call
+    from graph_benchmark import load_module
+
+    # The fake model (0.2s per call) asks sum_numbers with a negative arg when the question has one, and fixes the
+    # args after the diagnostics of the repair node
+    def reply(messages):
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            if last.content.startswith(INVALID_PREFIX):
+                return tool_call("sum_numbers", a=1, b=3)
+            return AIMessage(content=f"O resultado é {last.content}.")
+        return tool_call("sum_numbers", a=-1 if "-" in last.content else 1, b=3)
+
+    dynamically = load_module("human_in_the_loop/breaking_dynamically.py",
+                              chat_model_factory=FakeChatModel.factory(replies=[reply], latency=0.2))
+    chatbot = dynamically.Chatbot(checkpointer=MemorySaver(), when_interrupt=None)
+
+    rules = {"sum_numbers": [Range("a", min=0, clamp=True), Range("b", min=0, clamp=True)],
+             "multiply_numbers": [Range("a", min=0, clamp=True), Range("b", min=0, clamp=True)]}
+    validator = ToolCallValidator(chatbot.tools, rules)
+
+    call = {"name": "sum_numbers", "args": {"a": -1, "b": 3}, "id": "call_1"}
+    repeats = 100_000
+    print(f"Validation of a call: {1e6 * timeit.timeit(lambda: validator.validate([call]), number=repeats) / repeats:.2f} µs")
+
+    class Meter(BaseCallbackHandler):
+        def __init__(self):
+            self.model_calls = self.tool_runs = self.tool_errors = self.tool_node_runs = 0
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.model_calls += 1
+
+        def on_chain_start(self, serialized, inputs, **kwargs):
+            # The ToolNode runs as the "tools" node, and inside the repair node
+            self.tool_node_runs += kwargs.get("name") == "tools"
+
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.tool_runs += 1
+
+        def on_tool_error(self, error, **kwargs):
+            self.tool_errors += 1
+
+    # Half of the questions have a negative input
+    questions = [f"Quanto é {'-1' if i % 2 else '1'} mais 3?" for i in range(20)]
+    setups = [("NodeInterrupt in the tool", chatbot.workflow),
+              ("validation + fix", create_graph(chatbot.assistant, chatbot.tools, validator, MemorySaver())),
+              ("validation + repair", create_graph(chatbot.assistant, chatbot.tools, validator, MemorySaver(), on_invalid="repair")),
+              ("validation + interrupt", create_graph(chatbot.assistant, chatbot.tools, validator, MemorySaver(), on_invalid="interrupt"))]
+
+    baseline = None
+    for label, workflow in setups:
+        meter = Meter()
+        interrupts = 0
+        start = time.perf_counter()
+        for i, question in enumerate(questions):
+            config = {"configurable": {"thread_id": f"{label}-{i}"}, "callbacks": [meter]}
+            workflow.invoke({"messages": [HumanMessage(content=question, name="Marianna")]}, config)
+            state = workflow.get_state(config)
+            if state.next:
+                # The manual recovery of breaking_dynamically.py: fix the args and run again
+                interrupts += 1
+                last = state.values["messages"][-1]
+                fixed = [{**tool_call, "args": {"a": 1, "b": 3}} for tool_call in last.tool_calls]
+                workflow.update_state(config, {"messages": [AIMessage(content="", tool_calls=fixed, id=last.id)]})
+                workflow.invoke(None, config)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or meter
+        # The fix removes the failed tool runs at no model cost; the repair trades them for one more model call
+        print(f"{label:<26} {elapsed:5.2f}s | model calls: {meter.model_calls:>3} ({meter.model_calls - baseline.model_calls:+d}) "
+              f"| ToolNode runs: {meter.tool_node_runs:>3} ({meter.tool_node_runs - baseline.tool_node_runs:+d}) "
+              f"| tool runs: {meter.tool_runs:>3} (failed: {meter.tool_errors:>2}) | manual interventions: {interrupts:>2}")
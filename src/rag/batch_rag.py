@@ -0,0 +1,181 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Annotated, Optional, TypedDict
+
+from langchain_core.documents import Document
+from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langgraph.graph import StateGraph, START
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+
+from numpy_vector_index import NumpyIndexRetriever
+
+# Batched execution of many questions over the RAG chat graph of the tutorial 2.
+# The questions run concurrently (up to a limit), and the retriever_tool calls made by the concurrent graphs
+# are coalesced, so N questions cost one embedding call and one vector search instead of N of each
+# (with the CachedEmbeddings, the queries of a batch are embedded by embed_queries in batched model calls).
+
+
+# 1. Coalescing the concurrent retrievals
+
+class RetrievalBatcher:
+    """
+    Collects the queries made at the same time by different threads and searches them together.
+    A batch is dispatched when it reaches max_batch_size or when its first query has waited max_wait_ms.
+
+    Args:
+        retriever: a retriever with a batch_search method (e.g. the NumpyIndexRetriever).
+        max_batch_size: max number of queries searched together.
+        max_wait_ms: max time a query waits for others to fill the batch.
+    """
+
+    def __init__(self, retriever: NumpyIndexRetriever, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.retriever = retriever
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def search(self, question: str) -> list[Document]:
+        future = Future()
+        self._queue.put((question, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _dispatch(self):
+        while (first := self._queue.get()) is not None:
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait_seconds
+
+            while len(batch) < self.max_batch_size and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+
+            try:
+                results = self.retriever.batch_search([question for question, _ in batch])
+                for (_, future), documents in zip(batch, results):
+                    future.set_result(documents)
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+
+            self.batches += 1
+            self.queries += len(batch)
+
+
+# 2. The RAG chat graph of the tutorial 2, with the retriever tool going through the batcher
+
+class ChatRagState(TypedDict):
+    # The chat messages
+    messages: Annotated[list[AnyMessage], add_messages]
+
+def format_retrieved_docs(documents):
+    return "\n\n".join([doc.page_content for doc in documents])
+
+def create_rag_graph(chat_model, batcher: RetrievalBatcher, checkpointer=None):
+    def retriever_tool(question: str) -> str:
+        """
+        Receives a question and searches in a vector store for contexts that are relevant to the question.
+
+        Args:
+            question: the query to be used in the vector store search.
+        """
+        return format_retrieved_docs(batcher.search(question))
+
+    chat_tools = [retriever_tool]
+    chat_model_with_tools = chat_model.bind_tools(chat_tools)
+
+    def chat_node(state: ChatRagState):
+        prompt = ("You are a helpful assistant for question-answering tasks and an expert in Alzheimers cientific research."
+                  " Answer the user questions using exclusively the knowledge retrieved from a vector store with relevant information about the question."
+                  "If you don't know the answer, don't make up it.")
+
+        return {"messages": chat_model_with_tools.invoke(input=[SystemMessage(content=prompt)] + state["messages"])}
+
+    graph = StateGraph(ChatRagState)
+    graph.add_node("chat node", chat_node)
+    graph.add_node("tools", ToolNode(tools=chat_tools))
+    graph.add_edge(START, "chat node")
+    graph.add_conditional_edges(source="chat node", path=tools_condition)
+    graph.add_edge("tools", "chat node")
+
+    return graph.compile(checkpointer=checkpointer)
+
+
+# 3. The batch API
+
+def answer_questions(graph, questions: list[str], max_concurrency: int = 8, thread_ids: Optional[list[str]] = None) -> list[str]:
+    """
+    Runs the graph for all questions concurrently and returns the answers in the same order of the questions.
+
+    Args:
+        graph: the compiled RAG chat graph.
+        questions: the questions to be answered.
+        max_concurrency: max number of graphs running at the same time.
+        thread_ids: optional thread id of each question, for graphs compiled with a checkpointer.
+    """
+    inputs = [{"messages": [HumanMessage(content=question, name="user")]} for question in questions]
+    configs = [
+        {"max_concurrency": max_concurrency, **({"configurable": {"thread_id": thread_ids[i]}} if thread_ids else {})}
+        for i in range(len(questions))
+    ]
+    responses = graph.batch(inputs, config=configs)
+
+    return [response["messages"][-1].content for response in responses]
+
+def answer_questions_with_chain(retriever: NumpyIndexRetriever, prompt, chat_model, questions: list[str], max_concurrency: int = 8) -> list[str]:
+    """
+    Batch version of the rag_chain_with_outparser of the tutorial 1: one retrieval for all questions (one embedding
+    call and one vector search, if the retriever embeddings have embed_queries), then the LLM calls run concurrently.
+    """
+    contexts = retriever.batch_search(questions)
+    inputs = [{"context": format_retrieved_docs(docs), "question": question} for docs, question in zip(contexts, questions)]
+
+    return (prompt | chat_model | StrOutputParser()).batch(inputs, config={"max_concurrency": max_concurrency})
+
+
+if __name__ == "__main__":
+    from langchain_openai import ChatOpenAI
+    from ingestion import create_vector_store
+    from numpy_vector_index import NumpyVectorIndex
+
+    vector_store = create_vector_store()
+    retriever = NumpyIndexRetriever(index=NumpyVectorIndex.from_chroma(vector_store), embeddings=vector_store.embeddings, k=20)
+    batcher = RetrievalBatcher(retriever)
+    graph = create_rag_graph(ChatOpenAI(model="gpt-3.5-turbo"), batcher)
+
+    questions = [
+        "What is the Alzheimers disease?",
+        "O Alzheimer é comum em que segmentos da população?",
+        "Which biomarkers are used in the diagnosis of Alzheimer's disease?",
+        "What are the risk factors of dementia?",
+    ]
+
+    for max_concurrency in [1, 4]:
+        start = time.perf_counter()
+        answers = answer_questions(graph, questions, max_concurrency=max_concurrency)
+        print(f"max_concurrency={max_concurrency}: {time.perf_counter() - start:.2f}s | "
+              f"retrieval batches: {batcher.batches}, queries: {batcher.queries}")
+
+    for question, answer in zip(questions, answers):
+        print("Q:", question)
+        print("A:", answer)
+        print("---"*10)
+
+    batcher.close()
@@ -0,0 +1,277 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import dotenv
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# Indexing pipeline for the PDF corpus used in the RAG tutorials.
+# Instead of re-embedding every chunk at each run, the chunks get ids derived from their content, the embeddings are
+# kept in an on-disk cache, and only the new or changed chunks are embedded and written in the vector store.
+
+# Set up env variables
+print("Is env variables loaded?", dotenv.load_dotenv(".env"))
+
+PATH_PDFS = "notebooks/langchain/data/pdf"
+PERSIST_DIRECTORY = "./notebooks/data/chroma"
+PATH_EMBEDDINGS_CACHE = "./notebooks/data/embeddings_cache.db"
+COLLECTION_NAME = "alzheimer_papers_rag_tutorial_01"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-l6-v2"
+
+# Number of texts sent in each call to the embedding model.
+# Local models are limited by the memory of the device, OpenAI models by the max number of inputs per request.
+EMBEDDING_BATCH_SIZES = {
+    "sentence-transformers/all-MiniLM-l6-v2": 64,
+    "text-embedding-3-small": 2048,
+    "text-embedding-3-large": 2048,
+    "text-embedding-ada-002": 2048,
+}
+DEFAULT_EMBEDDING_BATCH_SIZE = 32
+# Prefix added to the queries (not to the documents) by the models trained with instructions.
+# The models not listed here embed the queries as documents.
+QUERY_INSTRUCTIONS = {
+    "intfloat/e5-base-v2": "query: ",
+    "intfloat/e5-large-v2": "query: ",
+    "BAAI/bge-small-en-v1.5": "Represent this sentence for searching relevant passages: ",
+    "BAAI/bge-base-en-v1.5": "Represent this sentence for searching relevant passages: ",
+}
+# Max number of chunks written to the vector store in a single call
+VECTOR_STORE_BATCH_SIZE = 1000
+
+
+# 1. Content based chunk ids
+
+def chunk_id(chunk: Document) -> str:
+    """
+    Generates the id of a chunk from its source file name, page and content.
+    Unlike an id based on the chunk position, it doesn't change when other chunks are added or removed.
+    A chunk whose text moved to another page gets a new id, so its page metadata is rewritten (its embedding is
+    still taken from the cache, as it's keyed by the text).
+    """
+    source = os.path.basename(chunk.metadata.get("source", ""))
+    page = chunk.metadata.get("page", "")
+    return hashlib.sha256(f"{source}\x00{page}\x00{chunk.page_content}".encode()).hexdigest()
+
+def deduplicate_chunks(chunks: Iterable[Document]) -> tuple[list[str], list[Document]]:
+    """
+    Returns the ids and the chunks, keeping only the first occurrence of repeated chunks (same source, page and content).
+    """
+    unique = {}
+    for chunk in chunks:
+        unique.setdefault(chunk_id(chunk), chunk)
+
+    return list(unique.keys()), list(unique.values())
+
+
+# 2. Embeddings with an on-disk cache and batched calls
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model, keeping the computed vectors in a SQLite file.
+    Only the texts that are not in the cache are sent to the model, in batches of batch_size texts.
+
+    Args:
+        embedding_model: the underlying embedding model.
+        path_cache: path of the SQLite file of the cache.
+        namespace: identifies the model in the cache, so vectors of different models are never mixed.
+        batch_size: number of texts per call to the model. If None, it's chosen from the model name.
+        query_instruction: prefix of the queries for models trained with instructions. If None, it's chosen from
+            the model name. The embedding_model should then be the plain model, not one that adds the instruction itself.
+    """
+
+    def __init__(self, embedding_model: Embeddings, path_cache: str = PATH_EMBEDDINGS_CACHE,
+                 namespace: str = EMBEDDING_MODEL_NAME, batch_size: Optional[int] = None,
+                 query_instruction: Optional[str] = None):
+        self.embedding_model = embedding_model
+        self.namespace = namespace
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZES.get(namespace, DEFAULT_EMBEDDING_BATCH_SIZE)
+        self.query_instruction = QUERY_INSTRUCTIONS.get(namespace, "") if query_instruction is None else query_instruction
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path_cache)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path_cache, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._connection.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{text}".encode()).hexdigest()
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock:
+            # SQLite limits the number of parameters of a query
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, keys: list[str], vectors: list[list[float]]):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in zip(keys, vectors)]
+            )
+            self._connection.commit()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        vectors = self._lookup(unique_keys)
+
+        # Repeated texts are embedded only once, and the hits and misses are counted per unique text
+        missing = list(dict.fromkeys(key_text for key_text in zip(keys, texts) if key_text[0] not in vectors))
+        self.hits += len(unique_keys) - len(missing)
+        self.misses += len(missing)
+
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            batch_vectors = self.embedding_model.embed_documents([text for _, text in batch])
+            self._store([key for key, _ in batch], batch_vectors)
+            vectors.update({key: vector for (key, _), vector in zip(batch, batch_vectors)})
+
+        return [vectors[key] for key in keys]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds many queries with the batched calls of embed_documents, instead of one model call per query.
+        The query instruction is added to the texts, so the query vectors are cached apart from the document vectors.
+        """
+        return self.embed_documents([self.query_instruction + text for text in texts])
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_queries([text])[0]
+
+
+# 3. Incremental indexing
+
+@dataclass
+class IndexingReport:
+    added: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    duplicated: int = 0
+    seconds: float = 0.0
+
+def index_chunks(chunks: Iterable[Document], vector_store, incremental: bool = True) -> IndexingReport:
+    """
+    Writes the chunks in the vector store, embedding only the ones that are not stored yet.
+
+    Args:
+        chunks: the chunks (documents split in smaller pieces) to be indexed.
+        vector_store: a Chroma vector store, whose embedding function should be a CachedEmbeddings.
+        incremental: if True, the stored chunks that are not among the given ones are deleted: chunks that no longer
+            exist in their source (e.g. edited pages), and all the chunks of the sources not given (e.g. removed PDFs).
+            So the chunks must be the whole corpus of the vector store.
+    """
+    start = time.perf_counter()
+    chunks = list(chunks)
+    ids, unique_chunks = deduplicate_chunks(chunks)
+    report = IndexingReport(duplicated=len(chunks) - len(unique_chunks))
+
+    existing_ids = set()
+    for begin in range(0, len(ids), VECTOR_STORE_BATCH_SIZE):
+        existing_ids.update(vector_store.get(ids=ids[begin:begin + VECTOR_STORE_BATCH_SIZE], include=[])["ids"])
+
+    new_pairs = [(id_, chunk) for id_, chunk in zip(ids, unique_chunks) if id_ not in existing_ids]
+    for begin in range(0, len(new_pairs), VECTOR_STORE_BATCH_SIZE):
+        batch = new_pairs[begin:begin + VECTOR_STORE_BATCH_SIZE]
+        vector_store.add_documents(documents=[chunk for _, chunk in batch], ids=[id_ for id_, _ in batch])
+
+    report.added = len(new_pairs)
+    report.unchanged = len(existing_ids)
+
+    if incremental:
+        sources = {chunk.metadata["source"] for chunk in unique_chunks if "source" in chunk.metadata}
+        report.deleted = delete_stale_chunks(vector_store, sources=sources, current_ids=set(ids))
+        report.deleted += delete_removed_sources(vector_store, sources=sources)
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+def delete_stale_chunks(vector_store, sources: set[str], current_ids: set[str]) -> int:
+    """
+    Deletes the chunks stored for the given sources that are not among the current ids (e.g. chunks of edited pages).
+    Returns the number of deleted chunks.
+    """
+    if not sources:
+        return 0
+
+    stored_ids = vector_store.get(where={"source": {"$in": sorted(sources)}}, include=[])["ids"]
+    stale_ids = [id_ for id_ in stored_ids if id_ not in current_ids]
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+
+    return len(stale_ids)
+
+def delete_removed_sources(vector_store, sources: set[str]) -> int:
+    """
+    Deletes the chunks of the sources that are not among the given ones (e.g. PDFs removed from the directory).
+    Returns the number of deleted chunks.
+    """
+    where = {"source": {"$nin": sorted(sources)}} if sources else None
+    removed_ids = vector_store.get(where=where, include=[])["ids"]
+    for begin in range(0, len(removed_ids), VECTOR_STORE_BATCH_SIZE):
+        vector_store.delete(ids=removed_ids[begin:begin + VECTOR_STORE_BATCH_SIZE])
+
+    return len(removed_ids)
+
+
+# 4. Putting all things together
+
+def create_vector_store(collection_name: str = COLLECTION_NAME, persist_directory: str = PERSIST_DIRECTORY,
+                        model_name: str = EMBEDDING_MODEL_NAME, path_cache: str = PATH_EMBEDDINGS_CACHE):
+    from langchain_chroma import Chroma
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+    embeddings = CachedEmbeddings(
+        embedding_model=HuggingFaceEmbeddings(model_name=model_name),
+        path_cache=path_cache,
+        namespace=model_name
+    )
+    vector_store = Chroma(
+        collection_name=collection_name,
+        persist_directory=persist_directory,
+        embedding_function=embeddings
+    )
+
+    return vector_store
+
+def ingest_pdf_directory(path_pdfs: str = PATH_PDFS, vector_store=None, incremental: bool = True,
+                         chunk_size: int = 1000, chunk_overlap: int = 200) -> IndexingReport:
+    from langchain_community.document_loaders import PyPDFDirectoryLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    vector_store = vector_store or create_vector_store()
+
+    pdf_documents = PyPDFDirectoryLoader(path=path_pdfs).load()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    pdf_text_splits = text_splitter.split_documents(pdf_documents)
+
+    return index_chunks(pdf_text_splits, vector_store=vector_store, incremental=incremental)
+
+
+if __name__ == "__main__":
+    vector_store = create_vector_store()
+
+    print("===== First indexing =====")
+    print(ingest_pdf_directory(vector_store=vector_store))
+
+    # Running it again doesn't embed anything, as all the chunks are already stored
+    print("===== Re-indexing =====")
+    print(ingest_pdf_directory(vector_store=vector_store))
+
+    embeddings = vector_store.embeddings
+    print(f"Embedding cache: {embeddings.hits} hits, {embeddings.misses} misses")
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# In-process vector index for the RAG corpus.
+# Our corpus is small enough to keep all the embeddings in a single float32 matrix with normalized rows.
+# So, the top-k search for a query is one matrix-vector product plus an argpartition, without the overhead of
+# a vector database client. The matrix is saved as a .npy file (opened memory-mapped) and the documents and
+# their metadata are saved in a sidecar JSON lines file.
+
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "metadata.jsonl"
+PATH_INDEX = "./notebooks/data/numpy_index"
+
+
+# 1. The index
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorIndex:
+    """
+    Exact cosine similarity index over a contiguous float32 matrix.
+
+    Args:
+        vectors: matrix (n_documents x dimension) with normalized rows.
+        ids: the id of each row.
+        texts: the content of each row.
+        metadatas: the metadata of each row (e.g. source and page).
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: list[str], texts: list[str], metadatas: list[dict]):
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+
+        # Metadata columns used by the filters, so they can be evaluated as vectorized masks
+        self.sources = np.array([m.get("source", "") for m in metadatas], dtype=object)
+        self.pages = np.array([m.get("page", -1) for m in metadatas], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_embeddings(cls, ids: list[str], texts: list[str], metadatas: list[dict], vectors) -> "NumpyVectorIndex":
+        return cls(np.ascontiguousarray(_normalize(vectors)), list(ids), list(texts), [dict(m or {}) for m in metadatas])
+
+    @classmethod
+    def from_chroma(cls, vector_store) -> "NumpyVectorIndex":
+        data = vector_store.get(include=["embeddings", "documents", "metadatas"])
+        return cls.from_embeddings(data["ids"], data["documents"], data["metadatas"], data["embeddings"])
+
+    def save(self, directory: str = PATH_INDEX):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, VECTORS_FILE), np.asarray(self.vectors))
+        with open(os.path.join(directory, METADATA_FILE), "w") as f:
+            for id_, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                f.write(json.dumps({"id": id_, "text": text, "metadata": metadata}) + "\n")
+
+    @classmethod
+    def load(cls, directory: str = PATH_INDEX, mmap: bool = True) -> "NumpyVectorIndex":
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r" if mmap else None)
+        ids, texts, metadatas = [], [], []
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            for line in f:
+                row = json.loads(line)
+                ids.append(row["id"])
+                texts.append(row["text"])
+                metadatas.append(row["metadata"])
+
+        return cls(vectors, ids, texts, metadatas)
+
+    def _filter_mask(self, filter: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        Filters on the source and page metadata. Each key accepts a value or a list of accepted values,
+        e.g. {"source": "a.pdf", "page": [0, 1, 2]}.
+        """
+        if not filter:
+            return None
+
+        mask = np.ones(len(self), dtype=bool)
+        for key, column in [("source", self.sources), ("page", self.pages)]:
+            if key in filter:
+                accepted = filter[key] if isinstance(filter[key], (list, tuple, set)) else [filter[key]]
+                mask &= np.isin(column, list(accepted))
+
+        return mask
+
+    def search(self, query_vectors, k: int = 20, filter: Optional[dict] = None) -> list[list[tuple[int, float]]]:
+        """
+        Returns, for each query, the (row, score) of the k most similar rows, ordered by decreasing score.
+
+        Args:
+            query_vectors: a query embedding or a matrix (n_queries x dimension) of query embeddings.
+            k: number of results per query.
+            filter: metadata filter on source/page.
+        """
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        if len(self) == 0:
+            return [[] for _ in range(len(queries))]
+
+        queries = _normalize(queries)
+        scores = queries @ self.vectors.T
+
+        mask = self._filter_mask(filter)
+        n_candidates = len(self) if mask is None else int(mask.sum())
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+
+        k = min(k, n_candidates)
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        # argpartition finds the top-k in linear time, then only those k are sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(np.arange(scores.shape[1]), (len(queries), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)[:, :k]
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        return [[(int(i), float(s)) for i, s in zip(rows, row_scores)] for rows, row_scores in zip(top, top_scores)]
+
+    def document(self, row: int, score: Optional[float] = None) -> Document:
+        metadata = dict(self.metadatas[row])
+        if score is not None:
+            metadata["score"] = score
+        return Document(page_content=self.texts[row], metadata=metadata, id=self.ids[row])
+
+
+# 2. The retriever, a drop-in replacement for vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 20})
+
+def embed_queries(embeddings, queries: list[str]) -> list[list[float]]:
+    """
+    Embeds the queries in a single batched call when the embeddings support it (e.g. the CachedEmbeddings).
+    Otherwise, each query goes through embed_query, so the query instructions of the model are still applied.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries)
+    return [embeddings.embed_query(query) for query in queries]
+
+
+class NumpyIndexRetriever(BaseRetriever):
+    index: Any
+    embeddings: Any
+    k: int = 20
+    filter: Optional[dict] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        return self.batch_search([query])[0]
+
+    def batch_search(self, queries: list[str], filter: Optional[dict] = None) -> list[list[Document]]:
+        """
+        Searches many queries with one embedding call and a single matrix product.
+        The queries are embedded as queries, not as documents, as the Chroma retriever does: for models with
+        instructions (e5, bge) the query and the document embeddings of the same text differ.
+        """
+        query_vectors = embed_queries(self.embeddings, queries)
+        results = self.index.search(query_vectors, k=self.k, filter=filter or self.filter)
+        return [[self.index.document(row, score) for row, score in result] for result in results]
+
+
+if __name__ == "__main__":
+    from ingestion import create_vector_store
+
+    vector_store = create_vector_store()
+    embeddings = vector_store.embeddings
+
+    index = NumpyVectorIndex.from_chroma(vector_store)
+    index.save()
+    index = NumpyVectorIndex.load(mmap=True)
+    print("Indexed chunks:", len(index))
+
+    questions = [
+        "What is the Alzheimers disease?",
+        "O Alzheimer é comum em que segmentos da população?",
+        "Which biomarkers are used in the diagnosis of Alzheimer's disease?",
+        "What are the risk factors of dementia?",
+        "How does amyloid beta accumulate in the brain?",
+    ] * 20
+    query_vectors = embed_queries(embeddings, questions)
+    k = 20
+
+    ## Chroma: one client query per question
+    start = time.perf_counter()
+    chroma_ids = [[doc.id for doc in vector_store.similarity_search_by_vector(vector, k=k)] for vector in query_vectors]
+    chroma_ms = 1000 * (time.perf_counter() - start) / len(questions)
+
+    ## Numpy index: one query at a time and all queries in a batch
+    start = time.perf_counter()
+    numpy_results = [index.search(vector, k=k)[0] for vector in query_vectors]
+    numpy_ms = 1000 * (time.perf_counter() - start) / len(questions)
+
+    start = time.perf_counter()
+    index.search(query_vectors, k=k)
+    numpy_batch_ms = 1000 * (time.perf_counter() - start) / len(questions)
+
+    # The numpy search is exact, so the recall measures how much of the exact top-k the Chroma (HNSW) search finds
+    recall = np.mean([
+        len(set(ids) & {index.ids[row] for row, _ in result}) / max(1, len(result))
+        for ids, result in zip(chroma_ids, numpy_results)
+    ])
+
+    print(f"Chroma: {chroma_ms:.3f} ms/query | Numpy: {numpy_ms:.3f} ms/query | Numpy batched: {numpy_batch_ms:.3f} ms/query")
+    print(f"Recall@{k} of Chroma against the exact search: {recall:.3f}")
+
+    retriever = NumpyIndexRetriever(index=index, embeddings=embeddings, k=k)
+    for doc in retriever.invoke("What is the Alzheimers disease?")[:3]:
+        print(doc.metadata)
@@ -0,0 +1,255 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+# Cache in front of the RAG chain and of the retriever tool of the RAG tutorials.
+# Repeated questions (e.g. FAQs) are answered without the similarity search and the LLM call.
+# A question matches a cached one when their normalized texts are equal (exact match) or, optionally, when
+# their embeddings are similar enough (semantic match). The cache is cleared when the vector store collection changes.
+
+
+# 1. The cache
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+def collection_fingerprint(vector_store) -> str:
+    """
+    Fingerprint of the vector store content. As the chunk ids are content hashes (see ingestion.chunk_id),
+    any added, removed or edited chunk changes it.
+    """
+    ids = vector_store.get(include=[])["ids"]
+    return hashlib.sha256("\n".join(sorted(ids)).encode()).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    context: Optional[str] = None
+    answer: Optional[str] = None
+    created_at: float = field(default_factory=time.monotonic)
+    vector: Optional[np.ndarray] = None
+
+
+class RagResponseCache:
+    """
+    LRU cache with time to live for the retrieved contexts and the final answers of the RAG questions.
+
+    Args:
+        max_entries: max number of cached questions. The least recently used one is evicted first.
+        ttl_seconds: time after which an entry expires.
+        embeddings: embedding model used for the semantic match. If None, only exact matches are used.
+        similarity_threshold: min cosine similarity between two questions for a semantic match.
+        fingerprint_fn: returns a fingerprint of the vector store collection. When it changes, the cache is cleared.
+        fingerprint_check_seconds: min interval between two fingerprint checks.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, embeddings: Optional[Embeddings] = None,
+                 similarity_threshold: float = 0.92, fingerprint_fn: Optional[Callable[[], str]] = None,
+                 fingerprint_check_seconds: float = 30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.fingerprint_fn = fingerprint_fn
+        self.fingerprint_check_seconds = fingerprint_check_seconds
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        # Embeddings computed in a miss, kept to be reused when the answer is stored
+        self._recent_vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.RLock()
+        self._fingerprint = fingerprint_fn() if fingerprint_fn else None
+        self._last_check = time.monotonic()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return (self.exact_hits + self.semantic_hits) / total if total else 0.0
+
+    def metrics(self) -> dict:
+        return {"exact_hits": self.exact_hits, "semantic_hits": self.semantic_hits, "misses": self.misses,
+                "hit_rate": self.hit_rate, "entries": len(self._entries), "invalidations": self.invalidations}
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._recent_vectors.clear()
+            self.invalidations += 1
+
+    def _check_collection(self):
+        # Only the check timer is read under the lock: fingerprint_fn lists the whole collection
+        with self._lock:
+            if not self.fingerprint_fn or time.monotonic() - self._last_check < self.fingerprint_check_seconds:
+                return
+            self._last_check = time.monotonic()
+        fingerprint = self.fingerprint_fn()
+        with self._lock:
+            changed = fingerprint != self._fingerprint
+            self._fingerprint = fingerprint
+        if changed:
+            self.invalidate()
+
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _embed(self, key: str) -> np.ndarray:
+        with self._lock:
+            vector = self._recent_vectors.get(key)
+        if vector is not None:
+            return vector
+
+        # The model call runs without the lock, so concurrent lookups don't wait for each other
+        vector = np.asarray(self.embeddings.embed_query(key), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._recent_vectors[key] = vector
+            if len(self._recent_vectors) > 256:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+    def _semantic_match(self, vector: np.ndarray) -> Optional[CacheEntry]:
+        candidates = [entry for entry in self._entries.values() if entry.vector is not None and not self._is_expired(entry)]
+        if not candidates:
+            return None
+
+        similarities = np.stack([entry.vector for entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        return candidates[best] if similarities[best] >= self.similarity_threshold else None
+
+    def get(self, question: str) -> Optional[CacheEntry]:
+        """
+        Returns the cached entry of the question (or of a similar question), or None in a miss.
+        """
+        self._check_collection()
+        key = normalize_question(question)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry
+
+        if self.embeddings is not None:
+            vector = self._embed(key)
+            with self._lock:
+                if (entry := self._semantic_match(vector)) is not None:
+                    self._entries.move_to_end(normalize_question(entry.question))
+                    self.semantic_hits += 1
+                    return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question: str, context: Optional[str] = None, answer: Optional[str] = None) -> CacheEntry:
+        """
+        Stores the context and/or the answer of the question. Fields not given keep their cached values.
+        """
+        key = normalize_question(question)
+        # Usually already computed by the get of the same question
+        vector = self._embed(key) if self.embeddings is not None else None
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or self._is_expired(entry):
+                entry = CacheEntry(question=question, vector=vector)
+
+            entry.context = context if context is not None else entry.context
+            entry.answer = answer if answer is not None else entry.answer
+            self._entries[key] = entry
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            return entry
+
+
+# 2. Cached versions of the RAG components of the tutorials
+
+def format_retrieved_docs(documents):
+    return "\n\n".join([doc.page_content for doc in documents])
+
+def create_cached_retriever_tool(cache: RagResponseCache, retriever):
+    def retriever_tool(question: str) -> str:
+        """
+        Receives a question and searches in a vector store for contexts that are relevant to the question.
+
+        Args:
+            question: the query to be used in the vector store search.
+        """
+        entry = cache.get(question)
+        if entry is not None and entry.context is not None:
+            return entry.context
+
+        context = format_retrieved_docs(retriever.invoke(input=question))
+        cache.put(question, context=context)
+
+        return context
+
+    return retriever_tool
+
+def create_cached_rag_chain(cache: RagResponseCache, retriever, prompt, chat_model):
+    """
+    Same as the rag_chain_with_outparser of the tutorial 1, but answering repeated questions from the cache.
+    """
+    generation_chain = prompt | chat_model | StrOutputParser()
+
+    def answer(question: str) -> str:
+        entry = cache.get(question)
+        if entry is not None and entry.answer is not None:
+            return entry.answer
+
+        context = entry.context if entry is not None and entry.context is not None \
+            else format_retrieved_docs(retriever.invoke(input=question))
+        response = generation_chain.invoke({"context": context, "question": question})
+        cache.put(question, context=context, answer=response)
+
+        return response
+
+    return RunnableLambda(answer)
+
+
+if __name__ == "__main__":
+    from langchain_openai import ChatOpenAI
+    from langchain_core.prompts import ChatPromptTemplate
+    from ingestion import create_vector_store
+
+    vector_store = create_vector_store()
+    retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 20})
+
+    prompt = ChatPromptTemplate.from_template(
+        "You are a helpful assistant for question-answering tasks and an expert in Alzheimers cientific research."
+        " Use the following pieces of retrieved context to answer the question."
+        " If you don't know the answer, just say that you don't know."
+        " Use three sentences maximum and keep the answer concise."
+        " Question: {question}\n\n"
+        " Context: {context}\n\n"
+        " Answer:"
+    )
+
+    cache = RagResponseCache(embeddings=vector_store.embeddings, fingerprint_fn=lambda: collection_fingerprint(vector_store))
+    rag_chain = create_cached_rag_chain(cache, retriever, prompt, ChatOpenAI(model="gpt-3.5-turbo"))
+
+    for question in ["What is the Alzheimers disease?", "what is the alzheimers disease", "What is Alzheimer's disease?"]:
+        start = time.perf_counter()
+        print(rag_chain.invoke(question))
+        print(f"--> {time.perf_counter() - start:.3f}s | {cache.metrics()}")
@@ -0,0 +1,208 @@
+import os
+import time
+import queue
+import resource
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, Optional
+
+from langchain_core.documents import Document
+
+from ingestion import PATH_PDFS, VECTOR_STORE_BATCH_SIZE, IndexingReport, create_vector_store, chunk_id, \
+    delete_removed_sources, delete_stale_chunks, index_chunks
+
+# Streaming version of the PDF loading and splitting steps of the RAG tutorials.
+# PyPDFDirectoryLoader.load() reads all the pages of all PDFs in a single process before the splitting starts.
+# Here, the PDFs are broken into page ranges that are parsed and split in a process pool, and the chunks are
+# yielded as soon as each range is ready. A bounded queue links this stage to the embedding stage, so parsing,
+# splitting and embedding run at the same time, and the memory doesn't grow with the corpus size.
+
+
+# 1. Work done inside the worker processes
+
+def _count_pages(path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+def _parse_and_split(path: str, first_page: int, last_page: int, chunk_size: int, chunk_overlap: int) -> tuple[list[Document], int]:
+    """
+    Extracts the text of the pages [first_page, last_page) of a PDF and splits it into chunks.
+    The documents have the same metadata generated by the PyPDFLoader (source and page).
+    """
+    from pypdf import PdfReader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    reader = PdfReader(path)
+    pages = [
+        Document(page_content=reader.pages[page].extract_text(), metadata={"source": path, "page": page})
+        for page in range(first_page, last_page)
+    ]
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    return text_splitter.split_documents(pages), len(pages)
+
+
+# 2. The chunks generator
+
+@dataclass
+class LoadingStats:
+    pages: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+    peak_worker_rss_mb: float = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    def update_memory(self):
+        # On Linux, ru_maxrss is given in kilobytes. For the children, it's the peak of the largest finished worker.
+        self.peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.peak_worker_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def stream_pdf_chunks(path_pdfs: str = PATH_PDFS, max_workers: Optional[int] = None, pages_per_task: int = 8,
+                      chunk_size: int = 1000, chunk_overlap: int = 200,
+                      stats: Optional[LoadingStats] = None) -> Iterator[Document]:
+    """
+    Yields the chunks of all PDFs in the folder, parsing and splitting them in parallel.
+
+    Args:
+        path_pdfs: the folder with the PDF files.
+        max_workers: number of worker processes. Default: number of CPUs.
+        pages_per_task: number of pages parsed by a worker in each task.
+        chunk_size: max size of a chunk, as in the RecursiveCharacterTextSplitter.
+        chunk_overlap: overlap between consecutive chunks, as in the RecursiveCharacterTextSplitter.
+        stats: if given, it's updated with the number of pages and chunks, the time and the memory peak.
+    """
+    stats = stats if stats is not None else LoadingStats()
+    max_workers = max_workers or os.cpu_count() or 1
+    # Only a few tasks are submitted in advance, so finished results don't pile up in memory
+    max_pending_tasks = 2 * max_workers
+    start = time.perf_counter()
+
+    paths = sorted(os.path.join(path_pdfs, name) for name in os.listdir(path_pdfs) if name.lower().endswith(".pdf"))
+
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        page_counts = executor.map(_count_pages, paths)
+        tasks = (
+            (path, first_page, min(first_page + pages_per_task, n_pages))
+            for path, n_pages in zip(paths, page_counts)
+            for first_page in range(0, n_pages, pages_per_task)
+        )
+
+        for task in tasks:
+            pending.add(executor.submit(_parse_and_split, *task, chunk_size, chunk_overlap))
+            if len(pending) < max_pending_tasks:
+                continue
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunks, n_pages = future.result()
+                stats.pages += n_pages
+                stats.chunks += len(chunks)
+                yield from chunks
+
+        while pending:
+            future = pending.pop()
+            chunks, n_pages = future.result()
+            stats.pages += n_pages
+            stats.chunks += len(chunks)
+            yield from chunks
+    finally:
+        # If the consumer stops (or fails) in the middle, the tasks not started yet are dropped, and only the
+        # running ones are waited for
+        for future in pending:
+            future.cancel()
+        executor.shutdown(cancel_futures=True)
+
+    stats.seconds = time.perf_counter() - start
+    stats.update_memory()
+
+
+# 3. The pipeline: loading/splitting in a background thread, embedding/storing in the caller thread
+
+_END_OF_STREAM = object()
+
+def ingest_streaming(path_pdfs: str = PATH_PDFS, vector_store=None, incremental: bool = True, max_workers: Optional[int] = None,
+                     batch_size: int = 256, max_queued_batches: int = 4, pages_per_task: int = 8,
+                     chunk_size: int = 1000, chunk_overlap: int = 200) -> tuple[IndexingReport, LoadingStats]:
+    """
+    Indexes the PDF folder, overlapping the parsing/splitting of the next chunks with the embedding of the current ones.
+
+    Args:
+        path_pdfs: the folder with the PDF files.
+        vector_store: a Chroma vector store. Default: the one created by ingestion.create_vector_store.
+        incremental: if True, outdated chunks of the indexed sources, and the chunks of the removed PDFs, are deleted at the end.
+        max_workers: number of worker processes used to parse the PDFs.
+        batch_size: number of chunks sent to the embedding stage at once.
+        max_queued_batches: size of the queue between the stages. When it's full, the loading waits (backpressure).
+    """
+    vector_store = vector_store or create_vector_store()
+    batches = queue.Queue(maxsize=max_queued_batches)
+    stats = LoadingStats()
+
+    def produce():
+        try:
+            batch = []
+            for chunk in stream_pdf_chunks(path_pdfs, max_workers=max_workers, pages_per_task=pages_per_task,
+                                           chunk_size=chunk_size, chunk_overlap=chunk_overlap, stats=stats):
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    batches.put(batch)
+                    batch = []
+            if batch:
+                batches.put(batch)
+            batches.put(_END_OF_STREAM)
+        except BaseException as error:
+            batches.put(error)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    report = IndexingReport()
+    start = time.perf_counter()
+    # Only the ids are kept for the whole corpus, to find the outdated chunks at the end
+    current_ids, sources = set(), set()
+
+    while (batch := batches.get()) is not _END_OF_STREAM:
+        if isinstance(batch, BaseException):
+            raise batch
+
+        batch_report = index_chunks(batch, vector_store=vector_store, incremental=False)
+        report.added += batch_report.added
+        report.unchanged += batch_report.unchanged
+        report.duplicated += batch_report.duplicated
+        current_ids.update(chunk_id(chunk) for chunk in batch)
+        sources.update(chunk.metadata["source"] for chunk in batch)
+
+    producer.join()
+
+    if incremental:
+        report.deleted = delete_stale_chunks(vector_store, sources=sources, current_ids=current_ids)
+        report.deleted += delete_removed_sources(vector_store, sources=sources)
+
+    report.seconds = time.perf_counter() - start
+    stats.update_memory()
+
+    return report, stats
+
+
+if __name__ == "__main__":
+    ## Loading and splitting only, to size the number of workers
+    for n_workers in [1, 2, 4]:
+        stats = LoadingStats()
+        for _ in stream_pdf_chunks(max_workers=n_workers, stats=stats):
+            pass
+        print(f"Workers: {n_workers} | pages: {stats.pages} | chunks: {stats.chunks} | "
+              f"pages/s: {stats.pages_per_second:.1f} | peak RSS: {stats.peak_rss_mb:.0f} MB "
+              f"(largest worker: {stats.peak_worker_rss_mb:.0f} MB)")
+
+    ## Complete pipeline
+    report, stats = ingest_streaming(batch_size=VECTOR_STORE_BATCH_SIZE)
+    print(report)
+    print(f"Pages/s: {stats.pages_per_second:.1f} | peak RSS: {stats.peak_rss_mb:.0f} MB")
@@ -0,0 +1,207 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import weakref
+from pathlib import Path
+
+from aiohttp import web, WSMsgType
+from langchain_core.messages import AIMessageChunk, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+# The benchmark helpers load the graph modules (optionally with the fake chat model)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+from fake_chat_model import FakeChatModel
+from graph_benchmark import load_module, arithmetic_calls
+
+# Long running server for the compiled graphs of the repo.
+# Each request is routed by its thread_id: turns of the same thread run one after the other (so they don't
+# fork the thread history), while different threads run concurrently, up to max_concurrency graph runs.
+# When more than max_queued requests are waiting, new ones are rejected with 429 (backpressure).
+# The answers can be returned at once (JSON), streamed token by token (server sent events) or through a WebSocket.
+
+
+# 1. The graphs that can be hosted
+
+# name -> (module path, graph factory, fake model script, node whose model tokens are the answer)
+GRAPHS = {
+    "summarization": ("state_and_memory/simple_chat_with_summarization.py", lambda m: m.create_graph(), None, "chat node"),
+    "async_chatbot": ("human_in_the_loop/async_chatbot.py",
+                      lambda m: m.AsyncChatbot(checkpointer=MemorySaver()).workflow, arithmetic_calls(), "assistant"),
+    "time_travel": ("human_in_the_loop/time_travel.py",
+                    lambda m: m.Chatbot(checkpointer=MemorySaver()).workflow, arithmetic_calls(), "assistant"),
+}
+
+def load_graph(name: str, fake: bool = False, latency: float = 0.0, token_latency: float = 0.0):
+    module_path, build, script, _ = GRAPHS[name]
+    factory = FakeChatModel.factory(replies=script, latency=latency, token_latency=token_latency) if fake else None
+    return build(load_module(module_path, chat_model_factory=factory))
+
+
+# 2. The server
+
+class Overloaded(Exception):
+    pass
+
+class ChatServer:
+    """
+    Args:
+        graph: a compiled graph with a checkpointer and a "messages" state key.
+        answer_node: the node whose model tokens are sent to the user. Tokens of other model calls (e.g. the
+            summarization node) are not part of the answer.
+        max_concurrency: max number of graph runs at the same time.
+        max_queued: max number of requests waiting for a slot. Above it, requests are rejected.
+    """
+
+    def __init__(self, graph, answer_node: str = "chat node", max_concurrency: int = 64, max_queued: int = 1000):
+        self.graph = graph
+        self.answer_node = answer_node
+        self.max_queued = max_queued
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # One lock per active thread. Locks of threads without requests are garbage collected.
+        self._thread_locks = weakref.WeakValueDictionary()
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def metrics(self) -> dict:
+        return {"queued": self.queued, "running": self.running, "completed": self.completed,
+                "rejected": self.rejected, "failed": self.failed, "active_threads": len(self._thread_locks)}
+
+    def _thread_lock(self, thread_id: str) -> asyncio.Lock:
+        lock = self._thread_locks.get(thread_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._thread_locks[thread_id] = lock
+        return lock
+
+    async def run_turn(self, thread_id: str, content: str):
+        """
+        Runs one conversation turn, yielding the answer tokens as they are generated.
+        """
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded()
+
+        lock = self._thread_lock(thread_id)
+        self.queued += 1
+        try:
+            await lock.acquire()
+            try:
+                await self._slots.acquire()
+            except BaseException:
+                lock.release()
+                raise
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        try:
+            graph_input = {"messages": [HumanMessage(content=content, name="User")]}
+            config = {"configurable": {"thread_id": thread_id}}
+            async for message, metadata in self.graph.astream(graph_input, config=config, stream_mode="messages"):
+                if isinstance(message, AIMessageChunk) and message.content \
+                        and metadata.get("langgraph_node") == self.answer_node:
+                    yield message.content
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._slots.release()
+            lock.release()
+
+    # HTTP and WebSocket handlers
+
+    async def handle_message(self, request: web.Request) -> web.StreamResponse:
+        thread_id = request.match_info["thread_id"]
+        try:
+            body = await request.json()
+            content = body["content"]
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({"error": 'the body must be a JSON object with a "content" key'}, status=400)
+        stream = request.query.get("stream", "false").lower() == "true"
+        start = time.perf_counter()
+
+        try:
+            if not stream:
+                tokens = [token async for token in self.run_turn(thread_id, content)]
+                return web.json_response({"thread_id": thread_id, "answer": "".join(tokens),
+                                          "latency_ms": 1000 * (time.perf_counter() - start)})
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            turn = self.run_turn(thread_id, content)
+            try:
+                # The first token is awaited before the headers are sent, so an overloaded server can still answer 429
+                first_token = await anext(turn, None)
+                await response.prepare(request)
+                if first_token is not None:
+                    await response.write(f"data: {json.dumps({'token': first_token})}\n\n".encode())
+                    async for token in turn:
+                        await response.write(f"data: {json.dumps({'token': token})}\n\n".encode())
+                await response.write(b"event: end\ndata: {}\n\n")
+                await response.write_eof()
+            finally:
+                # Releases the thread lock and the slot if the client disconnects in the middle of the stream
+                await turn.aclose()
+            return response
+
+        except Overloaded:
+            return web.json_response({"error": "server overloaded, retry later"}, status=429, headers={"Retry-After": "1"})
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        thread_id = request.match_info["thread_id"]
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                content = json.loads(msg.data)["content"]
+            except (ValueError, KeyError, TypeError):
+                await ws.send_json({"type": "error", "error": 'messages must be JSON objects with a "content" key'})
+                continue
+            try:
+                async for token in self.run_turn(thread_id, content):
+                    await ws.send_json({"type": "token", "content": token})
+                await ws.send_json({"type": "end"})
+            except Overloaded:
+                await ws.send_json({"type": "error", "error": "server overloaded, retry later"})
+
+        return ws
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics())
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/threads/{thread_id}/messages", self.handle_message),
+            web.get("/threads/{thread_id}/ws", self.handle_websocket),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hosts a compiled graph behind an HTTP/WebSocket interface.")
+    parser.add_argument("--graph", choices=list(GRAPHS), default="summarization")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--max-queued", type=int, default=1000)
+    parser.add_argument("--fake", action="store_true", help="Use the fake chat model, for load tests.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model time to first token, in seconds.")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Fake model time per token, in seconds.")
+    args = parser.parse_args()
+
+    graph = load_graph(args.graph, fake=args.fake, latency=args.latency, token_latency=args.token_latency)
+    server = ChatServer(graph, answer_node=GRAPHS[args.graph][3], max_concurrency=args.max_concurrency,
+                        max_queued=args.max_queued)
+    web.run_app(server.create_app(), host=args.host, port=args.port)
@@ -0,0 +1,92 @@
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import aiohttp
+
+# Open loop load generator for the chat_server.
+# Requests are started at a fixed rate (they don't wait for the previous ones to finish), spread over a number of
+# thread_ids, so we can measure the sustained requests per second and the tail latency of the server on one box.
+# Usage: python src/serving/chat_server.py --fake & python src/serving/load_generator.py --rps 200 --duration 30
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+async def send_request(session: aiohttp.ClientSession, url: str, thread_id: str, stream: bool, results: list):
+    start = time.perf_counter()
+    first_token = None
+    try:
+        async with session.post(f"{url}/threads/{thread_id}/messages", params={"stream": str(stream).lower()},
+                                json={"content": "Quanto é 2 mais 3?"}) as response:
+            if stream and response.status == 200:
+                async for line in response.content:
+                    if first_token is None and line.startswith(b"data: {\"token\""):
+                        first_token = time.perf_counter() - start
+            else:
+                await response.read()
+            status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        # The ClientTimeout raises asyncio.TimeoutError, which is not a ClientError
+        status = type(error).__name__
+
+    results.append((status, time.perf_counter() - start, first_token))
+
+
+async def run_load(url: str, rps: float, duration: float, n_threads: int, stream: bool) -> list:
+    results = []
+    tasks = []
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        n_requests = int(rps * duration)
+        for i in range(n_requests):
+            # Waits until the scheduled start of the request i
+            delay = start + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            thread_id = f"load-{random.randrange(n_threads)}"
+            tasks.append(asyncio.create_task(send_request(session, url, thread_id, stream, results)))
+
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        async with session.get(f"{url}/metrics") as response:
+            server_metrics = await response.json()
+
+    return results, elapsed, server_metrics
+
+
+def print_report(results: list, elapsed: float, server_metrics: dict):
+    statuses = Counter(status for status, _, _ in results)
+    latencies = [latency for status, latency, _ in results if status == 200]
+    first_tokens = [first for status, _, first in results if status == 200 and first is not None]
+
+    print(f"Requests: {len(results)} in {elapsed:.1f}s | statuses: {dict(statuses)}")
+    print(f"Sustained: {len(latencies) / elapsed:.1f} successful req/s")
+    print(f"Latency ms: p50={1000 * percentile(latencies, 0.5):.1f} p95={1000 * percentile(latencies, 0.95):.1f} "
+          f"p99={1000 * percentile(latencies, 0.99):.1f} max={1000 * max(latencies, default=float('nan')):.1f}")
+    if first_tokens:
+        print(f"Time to first token ms: p50={1000 * percentile(first_tokens, 0.5):.1f} p99={1000 * percentile(first_tokens, 0.99):.1f}")
+    print("Server metrics:", server_metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open loop load generator for the chat server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--rps", type=float, default=50, help="Requests started per second.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load.")
+    parser.add_argument("--threads", type=int, default=500, help="Number of distinct thread_ids.")
+    parser.add_argument("--stream", action="store_true", help="Request token streaming and measure the time to first token.")
+    args = parser.parse_args()
+
+    results, elapsed, server_metrics = asyncio.run(run_load(args.url, args.rps, args.duration, args.threads, args.stream))
+    print_report(results, elapsed, server_metrics)
@@ -0,0 +1,211 @@
+import logging
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from langgraph.graph import START, END, StateGraph
+from langchain_core.messages import AnyMessage, HumanMessage, RemoveMessage
+
+import simple_chat_with_summarization as summarization
+from simple_chat_with_summarization import StateSum, chat_node_with_summary, build_summary_prompt
+
+# Summarization out of the critical path of the answer.
+# In simple_chat_with_summarization.py the summarization node runs after the chat node, so the user waits for two
+# model calls whenever the history is long. Here the graph only answers, and the summary is a background job:
+# 1. after a turn, if the policy asks for a summary, a job gets the messages of the current state and calls the model;
+# 2. the job commits the summary and the RemoveMessage deletions in a single update_state (one checkpoint),
+#    holding the lock of the thread, so it never interleaves with a turn;
+# 3. turns that arrive while the summary is being generated run normally (with the previous summary). The job only
+#    deletes the messages it summarized, so the messages of those turns are kept for the next summary.
+
+logger = logging.getLogger(__name__)
+
+
+# 1. When to summarize and which messages
+
+@dataclass
+class SummaryPlan:
+    # Messages sent to the summarization model, after the current summary
+    to_summarize: list[AnyMessage]
+    # Messages deleted from the state once the summary is committed
+    to_delete: list[AnyMessage]
+    # Other state keys committed with the summary
+    extra_update: dict = field(default_factory=dict)
+
+
+class MessageCountPolicy:
+    """
+    The rule of summarization_conditional_edge: more than max_messages in the state.
+
+    Args:
+        max_messages: the summary is created when the state has more messages than it.
+        keep_last: number of recent messages kept in the state after the summary.
+    """
+
+    def __init__(self, max_messages: int = 6, keep_last: int = 3):
+        self.max_messages = max_messages
+        self.keep_last = keep_last
+
+    def plan(self, state: dict) -> Optional[SummaryPlan]:
+        messages = state["messages"]
+        if len(messages) <= self.max_messages:
+            return None
+        return SummaryPlan(to_summarize=list(messages), to_delete=list(messages[:-self.keep_last]))
+
+
+def summarize_with_model(chat_model) -> Callable[[list[AnyMessage], str], str]:
+    """
+    The summarization call of summarize_conversation, as a function of the messages and the current summary.
+    """
+    def summarize(messages: list[AnyMessage], summary: str) -> str:
+        response = chat_model.invoke(input=messages + [HumanMessage(content=build_summary_prompt(summary))])
+        return response.content
+    return summarize
+
+
+# 2. The graph, with the chat node only
+
+def create_graph(checkpointer, state_schema=StateSum):
+    # state_schema: StateSum or a subclass with the keys of the extra_update of the policy plans
+    graph = StateGraph(state_schema)
+    graph.add_node("chat node", chat_node_with_summary)
+    graph.add_edge(START, "chat node")
+    graph.add_edge("chat node", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+# 3. The turns and the background jobs
+
+class BackgroundSummarizer:
+    """
+    Args:
+        graph: a graph created by create_graph (or any graph with the StateSum keys and a checkpointer).
+        summarize: function (messages, current summary) -> new summary. Default: the model of simple_chat_with_summarization.py.
+        policy: decides when to summarize and what. Default: MessageCountPolicy().
+        max_workers: max number of summaries generated at the same time (for different threads).
+    """
+
+    def __init__(self, graph, summarize: Optional[Callable] = None, policy=None, max_workers: int = 4):
+        self.graph = graph
+        self.summarize = summarize or summarize_with_model(summarization.chat_model)
+        self.policy = policy or MessageCountPolicy()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarizer")
+
+        self._locks_guard = threading.Lock()
+        self._thread_locks = weakref.WeakValueDictionary()
+        # thread_id -> future of the summary job in flight. At most one per thread.
+        self._jobs: dict[str, Future] = {}
+
+        self.committed = 0
+        self.failed = 0
+
+    def _thread_lock(self, thread_id: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._thread_locks.get(thread_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._thread_locks[thread_id] = lock
+            return lock
+
+    def chat(self, thread_id: str, messages: list[AnyMessage]) -> dict:
+        """
+        Runs one turn and returns the state with the answer. The summary, if needed, is scheduled after it.
+        """
+        config = {"configurable": {"thread_id": thread_id}}
+        lock = self._thread_lock(thread_id)
+        with lock:
+            response = self.graph.invoke(input={"messages": messages}, config=config)
+
+        self._schedule(thread_id, response, lock)
+        return response
+
+    def _schedule(self, thread_id: str, state: dict, lock: threading.Lock):
+        with self._locks_guard:
+            if thread_id in self._jobs:
+                # The next turn after the commit schedules the summary of the new messages, if still needed
+                return
+            plan = self.policy.plan(state)
+            if plan is None:
+                return
+            # The job keeps a reference to the lock, so it isn't collected while the job runs
+            self._jobs[thread_id] = self._executor.submit(self._run_job, thread_id, state.get("summary", ""), plan, lock)
+
+    def _run_job(self, thread_id: str, summary: str, plan: SummaryPlan, lock: threading.Lock):
+        try:
+            # The slow part, without the lock: new turns of the thread can run meanwhile
+            new_summary = self.summarize(plan.to_summarize, summary)
+
+            with lock:
+                config = {"configurable": {"thread_id": thread_id}}
+                current_ids = {msg.id for msg in self.graph.get_state(config).values.get("messages", [])}
+                deletions = [RemoveMessage(id=msg.id) for msg in plan.to_delete if msg.id in current_ids]
+                # Summary and deletions in the same checkpoint: a reader sees both or none
+                self.graph.update_state(config, {"summary": new_summary, "messages": deletions, **plan.extra_update},
+                                        as_node="chat node")
+            self.committed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Summary of the thread %s failed", thread_id)
+        finally:
+            with self._locks_guard:
+                self._jobs.pop(thread_id, None)
+
+    def wait(self):
+        """
+        Waits for the summaries in flight (e.g. before the shutdown, or in tests).
+        """
+        while True:
+            with self._locks_guard:
+                jobs = list(self._jobs.values())
+            if not jobs:
+                return
+            for job in jobs:
+                job.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from pathlib import Path
+    from langchain_core.messages import AIMessage
+    from langgraph.checkpoint.memory import MemorySaver
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+
+    # The same fake model (0.5s per call) answers and summarizes in both setups
+    summarization.chat_model = FakeChatModel(replies=["Resposta sobre dinossauros."], latency=0.5)
+
+    questions = ["Temos dinossauros atualmente?", "Aves podem ser consideradas dinossauros?", "E os crocodilos?",
+                 "Qual o maior dinossauro?", "Quando eles foram extintos?", "Por quê?"]
+    initial = [AIMessage(content="Oi, como posso te ajudar?", name="Model"),
+               HumanMessage(content="Olá, gostaria de saber mais sobre dinossauros.", name="Marianna")]
+
+    # 1. The synchronous summarization of simple_chat_with_summarization.py
+    graph = summarization.create_graph()
+    config = {"configurable": {"thread_id": "sync"}}
+    latencies = []
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        graph.invoke({"messages": (initial if i == 0 else []) + [HumanMessage(content=question, name="Marianna")]}, config)
+        latencies.append(time.perf_counter() - start)
+    print("Synchronous summarization, turn latencies (s):", [round(latency, 2) for latency in latencies])
+
+    # 2. The background summarization
+    summarizer = BackgroundSummarizer(create_graph(MemorySaver()))
+    latencies = []
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        summarizer.chat("background", (initial if i == 0 else []) + [HumanMessage(content=question, name="Marianna")])
+        latencies.append(time.perf_counter() - start)
+    summarizer.close()
+    print("Background summarization, turn latencies (s):", [round(latency, 2) for latency in latencies])
+
+    state = summarizer.graph.get_state({"configurable": {"thread_id": "background"}}).values
+    print(f"Summaries committed: {summarizer.committed} | messages in the state: {len(state['messages'])} | summary: {state['summary']}")
@@ -0,0 +1,220 @@
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+from langgraph.channels.base import BaseChannel
+
+# Append-only sequence that shares its storage between the successive states of a graph.
+# custom_reduce_lists_with_none (state_reducers.py) and operator.add return left_list + right_list, so each node
+# update copies the whole history: a loop of n steps allocates O(n²) list slots.
+# A ChunkedSequence is a view (length) over chunks of fixed size:
+# - the full chunks never change, so all the views share them;
+# - appending to the latest view writes in place in the last chunk and returns a longer view (amortized O(1));
+#   the previous view keeps its length, so it doesn't see the new items (persistent);
+# - appending to an older view (a fork of the history) copies only its last chunk.
+# Reading works as a list: len, indexing, slicing, iteration, and + with lists.
+
+CHUNK_SIZE = 128
+
+
+class ChunkedSequence(Sequence):
+    def __init__(self, items: Optional[Iterable] = None, *, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        # The spine (list of chunks) and the last chunk may be longer than this view: they are shared with newer views
+        self._chunks = []
+        self._length = 0
+        if items:
+            extended = self.extend(items)
+            self._chunks, self._length = extended._chunks, extended._length
+
+    @classmethod
+    def _view(cls, chunks: list, length: int, chunk_size: int) -> "ChunkedSequence":
+        view = cls.__new__(cls)
+        view.chunk_size = chunk_size
+        view._chunks = chunks
+        view._length = length
+        return view
+
+    def extend(self, items: Iterable) -> "ChunkedSequence":
+        """
+        Returns a new view with the items appended. This view is not changed.
+        """
+        items = list(items)
+        if not items:
+            return self
+
+        chunks, length, size = self._chunks, self._length, self.chunk_size
+        n_chunks = -(-length // size)
+        if len(chunks) != n_chunks:
+            # A newer view already added chunks after ours: our spine is copied (O(n / chunk_size))
+            chunks = chunks[:n_chunks]
+
+        used_in_last = length - (n_chunks - 1) * size if n_chunks else size
+        if n_chunks and used_in_last < size and len(chunks[-1]) != used_in_last:
+            # A newer view already appended to our last chunk: it's copied (O(chunk_size))
+            chunks = chunks[:-1] + [chunks[-1][:used_in_last]]
+
+        index = 0
+        while index < len(items):
+            if not chunks or len(chunks[-1]) >= size:
+                chunks.append([])
+            free = size - len(chunks[-1])
+            chunks[-1].extend(items[index:index + free])
+            index += free
+
+        return self._view(chunks, length + len(items), size)
+
+    def append(self, item: Any) -> "ChunkedSequence":
+        return self.extend([item])
+
+    # Reading, as a list
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ChunkedSequence index out of range")
+        return self._chunks[index // self.chunk_size][index % self.chunk_size]
+
+    def __iter__(self) -> Iterator:
+        remaining = self._length
+        for chunk in self._chunks:
+            if remaining <= 0:
+                return
+            yield from chunk[:remaining] if remaining < len(chunk) else chunk
+            remaining -= len(chunk)
+
+    def __add__(self, other) -> "ChunkedSequence":
+        return self.extend(other)
+
+    def __radd__(self, other) -> list:
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ChunkedSequence, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ChunkedSequence({list(self)!r})"
+
+
+def append_chunked(left: Optional[Sequence] = None, right: Optional[Sequence] = None) -> ChunkedSequence:
+    """
+    Reducer with the behavior of custom_reduce_lists_with_none (None is an empty list), without copying the history.
+    """
+    if not isinstance(left, ChunkedSequence):
+        left = ChunkedSequence(left or [])
+    if right is None:
+        return left
+    return left.extend(right if isinstance(right, (list, tuple, ChunkedSequence)) else [right])
+
+
+class ChunkedSequenceChannel(BaseChannel):
+    """
+    Used as Annotated[list, ChunkedSequenceChannel] in a state schema, with the append_chunked reducer.
+    The checkpoints store a plain list, which the serializers of the checkpointers know.
+    """
+
+    def __init__(self, typ: Any = list, key: str = ""):
+        super().__init__(typ, key)
+        self.value = ChunkedSequence()
+
+    def __eq__(self, value: object) -> bool:
+        return isinstance(value, ChunkedSequenceChannel)
+
+    @property
+    def ValueType(self) -> Any:
+        return ChunkedSequence
+
+    @property
+    def UpdateType(self) -> Any:
+        return Any
+
+    def from_checkpoint(self, checkpoint: Optional[list]):
+        empty = self.__class__(self.typ, self.key)
+        if checkpoint is not None:
+            empty.value = ChunkedSequence(checkpoint)
+        return empty
+
+    def update(self, values: Sequence[Any]) -> bool:
+        if not values:
+            return False
+        for value in values:
+            self.value = append_chunked(self.value, value)
+        return True
+
+    def get(self) -> ChunkedSequence:
+        return self.value
+
+    def checkpoint(self) -> list:
+        return list(self.value)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import operator
+    import tracemalloc
+    from pathlib import Path
+    from typing import Annotated, TypedDict
+    from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+    from langgraph.graph import StateGraph, START, END
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from state_reducers import custom_reduce_lists_with_none
+
+    # A long tool calling loop, as the AgentState of the workshop notebook: each step appends a tool call and its result
+    steps = 2000
+
+    class StateAdd(TypedDict):
+        messages: Annotated[list[AnyMessage], operator.add]
+
+    class StateCustomReducer(TypedDict):
+        messages: Annotated[list[AnyMessage], custom_reduce_lists_with_none]
+
+    class StateChunked(TypedDict):
+        messages: Annotated[list[AnyMessage], ChunkedSequenceChannel]
+
+    def agent(state):
+        step = len(state["messages"]) // 2
+        call = {"name": "search", "args": {"query": f"passo {step}"}, "id": f"call_{step}", "type": "tool_call"}
+        return {"messages": [AIMessage(content="", tool_calls=[call], id=f"ai-{step}")]}
+
+    def tools(state):
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": [ToolMessage(content=f"resultado {call['args']['query']}", tool_call_id=call["id"])]}
+
+    def should_continue(state):
+        return "tools" if len(state["messages"]) < 2 * steps else END
+
+    for label, schema in [("operator.add", StateAdd), ("custom_reduce_lists_with_none", StateCustomReducer),
+                          ("ChunkedSequenceChannel", StateChunked)]:
+        graph = StateGraph(schema)
+        graph.add_node("agent", agent)
+        graph.add_node("tools", tools)
+        graph.add_edge(START, "agent")
+        graph.add_conditional_edges("agent", should_continue)
+        graph.add_edge("tools", "agent")
+        graph = graph.compile()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = graph.invoke({"messages": [HumanMessage(content="Pesquise tudo.")]}, config={"recursion_limit": 3 * 2 * steps})
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<32} {len(response['messages'])} messages | {elapsed:6.2f}s | peak memory {peak / 2**20:7.1f} MB")
+
+    # The reducer alone: allocations of n appends of one item
+    for label, reducer in [("custom_reduce_lists_with_none", custom_reduce_lists_with_none), ("append_chunked", append_chunked)]:
+        tracemalloc.start()
+        value = []
+        for i in range(20_000):
+            value = reducer(value, [i])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<32} 20000 appends | peak memory {peak / 2**20:7.1f} MB")
@@ -3,6 +3,8 @@ from langchain_openai import ChatOpenAI
 from langgraph.graph import MessagesState
 from langgraph.graph import START, END, StateGraph
 from langchain_core.messages import AnyMessage, AIMessage, HumanMessage, RemoveMessage, trim_messages
+from langchain_core.runnables import RunnableConfig
+from token_count_cache import CachedTokenTrimmer
 
 # Set up env variables
 print("Is env variables loaded?", dotenv.load_dotenv(".env"))
@@ -79,14 +81,14 @@ def test_graph_with_inplace_filtering(messages):
 
 # 3. Trimming messages
 
-def chat_node_with_trimming(state: MessagesState):
-    messages = trim_messages(
-        messages = state["messages"],
-        max_tokens = 50,
-        strategy = "last",
-        token_counter = ChatOpenAI(model="gpt-3.5-turbo"),
-        allow_partial = True
-    )
+## The trimmer keeps the token count of each message in a cache, so each turn only tokenizes the new messages.
+## It also uses a single local tokenizer, instead of creating a ChatOpenAI object to count the tokens at each call.
+trimmer = CachedTokenTrimmer(max_tokens=50, strategy="last", allow_partial=True)
+
+def chat_node_with_trimming(state: MessagesState, config: RunnableConfig):
+    ## Each thread keeps its own prefix sums in the trimmer
+    thread_id = config.get("configurable", {}).get("thread_id", "default")
+    messages = trimmer.trim(messages=state["messages"], history_key=thread_id)
 
     return {"messages": [chat_model.invoke(input=messages)]}
 
@@ -108,7 +110,7 @@ def test_graph_with_trimming(messages):
         messages = messages["messages"],
         max_tokens = 50,
         strategy = "last",
-        token_counter = ChatOpenAI(model="gpt-3.5-turbo"),
+        token_counter = trimmer.count_tokens,
         allow_partial = True
     ))
     print("---"*10)
@@ -116,9 +118,11 @@ def test_graph_with_trimming(messages):
         messages = messages["messages"],
         max_tokens = 50,
         strategy = "first",
-        token_counter = ChatOpenAI(model="gpt-3.5-turbo"),
+        token_counter = trimmer.count_tokens,
         allow_partial=False
     ))
+    print("---"*10)
+    print(trimmer.trim(messages=messages["messages"]))
 
     ## Graph with trim
     graph = create_graph_trimming()
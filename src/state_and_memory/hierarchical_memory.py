@@ -0,0 +1,258 @@
+import time
+import sqlite3
+import weakref
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AnyMessage, HumanMessage, RemoveMessage, SystemMessage
+from langgraph.graph import START, END, StateGraph
+
+from simple_chat_with_summarization import StateSum, summarization_conditional_edge
+from token_count_cache import get_encoding
+
+# Long term memory for the chat with summarization.
+# summarize_conversation deletes all but the last 3 messages, so their details only survive inside a single summary
+# string, sent at every turn and growing with the conversation. Here the deleted messages are archived instead:
+# - each group of deleted messages is a segment, stored in SQLite with its text, a short summary and an embedding;
+# - the summaries are rolled up: segments -> session (every segments_per_session segments) -> thread;
+# - the chat node receives the thread and session summaries (bounded) plus the archived segments most similar to
+#   the last question, as many as fit in a token budget. Old facts stay reachable, and the prompt stays bounded.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    thread_id TEXT NOT NULL,
+    session INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    content TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    embedding BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_thread ON segments (thread_id, session);
+CREATE TABLE IF NOT EXISTS rollups (
+    thread_id TEXT NOT NULL,
+    level TEXT NOT NULL,
+    session INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (thread_id, level, session)
+);
+"""
+
+SEGMENT_PROMPT = "Summarize the conversation excerpt above in up to 3 sentences, keeping names, numbers and decisions."
+ROLLUP_PROMPT = ("Merge the summaries above into a single summary of up to {max_words} words. "
+                 "Keep the facts that may be asked later, drop the small talk.")
+
+
+def render_messages(messages: list[AnyMessage]) -> str:
+    return "\n".join(f"{msg.name or msg.type}: {msg.content}" for msg in messages)
+
+
+@dataclass
+class ArchivedSegment:
+    id: int
+    content: str
+    summary: str
+    tokens: int
+    score: float
+
+
+class ConversationArchive:
+    """
+    Args:
+        path: path of the SQLite database of the archive.
+        embeddings: the embedding model of the segments and the questions.
+        chat_model: the model that writes the summaries.
+        segments_per_session: number of segments rolled up in a session summary.
+        model_name: the model whose tokenizer is used to count the tokens.
+    """
+
+    def __init__(self, path: str, embeddings: Embeddings, chat_model, segments_per_session: int = 5,
+                 model_name: str = "gpt-3.5-turbo"):
+        self.embeddings = embeddings
+        self.chat_model = chat_model
+        self.segments_per_session = segments_per_session
+        self.encoding = get_encoding(model_name)
+
+        self._lock = threading.Lock()
+        # thread_id -> lock that serializes the archives of the thread (the rollups depend on its segment count)
+        self._thread_locks = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        # thread_id -> (segment ids, normalized embeddings matrix), rebuilt after each new segment of the thread
+        self._matrices: dict[str, tuple[list[int], np.ndarray]] = {}
+
+    def _summarize(self, text: str, instruction: str) -> str:
+        return self.chat_model.invoke([HumanMessage(content=text), HumanMessage(content=instruction)]).content
+
+    def _thread_lock(self, thread_id: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._thread_locks.get(thread_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._thread_locks[thread_id] = lock
+            return lock
+
+    def _rollup(self, thread_id: str, level: str, session: int) -> str:
+        row = self.connection.execute("SELECT summary FROM rollups WHERE thread_id = ? AND level = ? AND session = ?",
+                                      (thread_id, level, session)).fetchone()
+        return row[0] if row else ""
+
+    # 1. Archiving
+
+    def archive(self, thread_id: str, messages: list[AnyMessage]) -> int:
+        """
+        Stores the messages as a segment and updates the session and thread summaries. Returns the segment id.
+        """
+        content = render_messages(messages)
+        summary = self._summarize(content, SEGMENT_PROMPT)
+        vector = np.asarray(self.embeddings.embed_query(content), dtype=np.float32)
+
+        # The archives of the same thread run one at a time: each one reads the segment count and the rollups, and
+        # writes them back, so two concurrent ones would both extend the same session summary (one update lost) and
+        # a session could be closed twice or never. Other threads are not blocked.
+        with self._thread_lock(thread_id):
+            with self._lock:
+                (count,) = self.connection.execute("SELECT COUNT(*) FROM segments WHERE thread_id = ?", (thread_id,)).fetchone()
+                session = count // self.segments_per_session
+                session_summary, thread_summary = self._rollup(thread_id, "session", session), self._rollup(thread_id, "thread", 0)
+
+            # The model calls run without the global lock, so the retrievals of other threads don't wait for them.
+            # The session summary is extended with the new segment summary...
+            session_summary = self._summarize(f"{session_summary}\n{summary}".strip(), ROLLUP_PROMPT.format(max_words=150))
+            # ...and a full session is merged into the thread summary, which only changes once per session
+            session_closed = (count + 1) % self.segments_per_session == 0
+            if session_closed:
+                thread_summary = self._summarize(f"{thread_summary}\n{session_summary}".strip(), ROLLUP_PROMPT.format(max_words=250))
+
+            with self._lock:
+                cursor = self.connection.execute(
+                    "INSERT INTO segments (thread_id, session, created_at, content, summary, tokens, embedding) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, session, time.time(), content, summary, len(self.encoding.encode(content)), vector.tobytes()))
+                segment_id = cursor.lastrowid
+                self.connection.execute("INSERT OR REPLACE INTO rollups VALUES (?, 'session', ?, ?)", (thread_id, session, session_summary))
+                if session_closed:
+                    self.connection.execute("INSERT OR REPLACE INTO rollups VALUES (?, 'thread', 0, ?)", (thread_id, thread_summary))
+                self.connection.commit()
+                self._matrices.pop(thread_id, None)
+
+        return segment_id
+
+    def summary(self, thread_id: str) -> str:
+        """
+        The thread summary plus the summary of the open session (not yet merged into the thread one).
+        """
+        with self._lock:
+            (count,) = self.connection.execute("SELECT COUNT(*) FROM segments WHERE thread_id = ?", (thread_id,)).fetchone()
+            parts = [self._rollup(thread_id, "thread", 0)]
+            if count % self.segments_per_session:
+                parts.append(self._rollup(thread_id, "session", count // self.segments_per_session))
+        return "\n".join(part for part in parts if part)
+
+    # 2. Retrieval
+
+    def _matrix(self, thread_id: str) -> tuple[list[int], np.ndarray]:
+        if thread_id not in self._matrices:
+            rows = self.connection.execute("SELECT id, embedding FROM segments WHERE thread_id = ? ORDER BY id", (thread_id,)).fetchall()
+            ids = [row[0] for row in rows]
+            matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else np.zeros((0, 1), np.float32)
+            if len(matrix):
+                matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._matrices[thread_id] = (ids, matrix)
+        return self._matrices[thread_id]
+
+    def retrieve(self, thread_id: str, query: str, k: int = 3, token_budget: int = 800) -> list[ArchivedSegment]:
+        """
+        Returns up to k archived segments similar to the query, with their full text while they fit in the token
+        budget, and with their summary after that.
+        """
+        with self._lock:
+            ids, matrix = self._matrix(thread_id)
+        if not ids:
+            return []
+
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        scores = matrix @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+        top = np.argsort(-scores)[:k]
+
+        segments = []
+        remaining = token_budget
+        with self._lock:
+            for index in top:
+                segment_id, content, summary, tokens = self.connection.execute(
+                    "SELECT id, content, summary, tokens FROM segments WHERE id = ?", (ids[index],)).fetchone()
+                if tokens > remaining:
+                    content, tokens = summary, len(self.encoding.encode(summary))
+                    if tokens > remaining:
+                        continue
+                remaining -= tokens
+                segments.append(ArchivedSegment(segment_id, content, summary, tokens, float(scores[index])))
+        return segments
+
+
+# 3. The chat with summarization, using the archive
+
+def create_graph(archive: ConversationArchive, chat_model, checkpointer, k: int = 3, token_budget: int = 800, keep_last: int = 3):
+    def chat_node_with_memory(state: StateSum, config):
+        thread_id = config["configurable"]["thread_id"]
+        question = next((msg.content for msg in reversed(state["messages"]) if isinstance(msg, HumanMessage)), "")
+
+        context = []
+        if summary := state.get("summary", ""):
+            context.append(f"Summary of the conversation earlier: {summary}")
+        if segments := archive.retrieve(thread_id, question, k=k, token_budget=token_budget):
+            context.append("Earlier parts of the conversation that may be relevant:\n" +
+                           "\n---\n".join(segment.content for segment in segments))
+
+        messages = ([SystemMessage(content="\n\n".join(context))] if context else []) + state["messages"]
+        return {"messages": chat_model.invoke(input=messages)}
+
+    def archive_conversation(state: StateSum, config):
+        thread_id = config["configurable"]["thread_id"]
+        evicted = state["messages"][:-keep_last]
+        archive.archive(thread_id, evicted)
+        return {"summary": archive.summary(thread_id), "messages": [RemoveMessage(id=msg.id) for msg in evicted]}
+
+    graph = StateGraph(StateSum)
+    graph.add_node("chat node", chat_node_with_memory)
+    graph.add_node("summarization node", archive_conversation)
+    graph.add_edge(START, "chat node")
+    graph.add_conditional_edges(source="chat node", path=summarization_conditional_edge)
+    graph.add_edge("summarization node", END)
+
+    return graph.compile(checkpointer=checkpointer)
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from pathlib import Path
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langgraph.checkpoint.memory import MemorySaver
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+
+    # Offline run: fake model and hash based embeddings. With real embeddings (e.g. the HuggingFaceEmbeddings of
+    # rag/ingestion.py), the retrieved segments are the ones about the question.
+    chat_model = FakeChatModel(replies=["Entendi, vou lembrar disso."])
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = ConversationArchive(f"{tmp}/archive.db", DeterministicFakeEmbedding(size=384), chat_model)
+        graph = create_graph(archive, chat_model, MemorySaver())
+        config = {"configurable": {"thread_id": "1"}}
+
+        facts = ["Meu gato se chama Sushi.", "Moro em Belo Horizonte.", "Meu aniversário é dia 3 de maio.",
+                 "Trabalho com engenharia de dados.", "Tenho alergia a camarão."] * 6
+        encoding = get_encoding()
+        for fact in facts:
+            response = graph.invoke({"messages": [HumanMessage(content=fact, name="Marianna")]}, config)
+            prompt_tokens = len(encoding.encode(response.get("summary", ""))) + sum(len(encoding.encode(m.content)) for m in response["messages"])
+            print(f"messages in the state: {len(response['messages'])} | state tokens: {prompt_tokens}")
+
+        (segments,) = archive.connection.execute("SELECT COUNT(*) FROM segments").fetchone()
+        print("Archived segments:", segments)
+        for segment in archive.retrieve("1", "Qual o nome do meu gato?", k=3):
+            print(f"{segment.score:.3f} | {segment.content[:80]!r}")
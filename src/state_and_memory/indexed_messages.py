@@ -0,0 +1,220 @@
+import uuid
+from typing import Annotated, Any, Iterator, Optional, Sequence, TypedDict, Union
+
+from langchain_core.messages import AnyMessage, BaseMessage, RemoveMessage, convert_to_messages
+from langgraph.channels.base import BaseChannel
+
+# Messages state backed by an index of the message ids.
+# add_messages (state_reducers.py) builds a new list and looks for the ids of the update in the whole history,
+# so each update costs O(history), and removing k messages (filter_messages_node) is O(k·n).
+# IndexedMessages keeps the messages in a dict id -> message, which keeps the insertion order:
+# - append, replace by id (the message keeps its position) and remove by id are O(1), so an update of k messages is O(k);
+# - reading by position (state["messages"][-2:]) uses a list rebuilt once per state change.
+# The IndexedMessagesChannel applies the updates in place and stores a plain list in the checkpoints,
+# so the checkpointers see the same values of a MessagesState. A container already read by a node is never changed:
+# the next update is applied to a copy of it (copy on write, a dict copy without any id lookup).
+
+
+# 1. The ordered container
+
+class IndexedMessages(Sequence[AnyMessage]):
+    def __init__(self, messages: Optional[Sequence] = None):
+        self._by_id = {}
+        # Positional view, rebuilt on the first read after a change
+        self._list = None
+        if messages:
+            self.add(messages)
+
+    # Updates, with the semantics of add_messages
+
+    def add(self, messages: Union[Sequence, Any]) -> "IndexedMessages":
+        """
+        Applies an update: new ids are appended, existing ids are replaced in place and RemoveMessage deletes the id.
+        """
+        if not isinstance(messages, list):
+            messages = [messages] if isinstance(messages, (BaseMessage, str, dict, tuple)) else list(messages)
+
+        for message in convert_to_messages(messages):
+            if message.id is None:
+                message.id = str(uuid.uuid4())
+            if isinstance(message, RemoveMessage):
+                if self._by_id.pop(message.id, None) is None:
+                    raise ValueError(f"Attempting to delete a message with an ID that doesn't exist ('{message.id}')")
+            else:
+                self._by_id[message.id] = message
+        self._list = None
+        return self
+
+    def remove(self, ids: Sequence[str]):
+        for id_ in ids:
+            del self._by_id[id_]
+        self._list = None
+
+    def copy(self) -> "IndexedMessages":
+        """
+        Shallow copy: the messages are shared, the updates of one container don't change the other.
+        """
+        copied = IndexedMessages()
+        copied._by_id = dict(self._by_id)
+        # The positional view is never changed, only replaced
+        copied._list = self._list
+        return copied
+
+    def get_by_id(self, id_: str) -> Optional[AnyMessage]:
+        return self._by_id.get(id_)
+
+    def __contains__(self, item) -> bool:
+        if isinstance(item, BaseMessage):
+            return self._by_id.get(item.id) is item
+        return item in self._by_id
+
+    # Sequence interface
+
+    def _as_list(self) -> list:
+        if self._list is None:
+            self._list = list(self._by_id.values())
+        return self._list
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[AnyMessage]:
+        return iter(self._by_id.values())
+
+    def __reversed__(self) -> Iterator[AnyMessage]:
+        return reversed(self._by_id.values())
+
+    def __getitem__(self, index):
+        # The last message (the most common read in the nodes) doesn't need the positional view
+        if index == -1 and self._list is None and self._by_id:
+            return next(reversed(self._by_id.values()))
+        return self._as_list()[index]
+
+    def __add__(self, other) -> list:
+        return self._as_list() + list(other)
+
+    def __radd__(self, other) -> list:
+        return list(other) + self._as_list()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (IndexedMessages, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"IndexedMessages({self._as_list()!r})"
+
+
+def add_messages_indexed(left: Optional[Sequence], right: Any) -> IndexedMessages:
+    """
+    Reducer version: returns a new IndexedMessages, left is not changed (as with add_messages).
+    """
+    messages = left.copy() if isinstance(left, IndexedMessages) else IndexedMessages(left)
+    if right is not None:
+        messages.add(right)
+    return messages
+
+
+# 2. The channel, so LangGraph updates the container in place instead of replacing it
+
+class IndexedMessagesChannel(BaseChannel):
+    """
+    Used as Annotated[IndexedMessages, IndexedMessagesChannel] in a state schema.
+    The updates change the container in place until it's read: after get(), the next update copies it first, so the
+    value a node got never changes.
+    """
+
+    def __init__(self, typ: Any = IndexedMessages, key: str = ""):
+        super().__init__(typ, key)
+        self.value = IndexedMessages()
+        # True once the current container was handed out by get()
+        self._shared = False
+
+    def __eq__(self, value: object) -> bool:
+        return isinstance(value, IndexedMessagesChannel)
+
+    @property
+    def ValueType(self) -> Any:
+        return IndexedMessages
+
+    @property
+    def UpdateType(self) -> Any:
+        return Any
+
+    def from_checkpoint(self, checkpoint: Optional[list]):
+        empty = self.__class__(self.typ, self.key)
+        if checkpoint is not None:
+            empty.value = IndexedMessages(checkpoint)
+        return empty
+
+    def update(self, values: Sequence[Any]) -> bool:
+        if not values:
+            return False
+        if self._shared:
+            self.value = self.value.copy()
+            self._shared = False
+        for value in values:
+            self.value.add(value)
+        return True
+
+    def get(self) -> IndexedMessages:
+        self._shared = True
+        return self.value
+
+    def checkpoint(self) -> list:
+        # A plain list: it's what gets serialized, and it doesn't change with the next updates
+        return list(self.value)
+
+
+class IndexedMessagesState(TypedDict):
+    # Drop-in for MessagesState
+    messages: Annotated[IndexedMessages, IndexedMessagesChannel]
+
+
+if __name__ == "__main__":
+    import time
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langgraph.graph import MessagesState, StateGraph, START, END
+    from langgraph.graph.message import add_messages
+
+    def history(n: int) -> list:
+        return [(HumanMessage if i % 2 == 0 else AIMessage)(content=f"Mensagem {i}", id=str(i)) for i in range(n)]
+
+    def timed(function, repeats: int = 20) -> float:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        return 1000 * (time.perf_counter() - start) / repeats
+
+    # 1. The reducer alone, on a 10k messages thread
+    n, k = 10_000, 100
+    messages = history(n)
+    updates = {
+        "append 1": lambda: [HumanMessage(content="Nova", id=str(uuid.uuid4()))],
+        "replace 1 by id": lambda: [HumanMessage(content="Editada", id=str(n // 2))],
+        f"remove {k}": lambda: [RemoveMessage(id=str(i)) for i in range(k)],
+    }
+
+    print(f"{'update (10k messages)':<24}{'add_messages ms':>16}{'indexed ms':>12}")
+    for label, make_update in updates.items():
+        list_ms = timed(lambda: add_messages(messages, make_update()))
+        # A fresh container per run, so the removals always find their ids (its creation is not timed)
+        containers = iter([IndexedMessages(messages) for _ in range(20)])
+        indexed_ms = timed(lambda: next(containers).add(make_update()))
+        print(f"{label:<24}{list_ms:>16.3f}{indexed_ms:>12.3f}")
+
+    # 2. filter_messages_node of filtering_trimming_messages.py, inside a graph
+    def filter_messages_node(state):
+        return {"messages": [RemoveMessage(id=msg.id) for msg in state["messages"][:-2]]}
+
+    for label, schema in [("MessagesState", MessagesState), ("IndexedMessagesState", IndexedMessagesState)]:
+        graph = StateGraph(schema)
+        graph.add_node("filter node", filter_messages_node)
+        graph.add_edge(START, "filter node")
+        graph.add_edge("filter node", END)
+        graph = graph.compile()
+
+        start = time.perf_counter()
+        response = graph.invoke({"messages": history(n)})
+        print(f"{label:<22} filter of {n} messages: {1000 * (time.perf_counter() - start):8.1f} ms "
+              f"| {len(response['messages'])} left")
@@ -0,0 +1,287 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, RemoveMessage, ToolMessage
+from langgraph.graph import START, END, StateGraph
+
+import simple_chat_with_summarization as summarization
+from simple_chat_with_summarization import StateSum, chat_node_with_summary, summarization_conditional_edge, build_summary_prompt
+from token_count_cache import CachedTokenTrimmer, message_key
+
+# Summarization of histories that don't fit in one prompt.
+# summarize_conversation sends the whole history in a single call: a thread imported from another system, or a long
+# session full of tool outputs, goes above the context window (or takes too long in a single sequential call). Here:
+# 1. map: the history is split in chunks of up to max_chunk_tokens (a message above the limit is cut in overlapping
+#    slices), each chunk is summarized by its own call, and the calls run concurrently (chat_model.batch with max_concurrency);
+# 2. reduce: the partial summaries are grouped in the same token bound and merged, level by level, until one is left;
+# 3. the summaries of the chunks (and of the groups) are cached by the hash of their content. The chunks are cut
+#    greedily from the start of the history, so an extended thread keeps its old chunks and only the new ones are
+#    sent to the model.
+
+MAP_PROMPT = "Create a summary of the conversation excerpt above. Keep names, numbers, decisions and tool results."
+# Tokens of a chunk left free when a message is sliced: the role and name of the slice, and the (empty) copy of the
+# AI message that called a sliced tool result
+SLICE_RESERVED_TOKENS = 32
+REDUCE_PROMPT = ("The texts above are summaries of consecutive parts of the same conversation, in order. "
+                 "Merge them into a single summary of the conversation.")
+
+
+class SummaryCache:
+    """
+    LRU of summaries by content hash, shared by the threads of the process.
+
+    Args:
+        max_entries: max number of summaries kept.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return summary
+
+    def put(self, key: str, summary: str):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class MapReduceSummarizer:
+    """
+    Args:
+        chat_model: the summarization model. Default: the model of simple_chat_with_summarization.py.
+        max_chunk_tokens: max tokens of the messages (or summaries) sent in one call.
+        slice_overlap: tokens repeated between consecutive slices of a message longer than max_chunk_tokens.
+        max_concurrency: max number of summarization calls at the same time.
+        cache: the cache of the chunk summaries. Default: a new SummaryCache.
+        model_name: the model whose tokenizer is used to count the tokens.
+    """
+
+    def __init__(self, chat_model=None, max_chunk_tokens: int = 2000, max_concurrency: int = 4,
+                 cache: Optional[SummaryCache] = None, model_name: str = "gpt-3.5-turbo", slice_overlap: int = 100):
+        self.chat_model = chat_model
+        self.max_chunk_tokens = max_chunk_tokens
+        self.slice_overlap = slice_overlap
+        self.max_concurrency = max_concurrency
+        self.cache = cache if cache is not None else SummaryCache()
+        self.counter = CachedTokenTrimmer(max_tokens=max_chunk_tokens, model_name=model_name)
+
+        self.map_calls = 0
+        self.reduce_calls = 0
+
+    # 1. Chunking
+
+    def _slices(self, message: AnyMessage) -> list[AnyMessage]:
+        """
+        Cuts a message longer than max_chunk_tokens in copies with slices of its content, each one repeating the last
+        slice_overlap tokens of the previous one.
+        """
+        if self.counter.count_message(message) <= self.max_chunk_tokens:
+            return [message]
+
+        encoding = self.counter.encoding
+        tokens = encoding.encode(message.content if isinstance(message.content, str) else str(message.content))
+        size = max(1, self.max_chunk_tokens - SLICE_RESERVED_TOKENS)
+        step = max(1, size - self.slice_overlap)
+        starts = range(0, max(1, len(tokens) - self.slice_overlap), step) if len(tokens) > size else [0]
+        # model_copy in pydantic v2 based langchain versions, copy in the pydantic v1 ones
+        copy = getattr(message, "model_copy", None) or message.copy
+        return [copy(update={"content": encoding.decode(tokens[start:start + size])}) for start in starts]
+
+    @staticmethod
+    def _with_tool_calls(message: AIMessage, tool_call_ids: set[str], content: Optional[str] = None) -> AIMessage:
+        tool_calls = [call for call in message.tool_calls if call["id"] in tool_call_ids]
+        if len(tool_calls) == len(message.tool_calls) and content is None:
+            return message
+        # The OpenAI format of the tool calls is dropped too, as it would be sent instead of an empty tool_calls
+        additional_kwargs = {key: value for key, value in message.additional_kwargs.items() if key != "tool_calls"}
+        copy = getattr(message, "model_copy", None) or message.copy
+        update = {"tool_calls": tool_calls, "additional_kwargs": additional_kwargs}
+        if content is not None:
+            update["content"] = content
+        return copy(update=update)
+
+    def _pair_tool_calls(self, chunk: list[AnyMessage], callers: dict[str, AIMessage]) -> list[AnyMessage]:
+        """
+        Makes a chunk a valid prompt: each AI message only keeps the tool calls answered in the chunk, and the tool
+        results that open the chunk get a copy of their AI message (without its text, summarized in the previous chunk).
+        """
+        answered = {message.tool_call_id for message in chunk if isinstance(message, ToolMessage)}
+        called = {call["id"] for message in chunk if isinstance(message, AIMessage) for call in message.tool_calls}
+
+        opening = []
+        for message in chunk:
+            if not isinstance(message, ToolMessage):
+                break
+            if message.tool_call_id not in called and message.tool_call_id in callers:
+                opening.append(message.tool_call_id)
+        prefix = []
+        if opening:
+            prefix = [self._with_tool_calls(callers[opening[0]], set(opening), content="")]
+
+        return prefix + [self._with_tool_calls(message, answered) if isinstance(message, AIMessage) and message.tool_calls else message
+                         for message in chunk]
+
+    def chunk(self, messages: list[AnyMessage]) -> list[list[AnyMessage]]:
+        """
+        Splits the messages greedily in chunks of up to max_chunk_tokens. A message longer than the limit is cut in
+        overlapping slices. A tool result that doesn't fit starts a new chunk, opened by a copy of the AI message that
+        called it, so each chunk is a valid prompt for the chat models.
+        """
+        chunks, current, tokens = [], [], 0
+        # tool_call_id -> the AI message with the call
+        callers = {}
+        for message in messages:
+            if isinstance(message, AIMessage):
+                callers.update((call["id"], message) for call in message.tool_calls)
+            for piece in self._slices(message):
+                count = self.counter.count_message(piece)
+                if current and tokens + count > self.max_chunk_tokens:
+                    chunks.append(current)
+                    current, tokens = [], 0
+                current.append(piece)
+                tokens += count
+        if current:
+            chunks.append(current)
+        return [self._pair_tool_calls(chunk, callers) for chunk in chunks]
+
+    def _group(self, summaries: list[str]) -> list[list[str]]:
+        groups, current, tokens = [], [], 0
+        for summary in summaries:
+            count = len(self.counter.encoding.encode(summary))
+            if current and tokens + count > self.max_chunk_tokens:
+                groups.append(current)
+                current, tokens = [], 0
+            current.append(summary)
+            tokens += count
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    def _key(kind: str, parts: list) -> str:
+        digest = hashlib.blake2b(kind.encode(), digest_size=16)
+        for part in parts:
+            digest.update(b"\x00")
+            digest.update(part if isinstance(part, bytes) else part.encode())
+        return digest.hexdigest()
+
+    # 2. Map and reduce
+
+    def _run(self, prompts: list[list[AnyMessage]], keys: list[str]) -> tuple[list[str], int]:
+        """
+        Summarizes the prompts whose key is not cached, concurrently.
+        Returns the summaries of all of them and the number of model calls.
+        """
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            chat_model = self.chat_model or summarization.chat_model
+            responses = chat_model.batch([prompts[i] for i in missing], config={"max_concurrency": self.max_concurrency})
+            for i, response in zip(missing, responses):
+                results[i] = response.content
+                self.cache.put(keys[i], response.content)
+        return results, len(missing)
+
+    def map(self, chunks: list[list[AnyMessage]]) -> list[str]:
+        # The key of a chunk: the id and content hash of its messages (as in the token count cache)
+        keys = [self._key("map", [message_key(message)[1] + (message.id or "").encode() for message in chunk])
+                for chunk in chunks]
+        prompts = [chunk + [HumanMessage(content=MAP_PROMPT)] for chunk in chunks]
+        summaries, calls = self._run(prompts, keys)
+        self.map_calls += calls
+        return summaries
+
+    def reduce(self, summaries: list[str]) -> str:
+        while len(summaries) > 1:
+            groups = self._group(summaries)
+            if len(groups) == len(summaries):
+                # Each summary fills a group alone: merge them in pairs, so each level halves the count
+                groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+            keys = [self._key("reduce", group) for group in groups]
+            prompts = [[HumanMessage(content="\n\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(group))),
+                        HumanMessage(content=REDUCE_PROMPT)] for group in groups]
+            summaries, calls = self._run(prompts, keys)
+            self.reduce_calls += calls
+        return summaries[0] if summaries else ""
+
+    def summarize(self, messages: list[AnyMessage], summary: str = "") -> str:
+        """
+        Same signature of the summarize functions of background_summarization.py: the messages and the current summary.
+        """
+        partial = self.reduce(self.map(self.chunk(messages)))
+        if not summary:
+            return partial
+        # The current summary is only extended at the end, so it doesn't change the keys of the chunks
+        chat_model = self.chat_model or summarization.chat_model
+        self.reduce_calls += 1
+        return chat_model.invoke([HumanMessage(content=partial), HumanMessage(content=build_summary_prompt(summary))]).content
+
+
+# 3. The graph of simple_chat_with_summarization.py with the map-reduce summarization node
+
+def create_graph(summarizer: MapReduceSummarizer, checkpointer=None):
+    def summarize_conversation(state: StateSum):
+        summary = summarizer.summarize(state["messages"], state.get("summary", ""))
+        return {"summary": summary, "messages": [RemoveMessage(id=msg.id) for msg in state["messages"][:-3]]}
+
+    graph = StateGraph(StateSum)
+    graph.add_node("chat node", chat_node_with_summary)
+    graph.add_node("summarization node", summarize_conversation)
+    graph.add_edge(START, "chat node")
+    graph.add_conditional_edges(source="chat node", path=summarization_conditional_edge)
+    graph.add_edge("summarization node", END)
+
+    return graph.compile(checkpointer=checkpointer)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from pathlib import Path
+    from langchain_core.messages import AIMessage
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+
+    # A thread imported from another system: 400 messages with long answers.
+    # The fake model takes 0.3s per call, whatever the prompt size (a real model also grows with the prompt).
+    chat_model = FakeChatModel(replies=["Resumo: conversa sobre dinossauros."], latency=0.3)
+    answer = "Os dinossauros viveram na era Mesozoica e muitos deles tinham penas. " * 8
+    history = []
+    for i in range(200):
+        history += [HumanMessage(content=f"Pergunta {i} sobre dinossauros?", name="Marianna", id=f"h{i}"),
+                    AIMessage(content=answer, name="Model", id=f"a{i}")]
+    counter = CachedTokenTrimmer(max_tokens=0)
+    print(f"History: {len(history)} messages, {counter.count_tokens(history)} tokens")
+
+    # 1. One prompt with the whole history (summarize_conversation)
+    start = time.perf_counter()
+    chat_model.invoke(history + [HumanMessage(content=build_summary_prompt(""))])
+    print(f"{'single prompt':<28} {time.perf_counter() - start:5.2f}s | 1 call of {counter.count_tokens(history)} tokens")
+
+    # 2. Map-reduce, then the same thread extended with 20 new messages
+    summarizer = MapReduceSummarizer(chat_model, max_chunk_tokens=2000, max_concurrency=8)
+    extended = history + [HumanMessage(content=f"Mais uma pergunta {i}?", name="Marianna", id=f"n{i}") for i in range(20)]
+    for label, messages in [("map-reduce", history), ("map-reduce, extended thread", extended)]:
+        map_calls, reduce_calls = summarizer.map_calls, summarizer.reduce_calls
+        start = time.perf_counter()
+        summarizer.summarize(messages)
+        print(f"{label:<28} {time.perf_counter() - start:5.2f}s | {len(summarizer.chunk(messages))} chunks | "
+              f"map calls: {summarizer.map_calls - map_calls} | reduce calls: {summarizer.reduce_calls - reduce_calls}")
+    print(f"Cache: {summarizer.cache.hits} hits, {summarizer.cache.misses} misses")
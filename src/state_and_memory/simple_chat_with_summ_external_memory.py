@@ -88,7 +88,7 @@ def summarization_conditional_edge(state: StateSum):
 
 # 4. Create the graph
 
-def create_graph(path_checkpoint):
+def create_graph(path_checkpoint, serde=None):
     graph = StateGraph(StateSum)
 
     graph.add_node("chat node", chat_node_with_summary)
@@ -102,8 +102,9 @@ def create_graph(path_checkpoint):
     graph.add_edge("summarization node", END)
 
     ## Here, we will use an SQLite database to persist the graph states
+    ## serde: how the checkpoints are serialized (e.g. the CompactSerializer of src/checkpointers). Default: JsonPlusSerializer
     sqlite_connection = sqlite3.connect(database=path_checkpoint, check_same_thread=False)
-    memory = SqliteSaver(sqlite_connection)
+    memory = SqliteSaver(sqlite_connection, serde=serde)
     graph = graph.compile(checkpointer=memory)
 
     return graph
@@ -40,21 +40,22 @@ def chat_node_with_summary(state:StateSum):
     return {"messages": response}
 
 ## B. The summarization node
-def summarize_conversation(state: StateSum):
-    # Get the summary if it exists
-    summary = state.get("summary", "")
-
+def build_summary_prompt(summary: str) -> str:
     # Create the summarization prompt
     if summary:
         # If a summary already exists, we ask the summarization model to extend it with a summarization of the new messages
-        summary_message = (
+        return (
             f"This is a summary of the conversation to date: {summary}\n\n"
             "Extend the summary by taking into account the new messages above."
         )
-    else:
-        # If there is no summary, we ask the summarization model to create one from the messages history
-        summary_message = "Create a summary of the conversation above."
-    
+    # If there is no summary, we ask the summarization model to create one from the messages history
+    return "Create a summary of the conversation above."
+
+def summarize_conversation(state: StateSum):
+    # Get the summary if it exists
+    summary = state.get("summary", "")
+    summary_message = build_summary_prompt(summary)
+
     # The summary prompt is added to the history as a new message from the user
     messages = state["messages"] + [HumanMessage(content=summary_message)]
 
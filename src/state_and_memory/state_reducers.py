@@ -3,6 +3,7 @@ from typing import Annotated, TypedDict, Optional
 from langgraph.graph import MessagesState
 from langgraph.graph.message import add_messages
 from langchain_core.messages import AnyMessage, AIMessage, HumanMessage, RemoveMessage
+from chunked_sequence import ChunkedSequenceChannel, append_chunked
 
 # 1. State with default attributes update behavior: overwrite
 class StateDefault(TypedDict):
@@ -33,6 +34,12 @@ class StateCustomReducer(TypedDict):
     messages: Annotated[list[AnyMessage], custom_reduce_lists_with_none]
     key1: int
 
+# 5. Same behavior of the custom reducer, but the list is not copied at each update (see chunked_sequence.py).
+# The channel keeps an append-only ChunkedSequence, which is read as a list, and appends to it with append_chunked.
+class StateChunkedReducer(TypedDict):
+    messages: Annotated[list[AnyMessage], ChunkedSequenceChannel]
+    key1: int
+
 
 def test_state_reducers():
     initial_messages = [
@@ -78,6 +85,15 @@ def test_state_reducers():
     except Exception as e:
         print("Error:", e)
 
+    print("\n------------------------ chunked reducer ------------------------\n")
+    messages = append_chunked(initial_messages, [new_message])
+    for msg in messages:
+        msg.pretty_print()
+
+    ## The previous state is not changed by the appends
+    longer_messages = append_chunked(messages, None) + [AIMessage(content="Adolphe Sax, em 1840.", name="Model", id=4)]
+    print("Lengths:", len(messages), len(longer_messages))
+
 
 def test_tricks_with_reducers():
     initial_messages = [
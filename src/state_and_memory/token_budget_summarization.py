@@ -0,0 +1,214 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.messages import HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import START, END, StateGraph
+
+import simple_chat_with_summarization as summarization
+from simple_chat_with_summarization import StateSum, chat_node_with_summary, build_summary_prompt
+from background_summarization import SummaryPlan
+from token_count_cache import REPLY_PRIMING_TOKENS, CachedTokenTrimmer
+
+# Summarization driven by the tokens of the prompt, instead of the number of messages.
+# summarization_conditional_edge summarizes when there are more than 6 messages, so short chats are summarized too
+# early and a few long tool outputs too late; and summarize_conversation sends the whole history again (including
+# the last messages, already summarized in the previous call). Here:
+# - the prompt (summary + messages) is measured with the cached prefix sums of token_count_cache.py, so only the
+#   messages that are new since the previous measure of the thread are hashed and counted;
+# - the summary is created when the prompt goes above trigger_ratio of the context budget, and the oldest
+#   messages are summarized and removed until it's below target_ratio;
+# - the summarized messages are removed with the summary, so each summarization call only gets the messages that
+#   are new since the previous one (plus the current summary);
+# - each turn reports its prompt tokens, the tokens sent to the summarizer and the tokens saved by the summaries.
+
+
+@dataclass
+class TurnReport:
+    thread_id: str
+    prompt_tokens: int
+    # Tokens sent to the summarization model in this turn (0 if no summary was created)
+    summarizer_tokens: int = 0
+    # Prompt tokens of the messages removed by the summaries so far, minus the summary in the prompt and the
+    # summarizer tokens of this turn
+    tokens_saved: int = 0
+
+
+class TokenBudgetPolicy:
+    """
+    Args:
+        context_budget: max tokens of the prompt sent to the chat model.
+        trigger_ratio: the summary is created when the prompt is above trigger_ratio * context_budget.
+        target_ratio: messages are summarized until the prompt is below target_ratio * context_budget.
+        keep_last: min number of recent messages kept as they are.
+        model_name: the model whose tokenizer is used to count the tokens.
+        max_reports: number of the most recent turn reports kept (and of threads whose removed tokens are tracked).
+    """
+
+    def __init__(self, context_budget: int = 3000, trigger_ratio: float = 0.8, target_ratio: float = 0.5,
+                 keep_last: int = 2, model_name: str = "gpt-3.5-turbo", max_reports: int = 10_000):
+        self.context_budget = context_budget
+        self.trigger_tokens = int(trigger_ratio * context_budget)
+        self.target_tokens = int(target_ratio * context_budget)
+        self.keep_last = keep_last
+        self.counter = CachedTokenTrimmer(max_tokens=context_budget, model_name=model_name)
+
+        self.reports: deque[TurnReport] = deque(maxlen=max_reports)
+        # thread_id -> prompt tokens of the messages removed by its summaries
+        self._removed_tokens: OrderedDict[str, int] = OrderedDict()
+        self._max_threads = max_reports
+        self._reports_lock = threading.Lock()
+
+    # 1. Measuring
+
+    def summary_tokens(self, summary: str) -> int:
+        if not summary:
+            return 0
+        return self.counter.count_message(SystemMessage(content=f"Summary of the conversation earlier: {summary}"))
+
+    def prompt_tokens(self, state: dict, history_key: str = "default") -> int:
+        """
+        Tokens of the prompt. history_key identifies the conversation (e.g. the thread_id), so only its new messages
+        are counted (see CachedTokenTrimmer.prefix_sums).
+        """
+        prefix = self.counter.prefix_sums(state["messages"], history_key)
+        return self.summary_tokens(state.get("summary", "")) + prefix[-1] + REPLY_PRIMING_TOKENS
+
+    def record_turn(self, thread_id: str, state: dict) -> TurnReport:
+        with self._reports_lock:
+            removed = self._removed_tokens.get(thread_id, 0)
+        report = TurnReport(thread_id=thread_id, prompt_tokens=self.prompt_tokens(state, thread_id),
+                            tokens_saved=removed - self.summary_tokens(state.get("summary", "")) if removed else 0)
+        with self._reports_lock:
+            self.reports.append(report)
+        return report
+
+    def record_summary(self, thread_id: str, tokens: int, removed_tokens: int):
+        """
+        Adds the summarizer tokens to the last turn of the thread (other threads may have reported turns since),
+        and the tokens of the removed messages to the savings of the next turns.
+        """
+        with self._reports_lock:
+            report = next((report for report in reversed(self.reports) if report.thread_id == thread_id), None)
+            if report is not None:
+                report.summarizer_tokens += tokens
+                report.tokens_saved -= tokens
+
+            self._removed_tokens[thread_id] = self._removed_tokens.pop(thread_id, 0) + removed_tokens
+            if len(self._removed_tokens) > self._max_threads:
+                self._removed_tokens.popitem(last=False)
+
+    # 2. Planning the summary (same interface of the policies of background_summarization.py)
+
+    def plan(self, state: dict, history_key: str = "default") -> Optional[SummaryPlan]:
+        messages = state["messages"]
+        prefix = self.counter.prefix_sums(messages, history_key)
+        total = self.summary_tokens(state.get("summary", "")) + prefix[-1] + REPLY_PRIMING_TOKENS
+        if total <= self.trigger_tokens or len(messages) <= self.keep_last:
+            return None
+
+        # The oldest messages are removed until the prompt fits the target (the new summary is not counted yet):
+        # the first cut whose removed tokens prefix[cut] reach total - target
+        cut = min(bisect_left(prefix, total - self.target_tokens), len(messages) - self.keep_last)
+        # A tool result can't be the first message kept, without the AI message that called the tool
+        while cut < len(messages) - 1 and isinstance(messages[cut], ToolMessage):
+            cut += 1
+        if cut == 0:
+            return None
+
+        # The messages of the previous summaries were deleted with them, so all of these are new to the summarizer
+        to_delete = list(messages[:cut])
+        return SummaryPlan(to_summarize=to_delete, to_delete=to_delete)
+
+    def removed_tokens(self, state: dict, plan: SummaryPlan, history_key: str = "default") -> int:
+        # The plan deletes a prefix of the messages, whose tokens are in the prefix sums of the plan
+        return self.counter.prefix_sums(state["messages"], history_key)[len(plan.to_delete)]
+
+    def summarizer_tokens(self, plan: SummaryPlan, summary: str) -> int:
+        return self.counter.count_tokens(plan.to_summarize + [HumanMessage(content=build_summary_prompt(summary))])
+
+
+# 3. The graph of simple_chat_with_summarization.py with the policy
+
+def create_graph(policy: TokenBudgetPolicy, checkpointer=None):
+    def chat_node(state: StateSum, config: RunnableConfig):
+        policy.record_turn(config["configurable"].get("thread_id", ""), state)
+        return chat_node_with_summary(state)
+
+    def summarize_conversation(state: StateSum, config: RunnableConfig):
+        thread_id = config["configurable"].get("thread_id", "")
+        # Same messages of the conditional edge: the prefix sums of the thread are reused, nothing is counted again
+        plan = policy.plan(state, thread_id)
+        summary = state.get("summary", "")
+        policy.record_summary(thread_id, policy.summarizer_tokens(plan, summary), policy.removed_tokens(state, plan, thread_id))
+
+        if plan.to_summarize:
+            response = summarization.chat_model.invoke(
+                input=plan.to_summarize + [HumanMessage(content=build_summary_prompt(summary))])
+            summary = response.content
+
+        return {"summary": summary, "messages": [RemoveMessage(id=msg.id) for msg in plan.to_delete],
+                **plan.extra_update}
+
+    def summarization_conditional_edge(state: StateSum, config: RunnableConfig):
+        return "summarization node" if policy.plan(state, config["configurable"].get("thread_id", "")) is not None else END
+
+    graph = StateGraph(StateSum)
+    graph.add_node("chat node", chat_node)
+    graph.add_node("summarization node", summarize_conversation)
+    graph.add_edge(START, "chat node")
+    graph.add_conditional_edges(source="chat node", path=summarization_conditional_edge)
+    graph.add_edge("summarization node", END)
+
+    return graph.compile(checkpointer=checkpointer)
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langgraph.checkpoint.memory import MemorySaver
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+    from fake_chat_model import FakeChatModel
+
+    # Short answers, with a few long ones (as tool outputs pasted in the chat)
+    long_answer = "Os dinossauros viveram na era Mesozoica. " * 60
+    summarization.chat_model = FakeChatModel(replies=["Resposta curta.", "Resposta curta.", long_answer, "Resposta curta."])
+    questions = [f"Pergunta {i} sobre dinossauros?" for i in range(40)]
+
+    # Input tokens of all the model calls (answers and summaries), with the same cached counter
+    class TokenMeter(BaseCallbackHandler):
+        def __init__(self, counter: CachedTokenTrimmer):
+            self.counter = counter
+            self.calls = 0
+            self.tokens = 0
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.calls += 1
+            self.tokens += self.counter.count_tokens(messages[0])
+
+    policy = TokenBudgetPolicy(context_budget=1500)
+    setups = [("len(messages) > 6", summarization.create_graph()),
+              ("token budget", create_graph(policy, checkpointer=MemorySaver()))]
+
+    input_tokens = {}
+    for label, graph in setups:
+        meter = TokenMeter(policy.counter)
+        config = {"configurable": {"thread_id": label}, "callbacks": [meter]}
+        for question in questions:
+            graph.invoke({"messages": [HumanMessage(content=question, name="Marianna")]}, config)
+        input_tokens[label] = meter.tokens
+        print(f"{label:<18} | model calls: {meter.calls:>3} | model input tokens: {meter.tokens:>7}")
+
+    # The savings are measured against the policy in use, counting the answers and the summaries
+    baseline, budget = input_tokens["len(messages) > 6"], input_tokens["token budget"]
+    reports = list(policy.reports)
+    print(f"\nToken budget: max prompt {max(r.prompt_tokens for r in reports)} tokens (budget {policy.context_budget}), "
+          f"{baseline - budget} input tokens saved against len(messages) > 6 ({100 * (baseline - budget) / baseline:.1f}%)")
+    print("Prompt tokens per turn:", [r.prompt_tokens for r in reports])
+    print("Summarizer tokens per turn:", [r.summarizer_tokens for r in reports])
+    print("Tokens saved per turn:", [r.tokens_saved for r in reports])
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Literal, Optional
+
+import tiktoken
+from langchain_core.messages import AnyMessage, HumanMessage, AIMessage
+
+# Incremental token counting for trimming long conversations.
+# trim_messages with a ChatOpenAI token counter re-tokenizes the whole history at each turn.
+# Here, each message is tokenized only once (its count is cached by id and content hash), and the
+# cut point for max_tokens is found by a binary search over the prefix sums of the message counts.
+
+logger = logging.getLogger(__name__)
+
+# The same constants used by ChatOpenAI.get_num_tokens_from_messages for the gpt-3.5-turbo/gpt-4 models
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3
+
+# A single tokenizer for the whole process. Loading the encoding is the slowest part of counting tokens.
+_ENCODINGS = {}
+
+
+class ApproximateEncoding:
+    """
+    Fallback when the tiktoken encoding can't be loaded (it's downloaded on the first use, so it fails offline).
+    A token is ~4 characters of English text; the "tokens" are the 4 characters slices, so decode(encode(text)) works.
+    """
+
+    name = "approximate"
+
+    def encode(self, text: str) -> list[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens: list[str]) -> str:
+        return "".join(tokens)
+
+
+def get_encoding(model_name: str = "gpt-3.5-turbo"):
+    if model_name not in _ENCODINGS:
+        try:
+            try:
+                _ENCODINGS[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                _ENCODINGS[model_name] = tiktoken.get_encoding("cl100k_base")
+        except Exception as error:
+            logger.warning("Tokenizer of %s not available (%r), counting tokens approximately", model_name, error)
+            _ENCODINGS[model_name] = ApproximateEncoding()
+    return _ENCODINGS[model_name]
+
+
+def message_key(message: AnyMessage) -> tuple:
+    """
+    Key of the token count cache: the message id plus a hash of what is tokenized.
+    So, a message overwritten with the same id (add_messages trick) is counted again.
+    """
+    digest = hashlib.blake2b(f"{message.type}\x00{message.name or ''}\x00{message.content}".encode(), digest_size=16).digest()
+    return (message.id, digest)
+
+
+def light_key(message: AnyMessage) -> tuple:
+    """
+    Key of the prefix sums: the message id plus the content length, so comparing a history with the previous one
+    doesn't read the contents. An edit that keeps the id and the exact length is not noticed.
+    """
+    content = message.content
+    return (message.id, message.type, message.name, len(content) if isinstance(content, str) else message_key(message)[1])
+
+
+class CachedTokenTrimmer:
+    """
+    Trims a list of messages to a max number of tokens, like trim_messages, counting only the new messages at each call.
+
+    Args:
+        max_tokens: the max number of tokens of the trimmed list (including the reply priming tokens).
+        strategy: "last" keeps the most recent messages, "first" keeps the oldest ones.
+        allow_partial: if True, the message in the cut point is partially kept, up to the remaining tokens.
+        model_name: the model whose tokenizer is used to count the tokens.
+        max_cached_messages: max number of message counts kept in the cache.
+        max_histories: max number of conversations (history keys) whose prefix sums are kept.
+    """
+
+    def __init__(self, max_tokens: int, strategy: Literal["first", "last"] = "last", allow_partial: bool = False,
+                 model_name: str = "gpt-3.5-turbo", max_cached_messages: int = 100_000, max_histories: int = 1_000):
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.allow_partial = allow_partial
+        self.model_name = model_name
+        self._encoding = None
+        self.max_cached_messages = max_cached_messages
+        self.max_histories = max_histories
+
+        self._counts: dict[tuple, int] = {}
+        # history key -> (message keys, prefix sums), where prefix[i] is the number of tokens of messages[:i]
+        self._histories: OrderedDict[str, tuple[list, list]] = OrderedDict()
+        self.tokenized_messages = 0
+
+    @property
+    def encoding(self):
+        # Loaded on the first count, so creating a trimmer at import time doesn't load (or download) the tokenizer
+        if self._encoding is None:
+            self._encoding = get_encoding(self.model_name)
+        return self._encoding
+
+    # 1. Counting
+
+    def count_message(self, message: AnyMessage, key: Optional[tuple] = None) -> int:
+        key = key or message_key(message)
+        if (count := self._counts.get(key)) is not None:
+            return count
+
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        count = TOKENS_PER_MESSAGE + len(self.encoding.encode(content))
+        if message.name:
+            count += TOKENS_PER_NAME + len(self.encoding.encode(message.name))
+
+        if len(self._counts) >= self.max_cached_messages:
+            self._counts.clear()
+        self._counts[key] = count
+        self.tokenized_messages += 1
+
+        return count
+
+    def count_tokens(self, messages: list[AnyMessage]) -> int:
+        """
+        Token counter with the trim_messages signature. It can be used as trim_messages(..., token_counter=trimmer.count_tokens).
+        """
+        return sum(self.count_message(msg) for msg in messages) + REPLY_PRIMING_TOKENS
+
+    def prefix_sums(self, messages: list[AnyMessage], history_key: str) -> list[int]:
+        """
+        Returns the prefix sums of the message counts (prefix[i] is the number of tokens of messages[:i]), reusing the
+        ones of the previous call with the same history_key for the unchanged messages.
+        """
+        keys = [light_key(msg) for msg in messages]
+        old_keys, prefix = self._histories.pop(history_key, ([], [0]))
+
+        # Usual case: the previous history plus new messages (a single list comparison, without reading the contents)
+        if len(keys) >= len(old_keys) and keys[:len(old_keys)] == old_keys:
+            common = len(old_keys)
+        else:
+            common = 0
+            for old, new in zip(old_keys, keys):
+                if old != new:
+                    break
+                common += 1
+            del prefix[common + 1:]
+
+        # Only the messages after the first difference with the previous call are hashed and (re)counted
+        for msg in messages[common:]:
+            prefix.append(prefix[-1] + self.count_message(msg))
+
+        self._histories[history_key] = (keys, prefix)
+        if len(self._histories) > self.max_histories:
+            self._histories.popitem(last=False)
+
+        return prefix
+
+    # 2. Trimming
+
+    def _partial(self, message: AnyMessage, budget: int, keep_end: bool) -> Optional[AnyMessage]:
+        budget -= TOKENS_PER_MESSAGE + (TOKENS_PER_NAME + len(self.encoding.encode(message.name)) if message.name else 0)
+        if budget <= 0 or not isinstance(message.content, str):
+            return None
+
+        tokens = self.encoding.encode(message.content)
+        tokens = tokens[-budget:] if keep_end else tokens[:budget]
+        # model_copy in pydantic v2 based langchain versions, copy in the pydantic v1 ones
+        copy = getattr(message, "model_copy", None) or message.copy
+        return copy(update={"content": self.encoding.decode(tokens)})
+
+    def trim(self, messages: list[AnyMessage], history_key: str = "default") -> list[AnyMessage]:
+        """
+        Returns the messages that fit in max_tokens, following the trimmer strategy.
+
+        Args:
+            messages: the conversation history.
+            history_key: identifies the conversation (e.g. the thread_id), so its prefix sums can be reused in the next turn.
+        """
+        prefix = self.prefix_sums(messages, history_key)
+        budget = self.max_tokens - REPLY_PRIMING_TOKENS
+        if budget <= 0:
+            # Not even the reply priming tokens fit
+            return []
+
+        if self.strategy == "last":
+            # First index i whose suffix messages[i:] fits in the budget
+            start = bisect_left(prefix, prefix[-1] - budget)
+            trimmed = list(messages[start:])
+            if self.allow_partial and start > 0:
+                partial = self._partial(messages[start - 1], budget - (prefix[-1] - prefix[start]), keep_end=True)
+                trimmed = ([partial] if partial else []) + trimmed
+        else:
+            # Last index j whose prefix messages[:j] fits in the budget
+            end = bisect_right(prefix, budget) - 1
+            trimmed = list(messages[:end])
+            if self.allow_partial and end < len(messages):
+                partial = self._partial(messages[end], budget - prefix[end], keep_end=False)
+                trimmed = trimmed + ([partial] if partial else [])
+
+        return trimmed
+
+
+if __name__ == "__main__":
+    import time
+    from langchain_core.messages import trim_messages
+
+    trimmer = CachedTokenTrimmer(max_tokens=200, strategy="last")
+    history = []
+
+    start = time.perf_counter()
+    for turn in range(500):
+        history.append(HumanMessage(content=f"Pergunta número {turn} sobre alimentação de gatos.", name="Marianna", id=f"h{turn}"))
+        history.append(AIMessage(content=f"Resposta número {turn}: gatos precisam de proteína animal.", name="Model", id=f"a{turn}"))
+        trimmed = trimmer.trim(history)
+    print(f"Cached trimmer: {time.perf_counter() - start:.3f}s, tokenized messages: {trimmer.tokenized_messages}")
+
+    # trim_messages re-counting the whole history at each turn, with the same tokenizer
+    uncached = CachedTokenTrimmer(max_tokens=200, max_cached_messages=0)
+    start = time.perf_counter()
+    for turn in range(2, len(history) + 1, 2):
+        trimmed_reference = trim_messages(history[:turn], max_tokens=200, strategy="last",
+                                          token_counter=lambda msgs: sum(uncached.count_message(m) for m in msgs) + REPLY_PRIMING_TOKENS)
+    print(f"trim_messages: {time.perf_counter() - start:.3f}s")
+
+    print("Same result:", [m.id for m in trimmed] == [m.id for m in trimmed_reference])